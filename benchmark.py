@@ -0,0 +1,916 @@
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Micro-benchmarks for the data pipeline and the detection layers.
+
+Run one suite with e.g.
+
+  python benchmark.py --suite roidb --num_images 1000000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark the Faster R-CNN pipeline')
+  parser.add_argument('--suite', dest='suite',
+                      help='benchmark suite to run',
+                      choices=sorted(SUITES), required=True, type=str)
+  parser.add_argument('--num_images', dest='num_images',
+                      help='number of synthetic roidb entries',
+                      default=1000000, type=int)
+  parser.add_argument('--legacy', dest='legacy',
+                      help='also time the previous implementations',
+                      action='store_true')
+  parser.add_argument('--image_dir', dest='image_dir',
+                      help='directory of sample images',
+                      default='images', type=str)
+  parser.add_argument('--target_size', dest='target_size',
+                      help='shorter side to decode the images for',
+                      default=600, type=int)
+  parser.add_argument('--repeat', dest='repeat',
+                      help='number of timed repetitions',
+                      default=20, type=int)
+  parser.add_argument('--nw', dest='num_workers',
+                      help='comma separated numbers of data loader workers',
+                      default='1,2,4,8', type=str)
+  parser.add_argument('--seed', dest='seed',
+                      help='random seed of the synthetic data',
+                      default=3, type=int)
+
+  args = parser.parse_args()
+  return args
+
+
+class Timer(object):
+  """Prints the wall time of a block."""
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc):
+    self.elapsed = time.time() - self.start
+    print('{:<40s} {:10.3f}s'.format(self.name, self.elapsed))
+
+
+def synthetic_roidb(num_images, num_classes=21, empty_frac=0.01, seed=3,
+                    crowd_frac=0., images=None):
+  """A prepared list-of-dicts roidb with random images and boxes.
+
+  A crowd_frac of the boxes get the all -1 gt_overlaps row of COCO
+  ''iscrowd'' boxes; images, if given, are cycled through as image paths.
+  """
+  rng = np.random.RandomState(seed)
+  num_boxes = rng.randint(1, 8, size=num_images)
+  num_boxes[rng.rand(num_images) < empty_frac] = 0
+  widths = rng.randint(200, 1000, size=num_images)
+  heights = rng.randint(200, 1000, size=num_images)
+  # the boxes of all images are drawn at once, every image gets its own copy
+  offsets = np.concatenate(([0], np.cumsum(num_boxes)))
+  total = offsets[-1]
+  xy = rng.randint(0, 100, size=(total, 2))
+  all_boxes = np.hstack((xy, xy + rng.randint(1, 100, size=(total, 2)))).astype(np.uint16)
+  all_classes = rng.randint(1, num_classes, size=total).astype(np.int32)
+  crowd = rng.rand(total) < crowd_frac
+  roidb = []
+  for i in range(num_images):
+    n = num_boxes[i]
+    boxes = all_boxes[offsets[i]:offsets[i + 1]].copy()
+    gt_classes = all_classes[offsets[i]:offsets[i + 1]].copy()
+    if crowd_frac > 0:
+      overlaps = np.zeros((n, num_classes), dtype=np.float32)
+      overlaps[np.arange(n), gt_classes] = 1.0
+      overlaps[crowd[offsets[i]:offsets[i + 1]]] = -1.0
+      gt_overlaps = scipy.sparse.csr_matrix(overlaps)
+    else:
+      # one entry per row, built from its CSR arrays without a COO pass
+      gt_overlaps = scipy.sparse.csr_matrix(
+        (np.ones(n, dtype=np.float32), gt_classes, np.arange(n + 1)),
+        shape=(n, num_classes))
+    roidb.append({'boxes': boxes,
+                  'gt_classes': gt_classes,
+                  'gt_overlaps': gt_overlaps,
+                  'seg_areas': np.ones(n, dtype=np.float32),
+                  'flipped': False,
+                  'width': int(widths[i]),
+                  'height': int(heights[i]),
+                  'image': images[i % len(images)] if images else
+                           '/data/images/{:08d}.jpg'.format(i),
+                  'img_id': i})
+  return roidb
+
+
+def _legacy_filter_roidb(roidb):
+  i = 0
+  while i < len(roidb):
+    if len(roidb[i]['boxes']) == 0:
+      del roidb[i]
+      i -= 1
+    i += 1
+  return roidb
+
+
+def _legacy_rank_roidb_ratio(roidb):
+  ratio_list = []
+  for i in range(len(roidb)):
+    ratio = roidb[i]['width'] / float(roidb[i]['height'])
+    if ratio > 2:
+      roidb[i]['need_crop'] = 1
+      ratio = 2
+    elif ratio < 0.5:
+      roidb[i]['need_crop'] = 1
+      ratio = 0.5
+    else:
+      roidb[i]['need_crop'] = 0
+    ratio_list.append(ratio)
+  ratio_list = np.array(ratio_list)
+  ratio_index = np.argsort(ratio_list)
+  return ratio_list[ratio_index], ratio_index
+
+
+def bench_roidb(args):
+  """Startup cost of filtering and ranking a synthetic roidb."""
+  from roi_data_layer.roidb import filter_roidb, rank_roidb_ratio
+  from roi_data_layer.columnar_roidb import ColumnarRoidb
+
+  with Timer('build synthetic roidb ({:d})'.format(args.num_images)):
+    roidb = synthetic_roidb(args.num_images, seed=args.seed)
+
+  if args.legacy:
+    with Timer('legacy filter_roidb'):
+      legacy = _legacy_filter_roidb(list(roidb))
+    with Timer('legacy rank_roidb_ratio'):
+      _legacy_rank_roidb_ratio(legacy)
+
+  with Timer('list filter_roidb'):
+    filtered = filter_roidb(list(roidb))
+  with Timer('list rank_roidb_ratio'):
+    rank_roidb_ratio(filtered)
+
+  with Timer('ColumnarRoidb.from_roidb'):
+    columnar = ColumnarRoidb.from_roidb(roidb)
+  with Timer('columnar filter_roidb'):
+    columnar = filter_roidb(columnar)
+  with Timer('columnar rank_roidb_ratio'):
+    rank_roidb_ratio(columnar)
+
+
+def bench_decode(args):
+  """Decode time of every image backend on the sample images."""
+  import glob
+  import os
+  from model.utils.image_decode import BACKENDS, BACKEND, decode_image, \
+    decode_image_for_scale
+
+  paths = sorted(glob.glob(os.path.join(args.image_dir, '*.jpg')) +
+                 glob.glob(os.path.join(args.image_dir, '*.png')))
+  print('{:d} images, default backend: {}'.format(len(paths), BACKEND))
+
+  def per_image(name, fn):
+    start = time.time()
+    for _ in range(args.repeat):
+      for path in paths:
+        fn(path)
+    elapsed = (time.time() - start) / (args.repeat * len(paths))
+    print('{:<40s} {:10.3f}ms'.format(name, elapsed * 1e3))
+
+  for backend in BACKENDS:
+    try:
+      decode_image(paths[0], backend)
+    except Exception as e:
+      print('{:<40s} unavailable ({})'.format(backend, e))
+      continue
+    per_image('{} full decode'.format(backend),
+              lambda path: decode_image(path, backend))
+    per_image('{} decode at {:d}'.format(backend, args.target_size),
+              lambda path: decode_image_for_scale(path, args.target_size,
+                                                  args.target_size * 2, backend))
+
+
+def _memory_stats():
+  """(rss, private) memory of this process in MB, from smaps_rollup."""
+  stats = {}
+  with open('/proc/self/smaps_rollup') as f:
+    for line in f:
+      fields = line.split()
+      if len(fields) == 3 and fields[2] == 'kB':
+        stats[fields[0].rstrip(':')] = int(fields[1]) / 1024.
+  return stats['Rss'], stats['Private_Clean'] + stats['Private_Dirty']
+
+
+class _TouchRoidb(object):
+  """Dataset whose every item reads all entries of a roidb, like an epoch."""
+
+  def __init__(self, roidb, num_items):
+    self.roidb = roidb
+    self.num_items = num_items
+
+  def __len__(self):
+    return self.num_items
+
+  def __getitem__(self, index):
+    num_boxes = 0
+    for i in range(len(self.roidb)):
+      entry = self.roidb[i]
+      num_boxes += len(entry['boxes']) + int(entry['need_crop'])
+    return _memory_stats()
+
+
+def bench_memory(args):
+  """Per-worker memory of DataLoader workers reading the whole roidb."""
+  import torch.utils.data
+  from roi_data_layer.columnar_roidb import ColumnarRoidb
+  from roi_data_layer.roidb import rank_roidb_ratio
+
+  roidb = synthetic_roidb(args.num_images, seed=args.seed)
+  rank_roidb_ratio(roidb)
+  for r in roidb:
+    # the dataset does not read the sparse overlaps
+    del r['gt_overlaps']
+  columnar = ColumnarRoidb.from_roidb([dict(r, gt_overlaps=np.zeros((len(r['boxes']), 1)))
+                                       for r in roidb])
+  rank_roidb_ratio(columnar)
+  variants = [('list of dicts', roidb),
+              ('columnar, in memory', columnar),
+              ('columnar, shared', columnar.share())]
+
+  print('{:<24s} {:>4s} {:>14s} {:>14s}'.format('roidb', 'nw', 'worker RSS MB',
+                                                'private MB'))
+  for name, db in variants:
+    for num_workers in [int(n) for n in args.num_workers.split(',')]:
+      loader = torch.utils.data.DataLoader(_TouchRoidb(db, num_workers), batch_size=None,
+                                           num_workers=num_workers)
+      stats = np.array(list(loader))
+      print('{:<24s} {:>4d} {:>14.1f} {:>14.1f}'.format(
+        name, num_workers, stats[:, 0].mean(), stats[:, 1].mean()))
+
+
+def _legacy_gt_inds(entry):
+  # the crowd filter of get_minibatch before the stats were precomputed
+  gt_inds = np.where((entry['gt_classes'] != 0) &
+                     np.all(entry['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+  return gt_inds
+
+
+class _GtBoxes(object):
+  """Dataset building only the gt boxes blob of get_minibatch."""
+
+  def __init__(self, roidb, legacy):
+    self.roidb = roidb
+    self.legacy = legacy
+
+  def __len__(self):
+    return len(self.roidb)
+
+  def __getitem__(self, index):
+    entry = self.roidb[index]
+    if self.legacy:
+      gt_inds = _legacy_gt_inds(entry)
+    else:
+      gt_inds = np.where((entry['gt_classes'] != 0) & ~entry['gt_crowd'])[0]
+    gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
+    gt_boxes[:, 0:4] = entry['boxes'][gt_inds, :]
+    gt_boxes[:, 4] = entry['gt_classes'][gt_inds]
+    return len(gt_boxes)
+
+
+def bench_loader(args):
+  """Loader throughput on a COCO-like roidb with crowd boxes.
+
+  Times the gt box path alone, before (densified gt_overlaps per sample)
+  and after (precomputed crowd mask), then the whole roibatchLoader on
+  the sample images of --image_dir.
+  """
+  import glob
+  import os
+  import torch.utils.data
+  from datasets.gt_stats import get_gt_stats
+  from model.utils.config import cfg
+  from roi_data_layer.columnar_roidb import ColumnarRoidb
+  from roi_data_layer.roibatchLoader import roibatchLoader
+  from roi_data_layer.roidb import rank_roidb_ratio
+
+  images = sorted(glob.glob(os.path.join(args.image_dir, '*.jpg')))
+  roidb = synthetic_roidb(args.num_images, num_classes=81, seed=args.seed,
+                          crowd_frac=0.01, images=images)
+  roidb = [r for r in roidb if len(r['boxes']) > 0]
+  with Timer('ColumnarRoidb.from_roidb'):
+    columnar = ColumnarRoidb.from_roidb(roidb)
+  ratio_list, ratio_index = rank_roidb_ratio(columnar)
+  columnar = columnar.share()
+
+  def throughput(name, dataset, num_workers, batch_size=None, **kwargs):
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size,
+                                         num_workers=num_workers, **kwargs)
+    start = time.time()
+    num_samples = 0
+    for batch in loader:
+      num_samples += 1 if batch_size is None else batch_size
+    elapsed = time.time() - start
+    print('{:<40s} {:>4d} {:12.1f} samples/s'.format(name, num_workers,
+                                                     num_samples / elapsed))
+
+  with Timer('get_gt_stats'):
+    stats = get_gt_stats(roidb)
+  # what prepare_roidb attaches to the entries
+  prepared = [dict(r, max_overlaps=max_overlaps, max_classes=max_classes, gt_crowd=crowd)
+              for r, max_overlaps, max_classes, crowd in zip(roidb, *stats)]
+  for num_workers in [int(n) for n in args.num_workers.split(',')]:
+    throughput('gt boxes, densified overlaps', _GtBoxes(roidb, True), num_workers)
+    throughput('gt boxes, list, crowd mask', _GtBoxes(prepared, False), num_workers)
+    throughput('gt boxes, columnar, crowd mask', _GtBoxes(columnar, False), num_workers)
+
+  if not images:
+    print('no images in {}, skipping the full loader'.format(args.image_dir))
+    return
+  cfg.TRAIN.USE_ALL_GT = False
+  subset = columnar.select(np.arange(min(len(columnar), args.repeat * 16)))
+  ratio_list, ratio_index = rank_roidb_ratio(subset)
+  dataset = roibatchLoader(subset, ratio_list, ratio_index, 1, 81, training=True)
+  for num_workers in [int(n) for n in args.num_workers.split(',')]:
+    throughput('roibatchLoader', dataset, num_workers, batch_size=1,
+               collate_fn=dataset.collate_fn)
+
+
+def synthetic_proposals(num_boxes, seed=3):
+  """(N, 5) float32 dets sorted by decreasing score, clustered around a
+  few objects like RPN proposals."""
+  rng = np.random.RandomState(seed)
+  objects = rng.rand(num_boxes // 20 + 1, 4) * [600, 400, 200, 200]
+  boxes = objects[rng.randint(0, len(objects), num_boxes)] + rng.randn(num_boxes, 4) * 10
+  boxes[:, 2:] = boxes[:, :2] + np.abs(boxes[:, 2:]) + 8
+  scores = rng.rand(num_boxes)
+  order = np.argsort(-scores, kind='mergesort')
+  return np.hstack((boxes[order], scores[order, np.newaxis])).astype(np.float32)
+
+
+def bench_nms(args):
+  """CPU and GPU NMS on RPN-like proposals, checking the keep lists agree,
+  and the Soft-NMS and Matrix-NMS modes."""
+  import torch
+  from model.nms import nms_cpu
+  from model.nms.nms_wrapper import nms_gpu, soft_nms, SOFT_NMS_MODES
+  from model.utils.config import cfg
+
+  def timed(fn):
+    fn()
+    start = time.time()
+    for _ in range(args.repeat):
+      keep = fn()
+    if torch.cuda.is_available():
+      torch.cuda.synchronize()
+    return keep, (time.time() - start) / args.repeat
+
+  for num_boxes in (300, 6000, 12000):
+    dets = torch.from_numpy(synthetic_proposals(num_boxes, args.seed))
+    backends = [('torch blocks', lambda: nms_cpu._nms_blocked(dets[:, :4].contiguous(), 0.7))]
+    if nms_cpu.cpu_nms is not None:
+      backends.append(('cython loop', lambda: torch.from_numpy(
+        nms_cpu.cpu_nms(dets[:, :4].contiguous().numpy(), 0.7))))
+    if nms_gpu is not None and torch.cuda.is_available():
+      dets_cuda = dets.cuda()
+      backends.append(('gpu', lambda: nms_gpu(dets_cuda, 0.7).view(-1).cpu()))
+
+    reference = None
+    for name, fn in backends:
+      keep, elapsed = timed(fn)
+      keep = keep.long().view(-1)
+      if reference is None:
+        reference = keep
+      print('{:<24s} N={:<6d} {:10.3f}ms  kept {:5d}  {}'.format(
+        name, num_boxes, elapsed * 1e3, keep.numel(),
+        'same' if torch.equal(keep, reference) else 'DIFFERENT'))
+
+    for mode in sorted(SOFT_NMS_MODES):
+      scores, elapsed = timed(lambda: soft_nms(dets, 0.7, mode))
+      print('{:<24s} N={:<6d} {:10.3f}ms  kept {:5d}'.format(
+        mode, num_boxes, elapsed * 1e3, int((scores >= cfg.TEST.NMS_MIN_SCORE).sum())))
+
+
+def _peak_memory_mb(fn):
+  """Peak memory increase of fn() in MB: CUDA allocations if it runs on a
+  GPU, else the growth of the peak RSS, reset through /proc (Linux)."""
+  import ctypes
+  import torch
+
+  if torch.cuda.is_available():
+    torch.cuda.synchronize()
+    # pytorch 0.4 cannot reset the peak, which then only grows over the runs
+    reset = getattr(torch.cuda, 'reset_peak_memory_stats',
+                    getattr(torch.cuda, 'reset_max_memory_allocated', None))
+    if reset is not None:
+      reset()
+    base = torch.cuda.memory_allocated()
+    fn()
+    torch.cuda.synchronize()
+    return (torch.cuda.max_memory_allocated() - base) / 2.**20
+
+  def status_kb(key):
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith(key):
+          return int(line.split()[1])
+
+  # give the freed heap back first, so that fn() has to grow the RSS
+  ctypes.CDLL('libc.so.6').malloc_trim(0)
+  with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+  base = status_kb('VmRSS')
+  fn()
+  return (status_kb('VmHWM') - base) / 1024.
+
+
+def _legacy_class_nms(boxes, scores, thresh, nms_thresh, max_per_image):
+  """The per-class loop and the max_per_image cut of test_net.py before
+  multiclass_nms(), on the (R, 4 * C) boxes and (R, C) scores of one image."""
+  import torch
+  from model.nms.nms_wrapper import nms
+
+  dets = [np.zeros((0, 5), dtype=np.float32)]
+  for j in range(1, scores.size(1)):
+    inds = torch.nonzero(scores[:, j] > thresh).view(-1)
+    cls_dets = np.zeros((0, 5), dtype=np.float32)
+    if inds.numel() > 0:
+      cls_scores = scores[:, j][inds]
+      _, order = torch.sort(cls_scores, 0, True)
+      cls_boxes = boxes[inds][:, j * 4:(j + 1) * 4]
+      cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1)), 1)[order]
+      keep = nms(cls_dets, nms_thresh)
+      cls_dets = cls_dets[keep.view(-1).long()].cpu().numpy()
+    dets.append(cls_dets)
+  if max_per_image > 0:
+    image_scores = np.hstack([d[:, -1] for d in dets[1:]])
+    if len(image_scores) > max_per_image:
+      image_thresh = np.sort(image_scores)[-max_per_image]
+      dets = [d[d[:, -1] >= image_thresh] for d in dets]
+  return dets
+
+
+def synthetic_detections(num_rois, num_classes, seed):
+  """(1, R, 4 * C) per-class boxes around a few objects and (1, R, C)
+  softmax scores, like the output of the detection head."""
+  import torch
+
+  rng = np.random.RandomState(seed)
+  objects = rng.rand(num_rois // 20 + 1, 4) * [600, 400, 200, 200]
+  boxes = objects[rng.randint(0, len(objects), num_rois)][:, np.newaxis] + \
+          rng.randn(num_rois, num_classes, 4) * 10
+  boxes[:, :, 2:] = boxes[:, :, :2] + np.abs(boxes[:, :, 2:]) + 8
+  logits = rng.randn(num_rois, num_classes) * 3
+  scores = np.exp(logits) / np.exp(logits).sum(1, keepdims=True)
+  return (torch.from_numpy(boxes.reshape(1, num_rois, -1).astype(np.float32)),
+          torch.from_numpy(scores[np.newaxis].astype(np.float32)))
+
+
+def bench_multiclass_nms(args):
+  """multiclass_nms() at the test_net.py defaults (score thresh 0, 100
+  detections per image, 300 rois) for VOC and COCO class counts, with
+  cfg.TEST.NMS_MAX_BOXES chunks and as one call; with --legacy also the
+  per-class loop, whose detections must match."""
+  import torch
+  from model.nms.multiclass_nms import multiclass_nms
+  from model.utils.config import cfg
+
+  device = 'cuda' if torch.cuda.is_available() else 'cpu'
+  max_boxes = cfg.TEST.NMS_MAX_BOXES
+  for num_classes in (21, 81):
+    boxes, scores = [t.to(device) for t in synthetic_detections(300, num_classes, args.seed)]
+    runs = [('chunks of {:d}'.format(max_boxes), max_boxes), ('one call', 0)]
+    if args.legacy:
+      runs.append(('per-class loop', None))
+    reference = None
+    for name, limit in runs:
+      if limit is None:
+        run = lambda: _legacy_class_nms(boxes[0], scores[0], 0., cfg.TEST.NMS, 100)
+      else:
+        def run():
+          cfg.TEST.NMS_MAX_BOXES = limit
+          return [d.numpy() for d in multiclass_nms(boxes, scores, cfg.TEST.NMS, score_thresh=0.,
+                                                    max_per_image=100, out_device='cpu')[0][0]]
+      run()
+      start = time.time()
+      for _ in range(args.repeat):
+        dets = run()
+      if device == 'cuda':
+        torch.cuda.synchronize()
+      elapsed = (time.time() - start) / args.repeat
+      peak = _peak_memory_mb(run)
+      if reference is None:
+        reference = dets
+      same = all(np.array_equal(a, b) for a, b in zip(dets, reference))
+      print('C={:<3d} {:<16s} {:10.3f}ms  peak {:7.1f}MB  dets {:4d}  {}'.format(
+        num_classes, name, elapsed * 1e3, peak, sum(len(d) for d in dets),
+        'same' if same else 'DIFFERENT'))
+    cfg.TEST.NMS_MAX_BOXES = max_boxes
+
+
+def bench_overlaps(args):
+  """Dense and sparse anchor/gt overlaps of the anchor target layer over
+  image sizes and gt counts, with COCO-style anchor scales."""
+  import torch
+  from model.rpn.anchor_grid import grid_anchors, inside_anchor_inds
+  from model.rpn.anchor_overlaps import sparse_anchor_overlaps
+  from model.rpn.bbox_transform import bbox_overlaps_batch
+
+  device = 'cuda' if torch.cuda.is_available() else 'cpu'
+  scales, ratios, stride = np.array([4, 8, 16, 32]), np.array([0.5, 1, 2]), 16
+  rng = np.random.RandomState(args.seed)
+
+  def dense(anchors, gt_boxes):
+    overlaps = bbox_overlaps_batch(anchors, gt_boxes)
+    max_overlaps, argmax_overlaps = torch.max(overlaps, 2)
+    gt_max_overlaps, _ = torch.max(overlaps, 1)
+    target = gt_max_overlaps.clone()
+    target[target == 0] = 1e-5
+    keep = torch.sum(overlaps.eq(target.view(gt_boxes.size(0), 1, -1).expand_as(overlaps)), 2)
+    return max_overlaps, argmax_overlaps, gt_max_overlaps, keep
+
+  print('{:>11s} {:>4s} {:>8s} {:>11s} {:>11s} {:>10s} {:>10s}  {}'.format(
+    'image', 'gt', 'anchors', 'dense ms', 'sparse ms', 'dense MB', 'sparse MB', 'outputs'))
+  for short_side in (600, 800, 1000):
+    im_height, im_width = short_side, short_side * 5 // 3
+    feat_height, feat_width = im_height // stride, im_width // stride
+    all_anchors = grid_anchors(feat_height, feat_width, stride, scales, ratios, device)
+    inds_inside = inside_anchor_inds(feat_height, feat_width, stride, scales, ratios,
+                                     im_height, im_width, 0, device)
+    anchors = all_anchors[inds_inside]
+    for num_gt in (5, 20, 50):
+      xy = rng.uniform(0, 1, (1, num_gt, 2)) * [im_width, im_height]
+      wh = rng.uniform(0.02, 0.5, (1, num_gt, 2)) * [im_width, im_height]
+      x2y2 = np.minimum(xy + wh, [im_width - 1, im_height - 1])
+      gt_boxes = torch.from_numpy(np.concatenate((xy, x2y2, np.ones((1, num_gt, 1))), 2)
+                                  .astype(np.float32)).to(device)
+
+      def run_dense():
+        return dense(anchors, gt_boxes)
+
+      def run_sparse():
+        return sparse_anchor_overlaps(all_anchors, inds_inside, gt_boxes,
+                                      feat_height, feat_width)
+
+      times = []
+      for fn in (run_dense, run_sparse):
+        fn()
+        start = time.time()
+        for _ in range(args.repeat):
+          out = fn()
+        if device == 'cuda':
+          torch.cuda.synchronize()
+        times.append(((time.time() - start) / args.repeat, out))
+      same = all(torch.equal(a, b) for a, b in zip(times[0][1], times[1][1]))
+      print('{:>11s} {:>4d} {:>8d} {:>11.2f} {:>11.2f} {:>10.1f} {:>10.1f}  {}'.format(
+        '{:d}x{:d}'.format(im_width, im_height), num_gt, anchors.size(0),
+        times[0][0] * 1e3, times[1][0] * 1e3, _peak_memory_mb(run_dense),
+        _peak_memory_mb(run_sparse), 'same' if same else 'DIFFERENT'))
+
+
+def _legacy_proposal_layer(feat_stride, scales, ratios):
+  """_ProposalLayer with the full sort and the per-image loop it had before
+  it was batched; it has no RPN_MIN_SIZE filter."""
+  import torch
+  from model.rpn.bbox_transform import bbox_transform_inv, clip_boxes
+  from model.rpn.generate_anchors import generate_anchors
+  from model.rpn.proposal_layer import _ProposalLayer
+  from model.nms.nms_wrapper import nms
+  from model.utils.config import cfg
+
+  class _LegacyProposalLayer(_ProposalLayer):
+    def forward(self, input):
+      scores = input[0][:, self._num_anchors:, :, :]
+      bbox_deltas = input[1]
+      im_info = input[2]
+      cfg_key = input[3]
+      pre_nms_topN = cfg[cfg_key].RPN_PRE_NMS_TOP_N
+      post_nms_topN = cfg[cfg_key].RPN_POST_NMS_TOP_N
+      nms_thresh = cfg[cfg_key].RPN_NMS_THRESH
+      batch_size = bbox_deltas.size(0)
+
+      feat_height, feat_width = scores.size(2), scores.size(3)
+      shift_x = np.arange(0, feat_width) * self._feat_stride
+      shift_y = np.arange(0, feat_height) * self._feat_stride
+      shift_x, shift_y = np.meshgrid(shift_x, shift_y)
+      shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
+                                           shift_x.ravel(), shift_y.ravel())).transpose())
+      shifts = shifts.contiguous().type_as(scores).float()
+      A = self._num_anchors
+      K = shifts.size(0)
+      base = torch.from_numpy(generate_anchors(scales=np.array(self._scales),
+                                               ratios=np.array(self._ratios))).type_as(scores)
+      anchors = base.view(1, A, 4) + shifts.view(K, 1, 4)
+      anchors = anchors.view(1, K * A, 4).expand(batch_size, K * A, 4)
+
+      bbox_deltas = bbox_deltas.permute(0, 2, 3, 1).contiguous().view(batch_size, -1, 4)
+      scores = scores.permute(0, 2, 3, 1).contiguous().view(batch_size, -1)
+      proposals = bbox_transform_inv(anchors, bbox_deltas, batch_size)
+      proposals = clip_boxes(proposals, im_info, batch_size)
+      _, order = torch.sort(scores, 1, True)
+
+      output = scores.new(batch_size, post_nms_topN, 5).zero_()
+      for i in range(batch_size):
+        order_single = order[i]
+        if pre_nms_topN > 0 and pre_nms_topN < scores.numel():
+          order_single = order_single[:pre_nms_topN]
+        proposals_single = proposals[i][order_single, :]
+        scores_single = scores[i][order_single].view(-1, 1)
+        keep_idx_i = nms(torch.cat((proposals_single, scores_single), 1), nms_thresh)
+        keep_idx_i = keep_idx_i.long().view(-1)
+        if post_nms_topN > 0:
+          keep_idx_i = keep_idx_i[:post_nms_topN]
+        proposals_single = proposals_single[keep_idx_i, :]
+        num_proposal = proposals_single.size(0)
+        output[i, :, 0] = i
+        output[i, :num_proposal, 1:] = proposals_single
+      return output
+
+  return _LegacyProposalLayer(feat_stride, scales, ratios)
+
+
+def bench_proposals(args):
+  """_ProposalLayer on random RPN outputs of 600x1000 images for batch
+  sizes 1 to 8, with the TRAIN and TEST top-N settings; with --legacy also
+  the per-image loop version, whose outputs must match with RPN_MIN_SIZE 0."""
+  import torch
+  from model.rpn.proposal_layer import _ProposalLayer
+  from model.utils.config import cfg
+
+  device = 'cuda' if torch.cuda.is_available() else 'cpu'
+  scales, ratios, stride = np.array([8, 16, 32]), np.array([0.5, 1, 2]), 16
+  layers = [('batched', _ProposalLayer(stride, scales, ratios))]
+  if args.legacy:
+    layers.append(('legacy', _legacy_proposal_layer(stride, scales, ratios)))
+  num_anchors = len(scales) * len(ratios)
+  feat_height, feat_width = 38, 63
+  rng = np.random.RandomState(args.seed)
+  for cfg_key in ('TRAIN', 'TEST'):
+    cfg[cfg_key].RPN_MIN_SIZE = 0
+    for batch_size in (1, 2, 4, 8):
+      # distinct scores: sort and topk may order ties differently
+      shape = (batch_size, 2 * num_anchors, feat_height, feat_width)
+      scores = torch.from_numpy((rng.permutation(np.prod(shape)).reshape(shape) /
+                                 float(np.prod(shape))).astype(np.float32)).to(device)
+      deltas = torch.from_numpy(rng.normal(0, 0.2, (batch_size, 4 * num_anchors, feat_height,
+                                                    feat_width)).astype(np.float32)).to(device)
+      im_info = torch.tensor([[600., 1000., 1.6]] * batch_size, device=device)
+      outputs = []
+      for name, layer in layers:
+        run = lambda: layer((scores, deltas, im_info, cfg_key))
+        run()
+        start = time.time()
+        for _ in range(args.repeat):
+          out = run()
+        if device == 'cuda':
+          torch.cuda.synchronize()
+        elapsed = (time.time() - start) / args.repeat
+        outputs.append(out)
+        print('{:<8s} {:<5s} B={:d} {:10.3f}ms  peak {:7.1f}MB  {}'.format(
+          name, cfg_key, batch_size, elapsed * 1e3, _peak_memory_mb(run),
+          'same' if torch.equal(out, outputs[0]) else 'DIFFERENT'))
+
+
+def _legacy_proposal_target_layer(num_classes):
+  """_ProposalTargetLayer with the per-image sampling loop and the per-roi
+  regression label copies it had before they were batched."""
+  import torch
+  from model.rpn.bbox_transform import bbox_overlaps_batch
+  from model.rpn.proposal_target_layer_cascade import _ProposalTargetLayer
+  from model.utils.config import cfg
+
+  class _LegacyProposalTargetLayer(_ProposalTargetLayer):
+
+    def _get_bbox_regression_labels_pytorch(self, bbox_target_data, labels_batch, num_classes):
+      batch_size = labels_batch.size(0)
+      rois_per_image = labels_batch.size(1)
+      clss = labels_batch
+      bbox_targets = bbox_target_data.new(batch_size, rois_per_image, 4).zero_()
+      bbox_inside_weights = bbox_target_data.new(bbox_targets.size()).zero_()
+      for b in range(batch_size):
+        if clss[b].sum() == 0:
+          continue
+        inds = torch.nonzero(clss[b] > 0).view(-1)
+        for i in range(inds.numel()):
+          ind = inds[i]
+          bbox_targets[b, ind, :] = bbox_target_data[b, ind, :]
+          bbox_inside_weights[b, ind, :] = self.BBOX_INSIDE_WEIGHTS
+      return bbox_targets, bbox_inside_weights
+
+    def _sample_rois_pytorch(self, all_rois, gt_boxes, fg_rois_per_image, rois_per_image,
+                             num_classes):
+      overlaps = bbox_overlaps_batch(all_rois, gt_boxes)
+      max_overlaps, gt_assignment = torch.max(overlaps, 2)
+      batch_size = overlaps.size(0)
+      labels = gt_boxes[:, :, 4].gather(1, gt_assignment)
+      labels_batch = labels.new(batch_size, rois_per_image).zero_()
+      rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
+      gt_rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
+      for i in range(batch_size):
+        fg_inds = torch.nonzero(max_overlaps[i] >= cfg.TRAIN.FG_THRESH).view(-1)
+        fg_num_rois = fg_inds.numel()
+        bg_inds = torch.nonzero((max_overlaps[i] < cfg.TRAIN.BG_THRESH_HI) &
+                                (max_overlaps[i] >= cfg.TRAIN.BG_THRESH_LO)).view(-1)
+        bg_num_rois = bg_inds.numel()
+        if fg_num_rois > 0 and bg_num_rois > 0:
+          fg_rois_per_this_image = min(fg_rois_per_image, fg_num_rois)
+          rand_num = torch.from_numpy(np.random.permutation(fg_num_rois)).type_as(gt_boxes).long()
+          fg_inds = fg_inds[rand_num[:fg_rois_per_this_image]]
+          bg_rois_per_this_image = rois_per_image - fg_rois_per_this_image
+          rand_num = np.floor(np.random.rand(bg_rois_per_this_image) * bg_num_rois)
+          bg_inds = bg_inds[torch.from_numpy(rand_num).type_as(gt_boxes).long()]
+        elif fg_num_rois > 0 and bg_num_rois == 0:
+          rand_num = np.floor(np.random.rand(rois_per_image) * fg_num_rois)
+          fg_inds = fg_inds[torch.from_numpy(rand_num).type_as(gt_boxes).long()]
+          fg_rois_per_this_image = rois_per_image
+        elif bg_num_rois > 0 and fg_num_rois == 0:
+          rand_num = np.floor(np.random.rand(rois_per_image) * bg_num_rois)
+          bg_inds = bg_inds[torch.from_numpy(rand_num).type_as(gt_boxes).long()]
+          fg_rois_per_this_image = 0
+        else:
+          raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
+        keep_inds = torch.cat([fg_inds, bg_inds], 0)
+        labels_batch[i].copy_(labels[i][keep_inds])
+        if fg_rois_per_this_image < rois_per_image:
+          labels_batch[i][fg_rois_per_this_image:] = 0
+        rois_batch[i] = all_rois[i][keep_inds]
+        rois_batch[i, :, 0] = i
+        gt_rois_batch[i] = gt_boxes[i][gt_assignment[i][keep_inds]]
+      bbox_target_data = self._compute_targets_pytorch(rois_batch[:, :, 1:5],
+                                                       gt_rois_batch[:, :, :4])
+      bbox_targets, bbox_inside_weights = \
+        self._get_bbox_regression_labels_pytorch(bbox_target_data, labels_batch, num_classes)
+      return labels_batch, rois_batch, bbox_targets, bbox_inside_weights
+
+  return _LegacyProposalTargetLayer(num_classes)
+
+
+def synthetic_rois(batch_size, num_rois, num_gt, seed):
+  """RPN-like rois (B, num_rois, 5) around num_gt gt boxes (B, num_gt, 5)
+  of 800x600 images, and the number of gt boxes of every image."""
+  import torch
+
+  rng = np.random.RandomState(seed)
+  gt_xy = rng.uniform(0, 600, (batch_size, num_gt, 2))
+  gt_wh = rng.uniform(20, 200, (batch_size, num_gt, 2))
+  gt_boxes = np.concatenate((gt_xy, gt_xy + gt_wh,
+                             rng.randint(1, 21, (batch_size, num_gt, 1))), 2)
+  # half of the rois jitter a gt box, the rest are anywhere
+  near = rng.randint(0, num_gt, (batch_size, num_rois))
+  jitter = rng.normal(0, 0.15, (batch_size, num_rois, 4)) * np.tile(gt_wh.mean(1, keepdims=True), 2)
+  rois = np.take_along_axis(gt_boxes[:, :, :4], near[:, :, None], 1) + jitter
+  anywhere = rng.uniform(0, 1, (batch_size, num_rois)) < 0.5
+  xy = rng.uniform(0, 600, (batch_size, num_rois, 2))
+  rois[anywhere] = np.concatenate((xy, xy + rng.uniform(20, 200, (batch_size, num_rois, 2))),
+                                  2)[anywhere]
+  rois = np.concatenate((np.zeros((batch_size, num_rois, 1)), rois), 2)
+  return (torch.from_numpy(rois.astype(np.float32)), torch.from_numpy(gt_boxes.astype(np.float32)),
+          torch.full((batch_size,), num_gt, dtype=torch.long))
+
+
+def bench_proposal_targets(args):
+  """_ProposalTargetLayer on 2000 RPN-like rois per image for batch sizes
+  1 to 16, with --legacy also the per-image loop version."""
+  import torch
+  from model.rpn.proposal_target_layer_cascade import _ProposalTargetLayer
+
+  device = 'cuda' if torch.cuda.is_available() else 'cpu'
+  layers = [('batched', _ProposalTargetLayer(21))]
+  if args.legacy:
+    layers.append(('legacy', _legacy_proposal_target_layer(21)))
+  for batch_size in (1, 2, 4, 8, 16):
+    rois, gt_boxes, num_boxes = [t.to(device) for t in
+                                 synthetic_rois(batch_size, 2000, 20, args.seed)]
+    for name, layer in layers:
+      layer(rois, gt_boxes, num_boxes)
+      start = time.time()
+      for _ in range(args.repeat):
+        labels = layer(rois, gt_boxes, num_boxes)[1]
+      if device == 'cuda':
+        torch.cuda.synchronize()
+      print('{:<8s} B={:<3d} {:10.3f}ms  fg/image {:6.1f}'.format(
+        name, batch_size, (time.time() - start) / args.repeat * 1e3,
+        float((labels > 0).sum()) / batch_size))
+
+
+def bench_roi_align(args):
+  """CPU RoIAlignAvg sampling (8x8 points per roi) forward and backward of
+  the roi_align extension on a 512x38x50 feature map, against F.grid_sample
+  on the same points; the CPU backward is gradchecked first."""
+  import torch
+  import torch.nn.functional as F
+  from model.roi_align.functions.roi_align import RoIAlignFunction
+
+  aligned, scale = 8, 1. / 16.
+
+  class _RoIAlignCPU(torch.autograd.Function):
+    # the float extension as a double function for gradcheck: the output is
+    # linear in the features, so large finite differences are exact
+    @staticmethod
+    def forward(ctx, features, rois):
+      ctx.function = RoIAlignFunction(aligned, aligned, scale)
+      return ctx.function.forward(features.float(), rois.float()).double()
+
+    @staticmethod
+    def backward(ctx, grad_output):
+      return ctx.function.backward(grad_output.float())[0].double(), None
+
+  rois = synthetic_rois(2, 8, 4, args.seed)[0]
+  rois[1, :, 0] = 1
+  features = torch.randn(2, 3, 38, 50, dtype=torch.float64, requires_grad=True)
+  print('gradcheck', torch.autograd.gradcheck(_RoIAlignCPU.apply,
+                                              (features, rois.view(-1, 5).double()),
+                                              eps=1e-1, atol=1e-4))
+
+  def grid_sample_align(features, rois):
+    # the same sampling points, one grid_sample call over the rois of all images
+    batch_size, _, height, width = features.size()
+    steps = torch.arange(aligned, dtype=rois.dtype) / (aligned - 1.)
+    x1, y1, x2, y2 = [rois[:, :, i].unsqueeze(2) * scale for i in range(1, 5)]
+    w = x1 + steps * (x2 - x1 + 1).clamp(min=0)
+    h = y1 + steps * (y2 - y1 + 1).clamp(min=0)
+    grid = torch.stack((w.unsqueeze(2).expand(-1, -1, aligned, -1) / (width - 1),
+                        h.unsqueeze(3).expand(-1, -1, -1, aligned) / (height - 1)), 4)
+    grid = grid.view(batch_size, -1, aligned, 2) * 2 - 1
+    try:
+      out = F.grid_sample(features, grid, align_corners=True)
+    except TypeError:
+      # before pytorch 1.3 grid_sample always aligned the corners
+      out = F.grid_sample(features, grid)
+    return out.view(batch_size, features.size(1), -1, aligned, aligned).transpose(1, 2)
+
+  for batch_size, num_rois in ((1, 128), (1, 300), (2, 256), (4, 256)):
+    rois = synthetic_rois(batch_size, num_rois, 20, args.seed)[0]
+    rois[:, :, 0] = torch.arange(batch_size, dtype=rois.dtype).view(-1, 1)
+    features = torch.randn(batch_size, 512, 38, 50)
+    function = RoIAlignFunction(aligned, aligned, scale)
+    out = function.forward(features, rois.view(-1, 5))
+    grad = torch.randn_like(out)
+
+    start = time.time()
+    for _ in range(args.repeat):
+      out = function.forward(features, rois.view(-1, 5))
+    forward = time.time() - start
+    start = time.time()
+    for _ in range(args.repeat):
+      function.backward(grad)
+    backward = time.time() - start
+    print('roi_align   B={} R={:<4d} forward {:8.2f}ms  backward {:8.2f}ms'.format(
+      batch_size, num_rois, forward / args.repeat * 1e3, backward / args.repeat * 1e3))
+
+    leaf = features.clone().requires_grad_()
+    sampled = grid_sample_align(leaf, rois)
+    forward = backward = 0
+    for _ in range(args.repeat):
+      start = time.time()
+      sampled = grid_sample_align(leaf, rois)
+      forward += time.time() - start
+      start = time.time()
+      sampled.backward(grad.view(sampled.size()))
+      backward += time.time() - start
+    # grid_sample blends with its zero padding within one cell outside the
+    # map and on the last row and column, where the kernel gives 0 or extrapolates
+    steps = torch.arange(aligned, dtype=rois.dtype) / (aligned - 1.)
+    x1, y1, x2, y2 = [rois[:, :, i].view(-1, 1) * scale for i in range(1, 5)]
+    w = x1 + steps * (x2 - x1 + 1).clamp(min=0)
+    h = y1 + steps * (y2 - y1 + 1).clamp(min=0)
+    inner = (((w <= -1) | (w >= 0)) & ((w <= 49) | (w >= 50))).view(-1, 1, 1, aligned) & \
+            (((h <= -1) | (h >= 0)) & ((h <= 37) | (h >= 38))).view(-1, 1, aligned, 1)
+    print('grid_sample B={} R={:<4d} forward {:8.2f}ms  backward {:8.2f}ms  max diff {:.2e}'.format(
+      batch_size, num_rois, forward / args.repeat * 1e3, backward / args.repeat * 1e3,
+      float(((out - sampled.detach().reshape(out.size())) * inner.float()).abs().max())))
+
+
+SUITES = {
+  'loader': bench_loader,
+  'nms': bench_nms,
+  'multiclass_nms': bench_multiclass_nms,
+  'memory': bench_memory,
+  'decode': bench_decode,
+  'roidb': bench_roidb,
+  'overlaps': bench_overlaps,
+  'proposals': bench_proposals,
+  'proposal_targets': bench_proposal_targets,
+  'roi_align': bench_roi_align,
+}
+
+
+if __name__ == '__main__':
+
+  args = parse_args()
+  print('Called with args:')
+  print(args)
+
+  SUITES[args.suite](args)
@@ -23,12 +23,12 @@ import torch.optim as optim
 
 import torchvision.transforms as transforms
 import torchvision.datasets as dset
-from scipy.misc import imread
+from model.utils.image_decode import decode_image
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
 from model.rpn.bbox_transform import clip_boxes
-from model.nms.nms_wrapper import nms
+from model.nms.multiclass_nms import multiclass_nms
 from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import save_net, load_net, vis_detections
 from model.utils.blob import im_list_to_blob
@@ -252,16 +252,15 @@ if __name__ == '__main__':
           raise RuntimeError("Webcam could not open. Please check connection.")
         ret, frame = cap.read()
         im_in = np.array(frame)
-      # Load the demo image
+        if len(im_in.shape) == 2:
+          im_in = im_in[:,:,np.newaxis]
+          im_in = np.concatenate((im_in,im_in,im_in), axis=2)
+        # rgb -> bgr
+        im = im_in[:,:,::-1]
+      # Load the demo image, decoded straight to bgr
       else:
         im_file = os.path.join(args.image_dir, imglist[num_images])
-        # im = cv2.imread(im_file)
-        im_in = np.array(imread(im_file))
-      if len(im_in.shape) == 2:
-        im_in = im_in[:,:,np.newaxis]
-        im_in = np.concatenate((im_in,im_in,im_in), axis=2)
-      # rgb -> bgr
-      im = im_in[:,:,::-1]
+        im = decode_image(im_file)
 
       blobs, im_scales = _get_image_blob(im)
       assert len(im_scales) == 1, "Only single-image batch implemented"
@@ -317,24 +316,17 @@ if __name__ == '__main__':
       misc_tic = time.time()
       if vis:
           im2show = np.copy(im)
+      # all classes suppressed in one pass
+      cls_dets_all, _ = multiclass_nms(pred_boxes.view(1, scores.size(0), -1),
+                                       scores.unsqueeze(0), cfg.TEST.NMS,
+                                       score_thresh=thresh, out_device='cpu',
+                                       mode=cfg.TEST.MODE)
       for j in xrange(1, len(pascal_classes)):
-          inds = torch.nonzero(scores[:,j]>thresh).view(-1)
+          cls_dets = cls_dets_all[0][j]
           # if there is det
-          if inds.numel() > 0:
-            cls_scores = scores[:,j][inds]
-            _, order = torch.sort(cls_scores, 0, True)
-            if args.class_agnostic:
-              cls_boxes = pred_boxes[inds, :]
-            else:
-              cls_boxes = pred_boxes[inds][:, j * 4:(j + 1) * 4]
-            
-            cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1)), 1)
-            # cls_dets = torch.cat((cls_boxes, cls_scores), 1)
-            cls_dets = cls_dets[order]
-            keep = nms(cls_dets, cfg.TEST.NMS)
-            cls_dets = cls_dets[keep.view(-1).long()]
+          if cls_dets.numel() > 0:
             if vis:
-              im2show = vis_detections(im2show, pascal_classes[j], cls_dets.cpu().numpy(), 0.5)
+              im2show = vis_detections(im2show, pascal_classes[j], cls_dets.numpy(), 0.5)
 
       misc_toc = time.time()
       nms_time = misc_toc - misc_tic
@@ -0,0 +1,231 @@
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Images served as byte ranges of uncompressed tar or zip archives.
+
+index_archive() lists the regular members of an archive once, with the
+offset and size of their data, and caches the listing in a pickle. Every
+member is then addressed by an archive URI
+
+  archive://<archive path>::<offset>:<size>:<method>:<file size>::<member>
+
+which carries its byte range, so read_bytes() is a single positional read
+of one descriptor per archive and process, without looking the member up
+again. Tar members and stored zip members are read as they are;
+deflated zip members are inflated after the read. ArchiveSet maps the loose
+image paths of an imdb to the URIs of the matching members.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import pickle
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+
+import numpy as np
+
+ARCHIVE_SCHEME = 'archive://'
+_SEP = '::'
+_STORED = zipfile.ZIP_STORED
+_DEFLATED = zipfile.ZIP_DEFLATED
+_ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+
+
+def is_archive_uri(path):
+  return path.startswith(ARCHIVE_SCHEME)
+
+
+def archive_uri(archive, member, offset, size, method=_STORED, file_size=None):
+  if file_size is None:
+    file_size = size
+  return '{}{}{}{:d}:{:d}:{:d}:{:d}{}{}'.format(
+    ARCHIVE_SCHEME, archive, _SEP, offset, size, method, file_size, _SEP, member)
+
+
+def split_archive_uri(uri):
+  """Return (archive, member, offset, size, method, file_size) of a URI."""
+  archive, byte_range, member = uri[len(ARCHIVE_SCHEME):].split(_SEP, 2)
+  offset, size, method, file_size = [int(v) for v in byte_range.split(':')]
+  return archive, member, offset, size, method, file_size
+
+
+def _index_tar(path):
+  members = {}
+  try:
+    tar = tarfile.open(path, 'r:')
+  except tarfile.ReadError:
+    raise IOError('{} is not an uncompressed tar archive; compressed archives '
+                  'cannot be read by byte range, repack it with `tar cf`'.format(path))
+  with tar:
+    while True:
+      info = tar.next()
+      if info is None:
+        break
+      if info.isreg():
+        members[info.name] = (info.offset_data, info.size, _STORED, info.size)
+      # do not keep a TarInfo per member around
+      tar.members = []
+  return members
+
+
+def _index_zip(path):
+  members = {}
+  with open(path, 'rb') as f:
+    for info in zipfile.ZipFile(f).infolist():
+      if info.filename.endswith('/'):
+        continue
+      if info.flag_bits & 0x1:
+        raise IOError('{}: encrypted member {}'.format(path, info.filename))
+      if info.compress_type not in (_STORED, _DEFLATED):
+        raise IOError('{}: member {} is neither stored nor deflated'.format(
+          path, info.filename))
+      # the data follows the local header, whose extra field may differ from
+      # the one in the central directory
+      f.seek(info.header_offset)
+      signature, name_len, extra_len = _ZIP_LOCAL_HEADER.unpack(
+        f.read(_ZIP_LOCAL_HEADER.size))
+      if signature != b'PK\x03\x04':
+        raise IOError('{}: bad local header for {}'.format(path, info.filename))
+      offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_len + extra_len
+      members[info.filename] = (offset, info.compress_size, info.compress_type,
+                                info.file_size)
+  return members
+
+
+def index_archive(path, cache_dir=None):
+  """Return a dict mapping every member of an archive to its URI.
+
+  The listing is cached in cache_dir, keyed by the absolute archive path,
+  and rebuilt when the mtime or size of the archive changed.
+  """
+  path = os.path.abspath(path)
+  st = os.stat(path)
+  stamp = (st.st_mtime, st.st_size)
+  cache_file = None
+  if cache_dir is not None:
+    digest = hashlib.md5(path.encode('utf-8')).hexdigest()[:8]
+    cache_file = os.path.join(cache_dir, '{}_{}_members.pkl'.format(
+      os.path.basename(path), digest))
+    if os.path.exists(cache_file):
+      with open(cache_file, 'rb') as f:
+        cached = pickle.load(f)
+      if cached['stamp'] == stamp:
+        members = cached['members']
+        return dict((name, archive_uri(path, name, *m)) for name, m in members.items())
+
+  if zipfile.is_zipfile(path):
+    members = _index_zip(path)
+  else:
+    members = _index_tar(path)
+  print('indexed {:d} members of {}'.format(len(members), path))
+
+  if cache_file is not None:
+    tmp_file = '{}.{:d}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+      pickle.dump({'stamp': stamp, 'members': members}, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, cache_file)
+  return dict((name, archive_uri(path, name, *m)) for name, m in members.items())
+
+
+# one descriptor per archive and process: the forked data loader workers
+# inherit those of the parent, and would share their file offset when the
+# reads fall back to lseek() and read() without pread()
+_descriptors = {}
+_descriptors_pid = None
+_lock = threading.Lock()
+
+
+def _descriptor(archive):
+  global _descriptors_pid
+  pid = os.getpid()
+  fd = _descriptors.get(archive) if _descriptors_pid == pid else None
+  if fd is None:
+    with _lock:
+      if _descriptors_pid != pid:
+        for inherited in _descriptors.values():
+          os.close(inherited)
+        _descriptors.clear()
+        _descriptors_pid = pid
+      fd = _descriptors.get(archive)
+      if fd is None:
+        fd = os.open(archive, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        _descriptors[archive] = fd
+  return fd
+
+
+def _pread(fd, size, offset):
+  if hasattr(os, 'pread'):
+    chunks = []
+    while size > 0:
+      chunk = os.pread(fd, size, offset)
+      if not chunk:
+        break
+      chunks.append(chunk)
+      size -= len(chunk)
+      offset += len(chunk)
+    return b''.join(chunks)
+  with _lock:
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def read_bytes(uri):
+  """Return the (decompressed) content of the archive member of a URI."""
+  archive, member, offset, size, method, file_size = split_archive_uri(uri)
+  data = _pread(_descriptor(archive), size, offset)
+  if len(data) != size:
+    raise IOError('{}: truncated member {}'.format(archive, member))
+  if method == _DEFLATED:
+    data = zlib.decompress(data, -zlib.MAX_WBITS)
+  return data
+
+
+def read_order(paths):
+  """Sort keys placing archive members in archive and byte order.
+
+  Loose files get key -1, so sorting by the keys leaves them first.
+  """
+  keys = np.full(len(paths), -1, dtype=np.int64)
+  archives = {}
+  for i, path in enumerate(paths):
+    if is_archive_uri(path):
+      archive, _, offset, _, _, _ = split_archive_uri(path)
+      rank = archives.setdefault(archive, len(archives))
+      keys[i] = (rank << 40) + offset
+  return keys
+
+
+class ArchiveSet(object):
+  """Members of several archives, looked up by the loose image paths.
+
+  A path resolves to the member named by its longest suffix, so archives
+  may be packed relative to any directory above the images, e.g. both
+  VOC2007/JPEGImages/000005.jpg and JPEGImages/000005.jpg resolve
+  .../VOCdevkit2007/VOC2007/JPEGImages/000005.jpg.
+  """
+
+  def __init__(self, archives, cache_dir=None):
+    self.archives = [os.path.abspath(a) for a in archives]
+    self._members = {}
+    for archive in self.archives:
+      for name, uri in index_archive(archive, cache_dir).items():
+        self._members.setdefault(os.path.normpath(name).replace(os.sep, '/'), uri)
+
+  def __len__(self):
+    return len(self._members)
+
+  def uri(self, path):
+    """Return the URI of the member holding path, or None."""
+    parts = os.path.normpath(os.path.abspath(path)).split(os.sep)
+    for i in range(1, len(parts)):
+      uri = self._members.get('/'.join(parts[i:]))
+      if uri is not None:
+        return uri
+    return None
@@ -0,0 +1,109 @@
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Per-box statistics of the sparse gt_overlaps matrices, computed once.
+
+overlap_stats() reduces the gt_overlaps matrices of a whole roidb to the
+maximum overlap of every box, the class it is reached at and the crowd
+flag (a COCO ''iscrowd'' box has its overlaps row set to -1). get_gt_stats()
+caches these flat arrays in a pickle next to the gt roidb pickle, so the
+sparse matrices are only read when the gt roidb changes and the data layer
+never needs them.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle
+
+import numpy as np
+import scipy.sparse
+
+
+def overlap_stats(gt_overlaps):
+  """Row-wise max, argmax and crowd flag over a list of sparse matrices.
+
+  Equivalent to gt_overlaps.toarray().max(axis=1), .argmax(axis=1) and
+  ~np.all(gt_overlaps.toarray() > -1, axis=1) on the stacked matrix,
+  computed from the raw CSR arrays of all matrices at once instead of
+  densifying or looping over the rows.
+  """
+  mats = [m if scipy.sparse.isspmatrix_csr(m) else scipy.sparse.csr_matrix(m)
+          for m in gt_overlaps]
+  num_cols = max([m.shape[1] for m in mats] + [1])
+  num_rows = sum(m.shape[0] for m in mats)
+  max_overlaps = np.zeros(num_rows, dtype=np.float32)
+  max_classes = np.zeros(num_rows, dtype=np.int32)
+  crowd = np.zeros(num_rows, dtype=np.bool_)
+  if num_rows == 0:
+    return max_overlaps, max_classes, crowd
+
+  data = np.concatenate([m.data for m in mats]).astype(np.float32, copy=False)
+  cols = np.concatenate([m.indices for m in mats])
+  row_nnz = np.concatenate([m.indptr[1:] - m.indptr[:-1] for m in mats])
+  rows = np.repeat(np.arange(num_rows), row_nnz)
+
+  # the first entry of every row after sorting by (row, -value, column) is
+  # the row maximum, at the lowest column in case of ties
+  order = np.lexsort((cols, -data, rows))
+  starts = np.cumsum(row_nnz) - row_nnz
+  filled = row_nnz > 0
+  first = order[starts[filled]]
+  max_overlaps[filled] = data[first]
+  max_classes[filled] = cols[first]
+  # implicit zeros are > -1, only explicit entries can mark a crowd box
+  crowd[filled] = np.minimum.reduceat(data, starts[filled]) <= -1
+
+  # rows whose explicit maximum is not positive compete with their implicit
+  # zeros, leave those (rare) rows to the dense computation
+  for i in np.flatnonzero(filled & (row_nnz < num_cols) & (max_overlaps <= 0)):
+    row = np.zeros(num_cols, dtype=np.float32)
+    entries = slice(starts[i], starts[i] + row_nnz[i])
+    row[cols[entries]] = data[entries]
+    max_overlaps[i] = row.max()
+    max_classes[i] = row.argmax()
+  return max_overlaps, max_classes, crowd
+
+
+def get_gt_stats(roidb, cache_file=None, stamp=None):
+  """Return per-image lists of (max_overlaps, max_classes, crowd) arrays.
+
+  The stats are cached in cache_file together with stamp (e.g. the mtime
+  of the gt roidb pickle) and the box count of every image; the cache is
+  only recomputed when either of them changed.
+  """
+  counts = np.array([len(r['boxes']) for r in roidb], dtype=np.int64)
+  box_offsets = np.zeros(len(roidb) + 1, dtype=np.int64)
+  np.cumsum(counts, out=box_offsets[1:])
+
+  stats = None
+  if cache_file is not None and os.path.exists(cache_file):
+    try:
+      with open(cache_file, 'rb') as f:
+        stats = pickle.load(f)
+    except (EOFError, pickle.UnpicklingError):
+      stats = None
+    if stats is not None and (stats['stamp'] != stamp or
+                              not np.array_equal(stats['box_offsets'], box_offsets)):
+      stats = None
+
+  if stats is None:
+    max_overlaps, max_classes, crowd = overlap_stats([r['gt_overlaps'] for r in roidb])
+    stats = {'stamp': stamp,
+             'box_offsets': box_offsets,
+             'max_overlaps': max_overlaps,
+             'max_classes': max_classes,
+             'crowd': crowd}
+    if cache_file is not None:
+      tmp_file = '{}.{:d}.tmp'.format(cache_file, os.getpid())
+      with open(tmp_file, 'wb') as f:
+        pickle.dump(stats, f, pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_file, cache_file)
+      print('gt overlap stats cached at {:s}'.format(cache_file))
+
+  bounds = box_offsets[1:-1]
+  return (np.split(stats['max_overlaps'], bounds),
+          np.split(stats['max_classes'], bounds),
+          np.split(stats['crowd'], bounds))
@@ -0,0 +1,145 @@
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Image sizes read from the file headers, probed in parallel and cached.
+
+read_image_size() parses the JPEG SOF marker or the PNG IHDR chunk and only
+falls back to PIL for other formats. get_image_sizes() probes a list of
+files through a thread pool and keeps the results in a sidecar pickle keyed
+by path, so later runs only stat the files and re-probe the ones whose
+mtime or size changed. Archive URIs are probed from the member bytes and
+stamped with the archive's mtime and size.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import pickle
+import struct
+from multiprocessing.pool import ThreadPool
+
+import PIL.Image
+
+from datasets.archive import is_archive_uri, read_bytes, split_archive_uri
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# start-of-frame markers carrying the image size, i.e. 0xC0-0xCF without
+# DHT (0xC4), JPG (0xC8) and DAC (0xCC)
+_JPEG_SOF = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+
+def _jpeg_size(f):
+  f.seek(2)
+  while True:
+    byte = f.read(1)
+    while byte and byte != b'\xff':
+      byte = f.read(1)
+    while byte == b'\xff':
+      byte = f.read(1)
+    if not byte:
+      return None
+    marker = ord(byte)
+    if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+      # markers without a payload
+      continue
+    length = f.read(2)
+    if len(length) != 2:
+      return None
+    length = struct.unpack('>H', length)[0]
+    if marker in _JPEG_SOF:
+      data = f.read(5)
+      if len(data) != 5:
+        return None
+      height, width = struct.unpack('>xHH', data)
+      return width, height
+    f.seek(length - 2, 1)
+
+
+def _header_size(f):
+  head = f.read(24)
+  if head[:2] == b'\xff\xd8':
+    return _jpeg_size(f)
+  elif head[:8] == _PNG_SIGNATURE and head[12:16] == b'IHDR':
+    return struct.unpack('>II', head[16:24])
+  return None
+
+
+def image_size_from_bytes(data):
+  """Return (width, height) from the header of an encoded image, or None."""
+  size = _header_size(io.BytesIO(data))
+  if size is None or size[0] <= 0 or size[1] <= 0:
+    return None
+  return size
+
+
+def read_image_size(path):
+  """Return (width, height) of an image, reading only its header."""
+  if is_archive_uri(path):
+    data = read_bytes(path)
+    size = image_size_from_bytes(data)
+    if size is None:
+      size = PIL.Image.open(io.BytesIO(data)).size
+    return size
+  with open(path, 'rb') as f:
+    size = _header_size(f)
+  if size is None or size[0] <= 0 or size[1] <= 0:
+    size = PIL.Image.open(path).size
+  return size
+
+
+def _probe(args):
+  path, stamp, cached = args
+  if stamp is None:
+    st = os.stat(split_archive_uri(path)[0] if is_archive_uri(path) else path)
+    stamp = (st.st_mtime, st.st_size)
+  if cached is not None and cached[0] == stamp:
+    return stamp, cached[1]
+  return stamp, read_image_size(path)
+
+
+def get_image_sizes(paths, cache_file=None, num_workers=16):
+  """Return a dict mapping every path to its (width, height).
+
+  Sizes are cached in cache_file by path together with the mtime and size
+  of the file; an entry is only re-probed when either of them changed.
+  """
+  cache = {}
+  if cache_file is not None and os.path.exists(cache_file):
+    try:
+      with open(cache_file, 'rb') as f:
+        cache = pickle.load(f)
+    except (EOFError, pickle.UnpicklingError):
+      cache = {}
+
+  unique = list(set(paths))
+  jobs = [(p, None, cache.get(p)) for p in unique]
+  if num_workers > 1 and len(jobs) > 1:
+    pool = ThreadPool(min(num_workers, len(jobs)))
+    try:
+      results = pool.map(_probe, jobs, chunksize=64)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [_probe(job) for job in jobs]
+
+  sizes = {}
+  num_probed = 0
+  for path, (stamp, size) in zip(unique, results):
+    sizes[path] = size
+    cached = cache.get(path)
+    if cached is None or cached[0] != stamp:
+      cache[path] = (stamp, size)
+      num_probed += 1
+
+  if cache_file is not None and num_probed > 0:
+    tmp_file = '{}.{:d}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+      pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, cache_file)
+    print('probed {:d} image sizes, cached at {:s}'.format(num_probed, cache_file))
+
+  return sizes
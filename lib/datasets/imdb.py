@@ -15,6 +15,9 @@ from model.utils.cython_bbox import bbox_overlaps
 import numpy as np
 import scipy.sparse
 from model.utils.config import cfg
+from datasets.image_sizes import get_image_sizes
+from datasets.archive import ArchiveSet
+from datasets.gt_stats import get_gt_stats
 import pdb
 
 ROOT_DIR = osp.join(osp.dirname(__file__), '..', '..')
@@ -33,6 +36,8 @@ class imdb(object):
     self._obj_proposer = 'gt'
     self._roidb = None
     self._roidb_handler = self.default_roidb
+    self._image_sizes = None
+    self._archives = None
     # Use this dict for storing dataset specific config options
     self.config = {}
 
@@ -93,6 +98,26 @@ class imdb(object):
   def image_id_at(self, i):
     raise NotImplementedError
 
+  def set_archives(self, archives):
+    """Serve the images from tar/zip archives instead of loose files.
+
+    Images found in the archives are read as byte ranges through the
+    archive URIs returned by image_uri_at(); others stay loose files.
+    """
+    self._archives = ArchiveSet(archives, self.cache_path) if archives else None
+    self._image_sizes = None
+
+  def image_uri(self, path):
+    if self._archives is not None:
+      uri = self._archives.uri(path)
+      if uri is not None:
+        return uri
+    return path
+
+  def image_uri_at(self, i):
+    """Path of image i, or its archive URI when it is archived."""
+    return self.image_uri(self.image_path_at(i))
+
   def default_roidb(self):
     raise NotImplementedError
 
@@ -107,10 +132,39 @@ class imdb(object):
     """
     raise NotImplementedError
 
-  def _get_widths(self):
-    return [PIL.Image.open(self.image_path_at(i)).size[0]
+  def _get_sizes(self):
+    """(width, height) of every image, read from the image headers.
+
+    The sizes are probed once per imdb and cached on disk, so both
+    append_flipped_images() and prepare_roidb() reuse them.
+    """
+    if self._image_sizes is None:
+      cache_file = osp.join(self.cache_path, self.name + '_image_sizes.pkl')
+      paths = [self.image_uri_at(i) for i in range(self.num_images)]
+      self._image_sizes = get_image_sizes(paths, cache_file,
+                                          num_workers=cfg.IMAGE_SIZE_WORKERS)
+    return [self._image_sizes[self.image_uri_at(i)]
             for i in range(self.num_images)]
 
+  def _get_gt_stats(self):
+    """Per-image (max_overlaps, max_classes, crowd) arrays of the roidb.
+
+    They are computed from the sparse gt_overlaps of the unflipped images
+    and cached next to the gt roidb pickle; every flipped image, appended
+    by append_flipped_images(), shares the arrays of its original.
+    """
+    roidb = self.roidb
+    num_orig = sum(1 for r in roidb if not r['flipped'])
+    gt_roidb_file = osp.join(self.cache_path, self.name + '_gt_roidb.pkl')
+    stamp = osp.getmtime(gt_roidb_file) if osp.exists(gt_roidb_file) else None
+    stats = get_gt_stats(roidb[:num_orig],
+                         osp.join(self.cache_path, self.name + '_gt_stats.pkl'),
+                         stamp)
+    return [[column[i % num_orig] for i in range(len(roidb))] for column in stats]
+
+  def _get_widths(self):
+    return [size[0] for size in self._get_sizes()]
+
   def append_flipped_images(self):
     num_images = self.num_images
     widths = self._get_widths()
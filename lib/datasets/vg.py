@@ -10,6 +10,7 @@ from __future__ import absolute_import
 import os
 from datasets.imdb import imdb
 import datasets.ds_utils as ds_utils
+from datasets.image_sizes import read_image_size
 import xml.etree.ElementTree as ET
 import numpy as np
 import scipy.sparse
@@ -196,7 +197,7 @@ class vg(imdb):
         return gt_roidb
 
     def _get_size(self, index):
-      return PIL.Image.open(self.image_path_from_index(index)).size
+      return read_image_size(self.image_uri(self.image_path_from_index(index)))
 
     def _annotation_path(self, index):
         return os.path.join(self._data_path, 'xml', str(index) + '.xml')
@@ -14,7 +14,8 @@ from model.roi_align.modules.roi_align import RoIAlignAvg
 from model.rpn.proposal_target_layer_cascade import _ProposalTargetLayer
 import time
 import pdb
-from model.utils.net_utils import _smooth_l1_loss, _crop_pool_layer, _affine_grid_gen, _affine_theta
+from model.utils.net_utils import _smooth_l1_loss, _crop_pool_layer, _affine_grid_gen, _affine_theta, \
+                                  _normalize_input
 
 class _fasterRCNN(nn.Module):
     """ faster RCNN """
@@ -43,6 +44,10 @@ class _fasterRCNN(nn.Module):
         gt_boxes = gt_boxes.data
         num_boxes = num_boxes.data
 
+        # uint8 NHWC batches are normalized here, on the device
+        if im_data.dtype == torch.uint8:
+            im_data = _normalize_input(im_data)
+
         #for dla convert the images to be divisible by 32
         print('image data size', im_data.size())
         padh = (im_data.size(2) // 32) * 32 + 32
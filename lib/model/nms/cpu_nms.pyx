@@ -0,0 +1,139 @@
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+cimport cython
+import numpy as np
+cimport numpy as np
+from libc.math cimport expf
+
+DTYPE = np.float32
+ctypedef np.float32_t DTYPE_t
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def cpu_nms(np.ndarray[DTYPE_t, ndim=2] boxes, float thresh):
+    """
+    Greedy NMS over boxes already sorted by decreasing score.
+
+    Parameters
+    ----------
+    boxes: (N, 4+) float32 ndarray of x1, y1, x2, y2
+    thresh: boxes overlapping a kept box by more than thresh are removed
+    Returns
+    -------
+    keep: int32 ndarray of the kept indices, in input order
+
+    The IoU is evaluated in float32 with the operation order of devIoU in
+    nms_cuda_kernel.cu.
+    """
+    cdef int N = boxes.shape[0]
+    cdef np.ndarray[np.uint8_t, ndim=1] suppressed = np.zeros(N, dtype=np.uint8)
+    cdef np.ndarray[np.int32_t, ndim=1] keep = np.zeros(N, dtype=np.int32)
+    cdef np.ndarray[DTYPE_t, ndim=1] areas = np.zeros(N, dtype=DTYPE)
+    cdef int num_keep = 0
+    cdef int i, j
+    cdef float ix1, iy1, ix2, iy2, iarea
+    cdef float left, right, top, bottom, width, height, inter, iou
+
+    for i in range(N):
+        areas[i] = (boxes[i, 2] - boxes[i, 0] + 1) * (boxes[i, 3] - boxes[i, 1] + 1)
+
+    for i in range(N):
+        if suppressed[i]:
+            continue
+        keep[num_keep] = i
+        num_keep += 1
+        ix1 = boxes[i, 0]
+        iy1 = boxes[i, 1]
+        ix2 = boxes[i, 2]
+        iy2 = boxes[i, 3]
+        iarea = areas[i]
+        for j in range(i + 1, N):
+            if suppressed[j]:
+                continue
+            left = max(ix1, boxes[j, 0])
+            right = min(ix2, boxes[j, 2])
+            top = max(iy1, boxes[j, 1])
+            bottom = min(iy2, boxes[j, 3])
+            width = max(right - left + 1, <float>0)
+            height = max(bottom - top + 1, <float>0)
+            inter = width * height
+            iou = inter / (iarea + areas[j] - inter)
+            if iou > thresh:
+                suppressed[j] = 1
+
+    return keep[:num_keep]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def cpu_soft_nms(np.ndarray[DTYPE_t, ndim=2] boxes, np.ndarray[DTYPE_t, ndim=1] scores,
+                 float thresh, int method, float sigma, float min_score):
+    """
+    Soft-NMS (Bodla et al., 2017) over boxes in any order.
+
+    Parameters
+    ----------
+    boxes: (N, 4+) float32 ndarray of x1, y1, x2, y2
+    scores: (N,) float32 ndarray
+    thresh: with method 1 (linear), boxes overlapping the picked box by more
+            than thresh have their score scaled by 1 - IoU
+    method: 1 for linear, 2 for Gaussian decay exp(-IoU^2 / sigma)
+    min_score: boxes decayed below min_score stop taking part
+    Returns
+    -------
+    out: (N,) float32 ndarray of the decayed scores, in input order; the
+         scores of the dropped boxes are below min_score
+
+    The box with the highest remaining score (the lowest index on ties) is
+    picked at every step, with the same IoU as cpu_nms.
+    """
+    cdef int N = boxes.shape[0]
+    cdef np.ndarray[DTYPE_t, ndim=1] out = scores.copy()
+    cdef np.ndarray[np.int32_t, ndim=1] alive = np.flatnonzero(scores >= min_score).astype(np.int32)
+    cdef np.ndarray[DTYPE_t, ndim=1] areas = np.zeros(N, dtype=DTYPE)
+    cdef int num_alive = alive.shape[0]
+    cdef int best, i, j, k, pos
+    cdef float ix1, iy1, ix2, iy2, iarea
+    cdef float left, right, top, bottom, width, height, inter, iou, weight
+
+    for i in range(N):
+        areas[i] = (boxes[i, 2] - boxes[i, 0] + 1) * (boxes[i, 3] - boxes[i, 1] + 1)
+
+    while num_alive > 0:
+        best = 0
+        for pos in range(1, num_alive):
+            if out[alive[pos]] > out[alive[best]]:
+                best = pos
+        i = alive[best]
+        ix1 = boxes[i, 0]
+        iy1 = boxes[i, 1]
+        ix2 = boxes[i, 2]
+        iy2 = boxes[i, 3]
+        iarea = areas[i]
+        # decay the others, compacting the survivors in index order
+        k = 0
+        for pos in range(num_alive):
+            j = alive[pos]
+            if j == i:
+                continue
+            left = max(ix1, boxes[j, 0])
+            right = min(ix2, boxes[j, 2])
+            top = max(iy1, boxes[j, 1])
+            bottom = min(iy2, boxes[j, 3])
+            width = max(right - left + 1, <float>0)
+            height = max(bottom - top + 1, <float>0)
+            inter = width * height
+            iou = inter / (iarea + areas[j] - inter)
+            if method == 1:
+                weight = 1 - iou if iou > thresh else 1
+            else:
+                weight = expf(-iou * iou / sigma)
+            out[j] = out[j] * weight
+            if out[j] >= min_score:
+                alive[k] = j
+                k += 1
+        num_alive = k
+
+    return out
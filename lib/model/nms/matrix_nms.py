@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+import torch
+
+# IoU entries per block of rows, bounds the memory of large groups
+_BLOCK_ELEMENTS = 1 << 22
+
+
+def _batched_iou(a, b, area_a, area_b):
+    """(G, n, m) IoU of the (G, n, 4) boxes a with the (G, m, 4) boxes b."""
+    width = torch.min(a[:, :, 2:3], b[:, :, 2].unsqueeze(1))
+    width.sub_(torch.max(a[:, :, 0:1], b[:, :, 0].unsqueeze(1))).add_(1).clamp_(min=0)
+    height = torch.min(a[:, :, 3:4], b[:, :, 3].unsqueeze(1))
+    height.sub_(torch.max(a[:, :, 1:2], b[:, :, 1].unsqueeze(1))).add_(1).clamp_(min=0)
+    inter = width.mul_(height)
+    union = area_a.unsqueeze(2) + area_b.unsqueeze(1)
+    return inter.div_(union.sub_(inter))
+
+
+def matrix_nms_decay(boxes, method, sigma):
+    """Matrix-NMS (Wang et al., SOLOv2) decay factors of G groups of boxes.
+
+    boxes is (G, M, 4), every group sorted by decreasing score; groups can
+    be padded with any boxes at their end. The decay of box j is the
+    minimum over the higher scoring boxes i of f(iou_ij) / f(iou_i), with
+    iou_i the largest IoU of box i with a box above it, and f(x) = 1 - x
+    for method 1 (linear) or exp(-x^2 / sigma) for method 2 (Gaussian).
+
+    All pairs are computed at once; large groups are split into blocks of
+    rows, and the compensation of a row is complete when its block comes
+    since it only depends on the rows above. Returns the (G, M) decays.
+    """
+    num_groups, num_boxes = boxes.size(0), boxes.size(1)
+    boxes = boxes.float()
+    areas = (boxes[:, :, 2] - boxes[:, :, 0] + 1) * (boxes[:, :, 3] - boxes[:, :, 1] + 1)
+    compensate = boxes.new_zeros(num_groups, num_boxes)
+    decay = boxes.new_ones(num_groups, num_boxes)
+    block = max(1, _BLOCK_ELEMENTS // max(num_groups * num_boxes, 1))
+    for start in range(0, num_boxes, block):
+        end = min(start + block, num_boxes)
+        # iou[g, i, j] of rows start + i above columns start + j only
+        upper = torch.ones(end - start, num_boxes - start, device=boxes.device).triu_(1)
+        iou = _batched_iou(boxes[:, start:end], boxes[:, start:],
+                           areas[:, start:end], areas[:, start:]).mul_(upper)
+        compensate[:, start:] = torch.max(compensate[:, start:], iou.max(1)[0])
+        # the other entries are 0 and give factors >= 1, a no-op for the min
+        comp = compensate[:, start:end].unsqueeze(2)
+        if method == 1:
+            factor = iou.neg_().add_(1).div_((1 - comp).clamp(min=1e-6)).min(1)[0]
+        else:
+            # exp is monotonic, take the min of the exponent
+            factor = torch.exp((comp * comp - iou.mul_(iou)).min(1)[0] / sigma)
+        decay[:, start:] = torch.min(decay[:, start:], factor)
+    return decay
@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+import torch
+from model.nms.nms_wrapper import nms, soft_nms, SOFT_NMS_MODES
+from model.utils.config import cfg
+
+
+def _group_chunks(group_rank, max_boxes):
+    """Candidate indices grouped by group_rank, each group in its original
+    order, split into chunks of whole groups holding at most max_boxes
+    candidates unless a single group is larger (max_boxes <= 0: one chunk)."""
+    num = group_rank.numel()
+    position = torch.arange(num, dtype=torch.long, device=group_rank.device)
+    _, by_group = torch.sort(group_rank * num + position)
+    if max_boxes <= 0 or num <= max_boxes:
+        return [by_group]
+    chunks, start, size = [], 0, 0
+    for count in torch.bincount(group_rank).tolist():
+        if size > 0 and size + count > max_boxes:
+            chunks.append(by_group[start:start + size])
+            start, size = start + size, 0
+        size += count
+    chunks.append(by_group[start:])
+    return chunks
+
+
+def multiclass_nms(boxes, scores, nms_thresh, score_thresh=0., max_per_image=0,
+                   out_device=None, mode='nms'):
+    """Per-class NMS of all classes of all images of a batch.
+
+    boxes is (B, R, 4) for class-agnostic boxes or (B, R, 4 * C), scores is
+    (B, R, C) with class 0 the background. Detections scoring above
+    score_thresh are shifted by their (image, class) group so that boxes
+    of different groups never overlap, and suppressed by nms calls over
+    whole groups of at most cfg.TEST.NMS_MAX_BOXES candidates together.
+    With a mode of SOFT_NMS_MODES, the groups are rescored by soft_nms()
+    instead and the detections keeping at least cfg.TEST.NMS_MIN_SCORE
+    remain, with their new scores. With max_per_image > 0, only the
+    detections scoring at least the max_per_image-th best kept score of
+    their image remain.
+
+    Returns dets and keep, indexed [image][class]: dets are (K, 5) tensors
+    of x1, y1, x2, y2, score in decreasing score order and keep the indices
+    of their rois; both are empty for class 0. They are split from one
+    tensor each, moved to out_device (default: the device of scores).
+    """
+    batch_size, num_rois, num_classes = scores.size()
+    if out_device is None:
+        out_device = scores.device
+
+    cand = torch.nonzero(scores[:, :, 1:] > score_thresh)
+    if cand.numel() > 0:
+        image_idx, roi_idx, class_idx = cand[:, 0], cand[:, 1], cand[:, 2] + 1
+        cand_scores = scores[image_idx, roi_idx, class_idx]
+        if boxes.size(2) == 4:
+            cand_boxes = boxes[image_idx, roi_idx]
+        else:
+            cand_boxes = boxes.view(batch_size, num_rois, num_classes, 4)[
+                image_idx, roi_idx, class_idx]
+
+        _, order = torch.sort(cand_scores, 0, True)
+        image_idx, roi_idx, class_idx = image_idx[order], roi_idx[order], class_idx[order]
+        cand_scores, cand_boxes = cand_scores[order], cand_boxes[order]
+
+        group = image_idx * num_classes + class_idx
+        if mode in SOFT_NMS_MODES:
+            cand_scores = soft_nms(torch.cat((cand_boxes, cand_scores.unsqueeze(1)), 1),
+                                   nms_thresh, mode, groups=group)
+            keep = torch.nonzero(cand_scores >= cfg.TEST.NMS_MIN_SCORE).view(-1)
+            _, order = torch.sort(cand_scores[keep], 0, True)
+            keep = keep[order]
+        else:
+            # contiguous groups, each offset by its rank inside its chunk
+            _, group_rank = torch.unique(group, sorted=True, return_inverse=True)
+            span = cand_boxes.max() - cand_boxes.min() + 1
+            keep = []
+            for chunk in _group_chunks(group_rank, cfg.TEST.NMS_MAX_BOXES):
+                offset = (group_rank[chunk] - group_rank[chunk[:1]]).to(cand_boxes.dtype) * span
+                dets = torch.cat((cand_boxes[chunk] + offset.unsqueeze(1),
+                                  cand_scores[chunk].unsqueeze(1)), 1)
+                keep.append(chunk[nms(dets, nms_thresh).long().view(-1).to(chunk.device)])
+            # back to decreasing score order
+            keep = torch.sort(torch.cat(keep), 0)[0]
+    else:
+        keep = cand.new_zeros(0)
+
+    if keep.numel() > 0 and max_per_image > 0:
+        # kept detections are in decreasing score order, rank them per image
+        kept_images = image_idx[keep]
+        position = torch.arange(keep.numel(), dtype=torch.long, device=keep.device)
+        _, by_image = torch.sort(kept_images * keep.numel() + position)
+        counts = torch.bincount(kept_images, minlength=batch_size)
+        starts = torch.cumsum(counts, 0) - counts
+        rank = torch.empty_like(position)
+        rank[by_image] = position - starts[kept_images[by_image]]
+        # the max_per_image-th best score of every image that has more
+        cut = keep[rank == max_per_image - 1]
+        image_thresh = cand_scores.new_full((batch_size,), float('-inf'))
+        image_thresh[image_idx[cut]] = cand_scores[cut]
+        image_thresh[counts <= max_per_image] = float('-inf')
+        keep = keep[cand_scores[keep] >= image_thresh[kept_images]]
+
+    num_groups = batch_size * num_classes
+    if keep.numel() > 0:
+        # group by (image, class), keeping the score order inside a group
+        group = group[keep]
+        position = torch.arange(keep.numel(), dtype=torch.long, device=keep.device)
+        _, by_group = torch.sort(group * keep.numel() + position)
+        keep = keep[by_group]
+        counts = torch.bincount(group[by_group], minlength=num_groups).tolist()
+        dets = torch.cat((cand_boxes[keep], cand_scores[keep].unsqueeze(1)), 1)
+        rois = roi_idx[keep]
+    else:
+        counts = [0] * num_groups
+        dets = scores.new_zeros(0, 5)
+        rois = cand.new_zeros(0)
+
+    dets = torch.split(dets.to(out_device), counts)
+    rois = torch.split(rois.to(out_device), counts)
+    return ([list(dets[b * num_classes:(b + 1) * num_classes]) for b in range(batch_size)],
+            [list(rois[b * num_classes:(b + 1) * num_classes]) for b in range(batch_size)])
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+import torch
+from model.utils.config import cfg
+
+try:
+    from model.nms.cpu_nms import cpu_nms, cpu_soft_nms
+except ImportError:
+    cpu_nms = cpu_soft_nms = None
+
+# boxes per IoU block of the vectorized path
+_BLOCK = 256
+
+
+def _iou(a, b):
+    """IoU of every box of a with every box of b, in float32 with the
+    operation order of devIoU in nms_cuda_kernel.cu."""
+    left = torch.max(a[:, 0:1], b[:, 0])
+    right = torch.min(a[:, 2:3], b[:, 2])
+    top = torch.max(a[:, 1:2], b[:, 1])
+    bottom = torch.min(a[:, 3:4], b[:, 3])
+    width = (right - left + 1).clamp(min=0)
+    height = (bottom - top + 1).clamp(min=0)
+    inter = width * height
+    area_a = (a[:, 2] - a[:, 0] + 1) * (a[:, 3] - a[:, 1] + 1)
+    area_b = (b[:, 2] - b[:, 0] + 1) * (b[:, 3] - b[:, 1] + 1)
+    return inter / (area_a.view(-1, 1) + area_b.view(1, -1) - inter)
+
+
+def _nms_blocked(boxes, thresh):
+    n = boxes.size(0)
+    suppressed = torch.zeros(n, dtype=torch.uint8)
+    keep = []
+    for start in range(0, n, _BLOCK):
+        end = min(start + _BLOCK, n)
+        alive = suppressed[start:end] == 0
+        if not alive.any():
+            continue
+        block = boxes[start:end]
+        # over[i, j]: box i of the block suppresses the later box j
+        over = (_iou(block, block) > thresh).triu(1)
+        # greedy NMS inside the block is the unique fixed point of
+        # kept[j] = alive[j] and no kept i < j suppresses j
+        kept = alive
+        while True:
+            update = alive & ((over & kept.view(-1, 1)).max(0)[0] == 0)
+            if torch.equal(update, kept):
+                break
+            kept = update
+        keep.append(torch.nonzero(kept).view(-1) + start)
+
+        if end < n:
+            rest = torch.nonzero(suppressed[end:] == 0).view(-1) + end
+            if rest.numel() > 0:
+                hit = (_iou(block[kept], boxes[rest]) > thresh).max(0)[0]
+                suppressed[rest[hit]] = 1
+    if not keep:
+        return torch.zeros(0, dtype=torch.long)
+    return torch.cat(keep)
+
+
+def nms_cpu(dets, thresh):
+    """NMS of (N, 5) dets sorted by decreasing score, on the CPU.
+
+    Returns the kept indices as an (K, 1) IntTensor, like nms_gpu. Lists of
+    at least cfg.NMS_CPU_LOOP_MIN_BOXES boxes go to the compiled greedy loop
+    when it is built, smaller ones to the vectorized block IoU path. Both
+    follow the greedy rule and the float32 IoU of the GPU kernel, so they
+    keep the same boxes as it whenever the IoUs round the same way, e.g.
+    for integer coordinates; nvcc may fuse the IoU arithmetic otherwise.
+    """
+    boxes = dets[:, :4].detach().cpu().float().contiguous()
+    if cpu_nms is not None and boxes.size(0) >= cfg.NMS_CPU_LOOP_MIN_BOXES:
+        keep = torch.from_numpy(cpu_nms(boxes.numpy(), thresh))
+    else:
+        keep = _nms_blocked(boxes, thresh)
+    return keep.int().view(-1, 1)
+
+
+def _soft_nms_loop(boxes, scores, thresh, method, sigma, min_score):
+    out = scores.clone()
+    alive = torch.nonzero(out >= min_score).view(-1)
+    while alive.numel() > 0:
+        best = int(torch.argmax(out[alive]))
+        i = alive[best]
+        alive = torch.cat((alive[:best], alive[best + 1:]))
+        if alive.numel() == 0:
+            break
+        iou = _iou(boxes[i].view(1, 4), boxes[alive]).view(-1)
+        if method == 1:
+            weight = torch.where(iou > thresh, 1 - iou, torch.ones_like(iou))
+        else:
+            weight = torch.exp(-iou * iou / sigma)
+        out[alive] = out[alive] * weight
+        alive = alive[out[alive] >= min_score]
+    return out
+
+
+def soft_nms_cpu(boxes, scores, thresh, method, sigma, min_score):
+    """Soft-NMS of (N, 4) boxes with (N,) scores, on the CPU.
+
+    method is 1 for the linear and 2 for the Gaussian decay. Returns the
+    decayed (N,) float scores in input order; boxes that fell below
+    min_score are out of the game and keep the score they fell to.
+    """
+    boxes = boxes.detach().cpu().float().contiguous()
+    scores = scores.detach().cpu().float().contiguous()
+    if cpu_soft_nms is not None:
+        return torch.from_numpy(cpu_soft_nms(boxes.numpy(), scores.numpy(), thresh,
+                                             method, sigma, min_score))
+    return _soft_nms_loop(boxes, scores, thresh, method, sigma, min_score)
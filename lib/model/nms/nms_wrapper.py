@@ -6,7 +6,18 @@
 # --------------------------------------------------------
 import torch
 from model.utils.config import cfg
-from model.nms.nms_gpu import nms_gpu
+from model.nms.nms_cpu import nms_cpu, soft_nms_cpu
+from model.nms.matrix_nms import matrix_nms_decay
+
+try:
+    from model.nms.nms_gpu import nms_gpu
+except ImportError:
+    # the CUDA extension is not built, e.g. on CPU-only machines
+    nms_gpu = None
+
+# cfg.TEST.MODE values that rescore instead of removing, and their decay
+SOFT_NMS_MODES = {'soft_linear': 1, 'soft_gaussian': 2,
+                  'matrix_linear': 1, 'matrix_gaussian': 2}
 
 def nms(dets, thresh, force_cpu=False):
     """Dispatch to either CPU or GPU NMS implementations."""
@@ -15,4 +26,52 @@ def nms(dets, thresh, force_cpu=False):
     # ---numpy version---
     # original: return gpu_nms(dets, thresh, device_id=cfg.GPU_ID)
     # ---pytorch version---
+    if force_cpu or not cfg.USE_GPU_NMS or not dets.is_cuda or nms_gpu is None:
+        return nms_cpu(dets, thresh).to(dets.device)
     return nms_gpu(dets, thresh)
+
+def soft_nms(dets, thresh, mode, groups=None):
+    """Scores of the (N, 5) dets after Soft-NMS or Matrix-NMS.
+
+    mode is one of SOFT_NMS_MODES; the Gaussian decays use cfg.TEST.NMS_SIGMA
+    and thresh only matters to 'soft_linear'. With groups, an (N,) tensor of
+    ids, only dets of the same group decay each other. The dets must be
+    sorted by decreasing score inside every group for the matrix modes.
+
+    Returns the decayed (N,) scores on the device of dets; dets scoring
+    below cfg.TEST.NMS_MIN_SCORE afterwards are meant to be dropped. Soft-NMS
+    runs on the CPU, Matrix-NMS with tensor ops wherever dets are.
+    """
+    num_dets = dets.size(0)
+    if num_dets == 0:
+        return dets.new_zeros(0)
+    method = SOFT_NMS_MODES[mode]
+    position = torch.arange(num_dets, dtype=torch.long, device=dets.device)
+    if groups is None:
+        group = torch.zeros_like(position)
+    else:
+        _, group = torch.unique(groups, sorted=True, return_inverse=True)
+    # contiguous groups, each in its original order
+    _, order = torch.sort(group * num_dets + position)
+    group = group[order]
+    counts = torch.bincount(group)
+    boxes, scores = dets[order, :4], dets[order, 4]
+
+    if mode.startswith('soft'):
+        out = torch.cat([soft_nms_cpu(b, s, thresh, method, cfg.TEST.NMS_SIGMA,
+                                      cfg.TEST.NMS_MIN_SCORE)
+                         for b, s in zip(torch.split(boxes, counts.tolist()),
+                                         torch.split(scores, counts.tolist()))])
+        out = out.to(dets.device).type_as(scores)
+    else:
+        # groups padded to the largest one at their end
+        starts = torch.cumsum(counts, 0) - counts
+        rank = position - starts[group]
+        padded = boxes.new_zeros(counts.size(0), int(counts.max()), 4)
+        padded[group, rank] = boxes
+        decay = matrix_nms_decay(padded, method, cfg.TEST.NMS_SIGMA)
+        out = scores * decay[group, rank].type_as(scores)
+
+    rescored = torch.empty_like(out)
+    rescored[order] = out
+    return rescored
@@ -3,10 +3,8 @@ import os
 import torch
 from torch.utils.ffi import create_extension
 
-# sources = ['src/roi_align.c']
-# headers = ['src/roi_align.h']
-sources = []
-headers = []
+sources = ['src/roi_align.c']
+headers = ['src/roi_align.h']
 defines = []
 with_cuda = False
 
@@ -29,7 +27,9 @@ ffi = create_extension(
     define_macros=defines,
     relative_to=__file__,
     with_cuda=with_cuda,
-    extra_objects=extra_objects
+    extra_objects=extra_objects,
+    extra_compile_args=['-fopenmp'],
+    extra_link_args=['-fopenmp']
 )
 
 if __name__ == '__main__':
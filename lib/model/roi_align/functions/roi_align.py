@@ -26,21 +26,30 @@ class RoIAlignFunction(Function):
                                              self.spatial_scale, features,
                                              rois, output)
         else:
-            raise NotImplementedError
+            roi_align.roi_align_forward(self.aligned_height,
+                                        self.aligned_width,
+                                        self.spatial_scale, features.contiguous(),
+                                        rois.contiguous(), output)
 
         return output
 
     def backward(self, grad_output):
-        assert(self.feature_size is not None and grad_output.is_cuda)
+        assert(self.feature_size is not None)
 
         batch_size, num_channels, data_height, data_width = self.feature_size
 
         grad_input = self.rois.new(batch_size, num_channels, data_height,
                                   data_width).zero_()
-        roi_align.roi_align_backward_cuda(self.aligned_height,
-                                          self.aligned_width,
-                                          self.spatial_scale, grad_output,
-                                          self.rois, grad_input)
+        if grad_output.is_cuda:
+            roi_align.roi_align_backward_cuda(self.aligned_height,
+                                              self.aligned_width,
+                                              self.spatial_scale, grad_output,
+                                              self.rois, grad_input)
+        else:
+            roi_align.roi_align_backward(self.aligned_height,
+                                         self.aligned_width,
+                                         self.spatial_scale, grad_output.contiguous(),
+                                         self.rois.contiguous(), grad_input)
 
         # print grad_input
 
@@ -0,0 +1,175 @@
+#include <TH/TH.h>
+#include <math.h>
+#include <stdlib.h>
+
+// The sampling points of ROI R = [batch_index x1 y1 x2 y2] as
+// ROIAlignForward in roi_align_kernel.cu places them: the offset of the top
+// left corner of the bilinear cell of every point and the weights of its
+// four corners, or -1 for the points outside the input
+static void roi_align_points(const float * roi, float spatial_scale,
+                             int aligned_height, int aligned_width, int height, int width,
+                             int * offsets, float * weights)
+{
+    float roi_start_w = roi[1] * spatial_scale;
+    float roi_start_h = roi[2] * spatial_scale;
+    float roi_end_w = roi[3] * spatial_scale;
+    float roi_end_h = roi[4] * spatial_scale;
+
+    // Force malformed ROIs to be 1x1
+    float roi_width = fmaxf(roi_end_w - roi_start_w + 1., 0.);
+    float roi_height = fmaxf(roi_end_h - roi_start_h + 1., 0.);
+    float bin_size_h = roi_height / (aligned_height - 1.);
+    float bin_size_w = roi_width / (aligned_width - 1.);
+
+    int ph, pw;
+    for (ph = 0; ph < aligned_height; ++ph)
+    {
+        float h = (float)(ph) * bin_size_h + roi_start_h;
+        int hstart = fminf(floor(h), height - 2);
+        float h_ratio = h - (float)(hstart);
+        for (pw = 0; pw < aligned_width; ++pw)
+        {
+            float w = (float)(pw) * bin_size_w + roi_start_w;
+            int wstart = fminf(floor(w), width - 2);
+            float w_ratio = w - (float)(wstart);
+            int i = ph * aligned_width + pw;
+            if (h < 0 || h >= height || w < 0 || w >= width)
+            {
+                offsets[i] = -1;
+                continue;
+            }
+            offsets[i] = hstart * width + wstart;
+            weights[i * 4 + 0] = (1. - h_ratio) * (1. - w_ratio);
+            weights[i * 4 + 1] = (1. - h_ratio) * w_ratio;
+            weights[i * 4 + 2] = h_ratio * (1. - w_ratio);
+            weights[i * 4 + 3] = h_ratio * w_ratio;
+        }
+    }
+}
+
+int roi_align_forward(int aligned_height, int aligned_width, float spatial_scale,
+                      THFloatTensor * features, THFloatTensor * rois, THFloatTensor * output)
+{
+    // Grab the input tensor
+    float * data_flat = THFloatTensor_data(features);
+    float * rois_flat = THFloatTensor_data(rois);
+
+    float * output_flat = THFloatTensor_data(output);
+
+    // Number of ROIs
+    int num_rois = THFloatTensor_size(rois, 0);
+    int size_rois = THFloatTensor_size(rois, 1);
+    if (size_rois != 5)
+    {
+        return 0;
+    }
+    // Number of channels
+    int num_channels = THFloatTensor_size(features, 1);
+    // data height
+    int data_height = THFloatTensor_size(features, 2);
+    // data width
+    int data_width = THFloatTensor_size(features, 3);
+
+    // The points of a ROI are computed once for all the channels, the ROIs
+    // are split between the threads
+    const int points = aligned_height * aligned_width;
+    int n;
+    #pragma omp parallel for schedule(dynamic)
+    for (n = 0; n < num_rois; ++n)
+    {
+        int roi_batch_ind = rois_flat[n * 5 + 0];
+        int * offsets = (int *)malloc(points * sizeof(int));
+        float * weights = (float *)malloc(points * 4 * sizeof(float));
+        roi_align_points(rois_flat + n * 5, spatial_scale, aligned_height, aligned_width,
+                         data_height, data_width, offsets, weights);
+
+        int c, i;
+        for (c = 0; c < num_channels; ++c)
+        {
+            const float * bottom = data_flat + (roi_batch_ind * num_channels + c) * data_height * data_width;
+            float * top = output_flat + (n * num_channels + c) * points;
+            for (i = 0; i < points; ++i)
+            {
+                // bilinear interpolation, 0 outside the input
+                const int upleft = offsets[i];
+                if (upleft < 0)
+                {
+                    top[i] = 0.;
+                    continue;
+                }
+                const float * weight = weights + i * 4;
+                top[i] = bottom[upleft] * weight[0] + bottom[upleft + 1] * weight[1]
+                    + bottom[upleft + data_width] * weight[2] + bottom[upleft + data_width + 1] * weight[3];
+            }
+        }
+        free(offsets);
+        free(weights);
+    }
+    return 1;
+}
+
+int roi_align_backward(int aligned_height, int aligned_width, float spatial_scale,
+                       THFloatTensor * top_grad, THFloatTensor * rois, THFloatTensor * bottom_grad)
+{
+    // Grab the input tensor
+    float * top_grad_flat = THFloatTensor_data(top_grad);
+    float * rois_flat = THFloatTensor_data(rois);
+    float * bottom_grad_flat = THFloatTensor_data(bottom_grad);
+
+    // Number of ROIs
+    int num_rois = THFloatTensor_size(rois, 0);
+    int size_rois = THFloatTensor_size(rois, 1);
+    if (size_rois != 5)
+    {
+        return 0;
+    }
+    // Number of channels
+    int num_channels = THFloatTensor_size(bottom_grad, 1);
+    // data height
+    int data_height = THFloatTensor_size(bottom_grad, 2);
+    // data width
+    int data_width = THFloatTensor_size(bottom_grad, 3);
+    const int points = aligned_height * aligned_width;
+
+    int n;
+    int * offsets = (int *)malloc(num_rois * points * sizeof(int));
+    float * weights = (float *)malloc(num_rois * points * 4 * sizeof(float));
+    for (n = 0; n < num_rois; ++n)
+    {
+        roi_align_points(rois_flat + n * 5, spatial_scale, aligned_height, aligned_width,
+                         data_height, data_width, offsets + n * points, weights + n * points * 4);
+    }
+
+    // Every output element passes its gradient to the four corners it
+    // interpolates. Those of channel c are in channel c, so the channels are
+    // split between the threads without write conflicts, and the gradients
+    // add up in ROI order
+    int c;
+    #pragma omp parallel for
+    for (c = 0; c < num_channels; ++c)
+    {
+        int m, i;
+        for (m = 0; m < num_rois; ++m)
+        {
+            int roi_batch_ind = rois_flat[m * 5 + 0];
+            float * bottom = bottom_grad_flat + (roi_batch_ind * num_channels + c) * data_height * data_width;
+            const float * top = top_grad_flat + (m * num_channels + c) * points;
+            for (i = 0; i < points; ++i)
+            {
+                const int upleft = offsets[m * points + i];
+                if (upleft < 0)
+                {
+                    continue;
+                }
+                const float * weight = weights + (m * points + i) * 4;
+                bottom[upleft] += top[i] * weight[0];
+                bottom[upleft + 1] += top[i] * weight[1];
+                bottom[upleft + data_width] += top[i] * weight[2];
+                bottom[upleft + data_width + 1] += top[i] * weight[3];
+            }
+        }
+    }
+    free(offsets);
+    free(weights);
+    return 1;
+}
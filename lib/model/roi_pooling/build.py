@@ -28,7 +28,9 @@ ffi = create_extension(
     define_macros=defines,
     relative_to=__file__,
     with_cuda=with_cuda,
-    extra_objects=extra_objects
+    extra_objects=extra_objects,
+    extra_compile_args=['-fopenmp'],
+    extra_link_args=['-fopenmp']
 )
 
 if __name__ == '__main__':
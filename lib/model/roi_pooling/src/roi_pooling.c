@@ -1,104 +1,143 @@
 #include <TH/TH.h>
 #include <math.h>
+#include <stdlib.h>
+#include <float.h>
 
 int roi_pooling_forward(int pooled_height, int pooled_width, float spatial_scale,
-                        THFloatTensor * features, THFloatTensor * rois, THFloatTensor * output)
+                        THFloatTensor * features, THFloatTensor * rois, THFloatTensor * output,
+                        THIntTensor * argmax)
 {
     // Grab the input tensor
     float * data_flat = THFloatTensor_data(features);
     float * rois_flat = THFloatTensor_data(rois);
 
     float * output_flat = THFloatTensor_data(output);
+    int * argmax_flat = THIntTensor_data(argmax);
 
     // Number of ROIs
     int num_rois = THFloatTensor_size(rois, 0);
     int size_rois = THFloatTensor_size(rois, 1);
-    // batch size
-    int batch_size = THFloatTensor_size(features, 0);
-    if(batch_size != 1)
+    if (size_rois != 5)
     {
         return 0;
     }
+    // Number of channels
+    int num_channels = THFloatTensor_size(features, 1);
     // data height
-    int data_height = THFloatTensor_size(features, 1);
+    int data_height = THFloatTensor_size(features, 2);
     // data width
-    int data_width = THFloatTensor_size(features, 2);
-    // Number of channels
-    int num_channels = THFloatTensor_size(features, 3);
+    int data_width = THFloatTensor_size(features, 3);
 
-    // Set all element of the output tensor to -inf.
-    THFloatStorage_fill(THFloatTensor_storage(output), -1);
-
-    // For each ROI R = [batch_index x1 y1 x2 y2]: max pool over R
-    int index_roi = 0;
-    int index_output = 0;
+    // For each ROI R = [batch_index x1 y1 x2 y2]: max pool over R, the ROIs
+    // are split between the threads
     int n;
+    #pragma omp parallel for schedule(dynamic)
     for (n = 0; n < num_rois; ++n)
     {
-        int roi_batch_ind = rois_flat[index_roi + 0];
-        int roi_start_w = round(rois_flat[index_roi + 1] * spatial_scale);
-        int roi_start_h = round(rois_flat[index_roi + 2] * spatial_scale);
-        int roi_end_w = round(rois_flat[index_roi + 3] * spatial_scale);
-        int roi_end_h = round(rois_flat[index_roi + 4] * spatial_scale);
-        //      CHECK_GE(roi_batch_ind, 0);
-        //      CHECK_LT(roi_batch_ind, batch_size);
+        int roi_batch_ind = rois_flat[n * 5 + 0];
+        int roi_start_w = round(rois_flat[n * 5 + 1] * spatial_scale);
+        int roi_start_h = round(rois_flat[n * 5 + 2] * spatial_scale);
+        int roi_end_w = round(rois_flat[n * 5 + 3] * spatial_scale);
+        int roi_end_h = round(rois_flat[n * 5 + 4] * spatial_scale);
 
+        // Force malformed ROIs to be 1x1
         int roi_height = fmaxf(roi_end_h - roi_start_h + 1, 1);
         int roi_width = fmaxf(roi_end_w - roi_start_w + 1, 1);
         float bin_size_h = (float)(roi_height) / (float)(pooled_height);
         float bin_size_w = (float)(roi_width) / (float)(pooled_width);
 
-        int index_data = roi_batch_ind * data_height * data_width * num_channels;
-        const int output_area = pooled_width * pooled_height;
-
-        int c, ph, pw;
+        // The bins are the products of row and column ranges, clipped to
+        // the input, computed once for all the channels
+        int * hstarts = (int *)malloc(2 * (pooled_height + pooled_width) * sizeof(int));
+        int * hends = hstarts + pooled_height;
+        int * wstarts = hends + pooled_height;
+        int * wends = wstarts + pooled_width;
+        int c, ph, pw, h, w;
         for (ph = 0; ph < pooled_height; ++ph)
         {
-            for (pw = 0; pw < pooled_width; ++pw)
-            {
-                int hstart = (floor((float)(ph) * bin_size_h));
-                int wstart = (floor((float)(pw) * bin_size_w));
-                int hend = (ceil((float)(ph + 1) * bin_size_h));
-                int wend = (ceil((float)(pw + 1) * bin_size_w));
-
-                hstart = fminf(fmaxf(hstart + roi_start_h, 0), data_height);
-                hend = fminf(fmaxf(hend + roi_start_h, 0), data_height);
-                wstart = fminf(fmaxf(wstart + roi_start_w, 0), data_width);
-                wend = fminf(fmaxf(wend + roi_start_w, 0), data_width);
+            hstarts[ph] = fminf(fmaxf((int)(floor((float)(ph) * bin_size_h)) + roi_start_h, 0), data_height);
+            hends[ph] = fminf(fmaxf((int)(ceil((float)(ph + 1) * bin_size_h)) + roi_start_h, 0), data_height);
+        }
+        for (pw = 0; pw < pooled_width; ++pw)
+        {
+            wstarts[pw] = fminf(fmaxf((int)(floor((float)(pw) * bin_size_w)) + roi_start_w, 0), data_width);
+            wends[pw] = fminf(fmaxf((int)(ceil((float)(pw + 1) * bin_size_w)) + roi_start_w, 0), data_width);
+        }
 
-                const int pool_index = index_output + (ph * pooled_width + pw);
-                int is_empty = (hend <= hstart) || (wend <= wstart);
-                if (is_empty)
-                {
-                    for (c = 0; c < num_channels * output_area; c += output_area)
-                    {
-                        output_flat[pool_index + c] = 0;
-                    }
-                }
-                else
+        for (c = 0; c < num_channels; ++c)
+        {
+            // NCHW: the pooled region of a channel is read from its own plane
+            const int data_offset = (roi_batch_ind * num_channels + c) * data_height * data_width;
+            float * top = output_flat + (n * num_channels + c) * pooled_height * pooled_width;
+            int * top_argmax = argmax_flat + (n * num_channels + c) * pooled_height * pooled_width;
+            for (ph = 0; ph < pooled_height; ++ph)
+            {
+                for (pw = 0; pw < pooled_width; ++pw)
                 {
-                    int h, w, c;
-                    for (h = hstart; h < hend; ++h)
+                    int is_empty = (hends[ph] <= hstarts[ph]) || (wends[pw] <= wstarts[pw]);
+
+                    // Define an empty pooling region to be zero
+                    float maxval = is_empty ? 0 : -FLT_MAX;
+                    // If nothing is pooled, argmax = -1 causes nothing to be backprop'd
+                    int maxidx = -1;
+                    for (h = hstarts[ph]; h < hends[ph]; ++h)
                     {
-                        for (w = wstart; w < wend; ++w)
+                        const int row = data_offset + h * data_width;
+                        for (w = wstarts[pw]; w < wends[pw]; ++w)
                         {
-                            for (c = 0; c < num_channels; ++c)
+                            if (data_flat[row + w] > maxval)
                             {
-                                const int index = (h * data_width + w) * num_channels + c;
-                                if (data_flat[index_data + index] > output_flat[pool_index + c * output_area])
-                                {
-                                    output_flat[pool_index + c * output_area] = data_flat[index_data + index];
-                                }
+                                maxval = data_flat[row + w];
+                                maxidx = row + w;
                             }
                         }
                     }
+                    top[ph * pooled_width + pw] = maxval;
+                    top_argmax[ph * pooled_width + pw] = maxidx;
                 }
             }
         }
+        free(hstarts);
+    }
+    return 1;
+}
+
+int roi_pooling_backward(int pooled_height, int pooled_width, float spatial_scale,
+                         THFloatTensor * top_grad, THFloatTensor * rois, THFloatTensor * bottom_grad,
+                         THIntTensor * argmax)
+{
+    // Grab the input tensor
+    float * top_grad_flat = THFloatTensor_data(top_grad);
+    float * bottom_grad_flat = THFloatTensor_data(bottom_grad);
+    int * argmax_flat = THIntTensor_data(argmax);
+
+    // Number of ROIs
+    int num_rois = THFloatTensor_size(rois, 0);
+    // Number of channels
+    int num_channels = THFloatTensor_size(bottom_grad, 1);
+    const int output_area = pooled_height * pooled_width;
 
-        // Increment ROI index
-        index_roi += size_rois;
-        index_output += pooled_height * pooled_width * num_channels;
+    // Every pooled element passes its gradient to the element it took the
+    // max of. Those of channel c are in channel c, so the channels are split
+    // between the threads without write conflicts, and the gradients add up
+    // in ROI order as in the CUDA kernel
+    int c;
+    #pragma omp parallel for
+    for (c = 0; c < num_channels; ++c)
+    {
+        int n, i;
+        for (n = 0; n < num_rois; ++n)
+        {
+            const int offset = (n * num_channels + c) * output_area;
+            for (i = 0; i < output_area; ++i)
+            {
+                const int index = argmax_flat[offset + i];
+                if (index >= 0)
+                {
+                    bottom_grad_flat[index] += top_grad_flat[offset + i];
+                }
+            }
+        }
     }
     return 1;
-}
\ No newline at end of file
+}
@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Shifted anchor grids shared by the proposal and anchor target layers.
+
+The grid of a feature map only depends on its size, the feature stride and
+the anchor scales and ratios, and the ratio-grouped batches keep hitting
+the same few feature map sizes. grid_anchors() builds the (H * W * A, 4)
+grid with torch ops on the target device and keeps it in an LRU cache
+keyed by (feat_height, feat_width, stride, scales, ratios, device, dtype);
+inside_anchor_inds() memoizes the indices of the anchors lying inside an
+image the same way. The cached tensors are shared, callers must not
+modify them in place.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from model.utils.config import cfg
+from .generate_anchors import generate_anchors
+
+
+class _LRUCache(object):
+    """A thread-safe LRU mapping; DataParallel replicas run in threads."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+                return value
+        value = build()
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_anchor_cache = _LRUCache(cfg.ANCHOR_CACHE_SIZE)
+_inside_cache = _LRUCache(cfg.ANCHOR_CACHE_SIZE)
+
+
+def _grid_key(feat_height, feat_width, feat_stride, scales, ratios, device, dtype):
+    return (int(feat_height), int(feat_width), float(feat_stride),
+            tuple(float(s) for s in np.ravel(scales)),
+            tuple(float(r) for r in np.ravel(ratios)),
+            str(torch.device(device)), dtype)
+
+
+def _build_grid(feat_height, feat_width, feat_stride, scales, ratios, device, dtype):
+    base = torch.tensor(generate_anchors(scales=np.array(scales), ratios=np.array(ratios)),
+                        dtype=torch.float32, device=device)
+    shift_x = torch.arange(0, feat_width, dtype=torch.float32, device=device) * feat_stride
+    shift_y = torch.arange(0, feat_height, dtype=torch.float32, device=device) * feat_stride
+    # shift k = y * feat_width + x, as np.meshgrid(shift_x, shift_y) ravels
+    shift_x = shift_x.view(1, -1).expand(feat_height, feat_width)
+    shift_y = shift_y.view(-1, 1).expand(feat_height, feat_width)
+    shifts = torch.stack((shift_x, shift_y, shift_x, shift_y), 2).view(-1, 1, 4)
+    # anchor k * A + a is anchor a shifted to cell k
+    return (base.view(1, -1, 4) + shifts).view(-1, 4).to(dtype)
+
+
+def grid_anchors(feat_height, feat_width, feat_stride, scales, ratios, device,
+                 dtype=torch.float32):
+    """All anchors of a feature map, as a (feat_height * feat_width * A, 4)
+    tensor on device."""
+    key = _grid_key(feat_height, feat_width, feat_stride, scales, ratios, device, dtype)
+    return _anchor_cache.get(key, lambda: _build_grid(
+        int(feat_height), int(feat_width), feat_stride, scales, ratios, device, dtype))
+
+
+def inside_anchor_inds(feat_height, feat_width, feat_stride, scales, ratios,
+                       im_height, im_width, allowed_border=0, device='cpu',
+                       dtype=torch.float32):
+    """Indices of the grid anchors lying inside an im_height x im_width
+    image, up to allowed_border pixels."""
+    im_height, im_width = int(im_height), int(im_width)
+    key = (_grid_key(feat_height, feat_width, feat_stride, scales, ratios, device, dtype),
+           im_height, im_width, allowed_border)
+
+    def build():
+        anchors = grid_anchors(feat_height, feat_width, feat_stride, scales, ratios,
+                               device, dtype)
+        keep = ((anchors[:, 0] >= -allowed_border) &
+                (anchors[:, 1] >= -allowed_border) &
+                (anchors[:, 2] < im_width + allowed_border) &
+                (anchors[:, 3] < im_height + allowed_border))
+        return torch.nonzero(keep).view(-1)
+
+    return _inside_cache.get(key, build)
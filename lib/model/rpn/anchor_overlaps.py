@@ -0,0 +1,174 @@
+from __future__ import absolute_import
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Anchor/gt overlap statistics without the dense IoU tensor.
+
+_AnchorTargetLayer only needs, from the (B, N, K) IoUs of the N inside
+anchors with the K gt boxes, the best gt of every anchor and the best
+anchors of every gt. Most pairs do not intersect and have IoU 0: since the
+anchors form a regular grid, the intersection of the anchor a of cell
+(y, x) with gt box k is the product of a 1-D intersection with column x
+and one with row y, and the cells intersecting gt box k form a rectangle
+per base anchor. The pairs of these rectangles are enumerated in chunks,
+their exact IoU is computed, and the maxima are reduced with sorts of
+integer keys built from the rank of every IoU.
+"""
+
+import torch
+
+# intersecting pairs enumerated at once, bounds the memory
+_CHUNK_PAIRS = 1 << 16
+
+
+def _repeat(values, counts, total):
+    """values[i] repeated counts[i] times, counts summing to total."""
+    nonzero = torch.nonzero(counts > 0).view(-1)
+    counts = counts.index_select(0, nonzero)
+    # mark the first slot of every repeated value, the running count of the
+    # marks is then the index of the value of a slot
+    marks = counts.new_zeros(total)
+    marks.index_fill_(0, torch.cumsum(counts, 0) - counts, 1)
+    return values.index_select(0, nonzero).take(torch.cumsum(marks, 0) - 1)
+
+
+def _last_of_runs(sorted_keys):
+    """Mask of the last element of every run of equal sorted_keys."""
+    return torch.cat((sorted_keys[1:] != sorted_keys[:-1], sorted_keys.new_ones(1) > 0))
+
+
+def _overlap_interval(extent, inside, size):
+    """First cell and number of cells along one axis where the 1-D
+    intersections of extent, (B, K, size, A), are positive and inside."""
+    hit = (extent > 0) & inside
+    index = torch.arange(size, dtype=torch.long, device=extent.device).view(1, 1, -1, 1)
+    first = torch.where(hit, index, torch.full_like(index, size)).min(2)[0]
+    return first, hit.long().sum(2)
+
+
+def sparse_anchor_overlaps(all_anchors, inds_inside, gt_boxes, feat_height, feat_width):
+    """IoU statistics of the inside anchors and the gt boxes.
+
+    all_anchors is the grid_anchors() grid of a feat_height x feat_width
+    feature map, inds_inside the indices of the N anchors kept and gt_boxes
+    (B, K, 5). With overlaps = bbox_overlaps_batch(all_anchors[inds_inside],
+    gt_boxes), returns
+      max_overlaps, argmax_overlaps: (B, N), as torch.max(overlaps, 2), the
+        lowest gt on ties and 0 for an anchor overlapping none,
+      gt_max_overlaps: (B, K), as torch.max(overlaps, 1)[0],
+      gt_best: (B, N) number of gt boxes whose max overlap (1e-5 if 0) the
+        anchor reaches,
+    with memory bounded by _CHUNK_PAIRS intersecting pairs at a time.
+    """
+    batch_size, num_gt = gt_boxes.size(0), gt_boxes.size(1)
+    num_inside = inds_inside.size(0)
+    A = all_anchors.size(0) // (feat_height * feat_width)
+    device = gt_boxes.device
+
+    anchors = all_anchors[inds_inside]
+    anchors_area = (anchors[:, 2] - anchors[:, 0] + 1) * (anchors[:, 3] - anchors[:, 1] + 1)
+    anchors_area_zero = ((anchors[:, 2] - anchors[:, 0] + 1) == 1) & \
+                        ((anchors[:, 3] - anchors[:, 1] + 1) == 1)
+    # position of every grid anchor among the inside ones, -1 if outside
+    inside_pos = torch.full((all_anchors.size(0),), -1, dtype=torch.long, device=device)
+    inside_pos[inds_inside] = torch.arange(num_inside, dtype=torch.long, device=device)
+    usable = (inside_pos >= 0) & (((all_anchors[:, 2] - all_anchors[:, 0] + 1) != 1) |
+                                  ((all_anchors[:, 3] - all_anchors[:, 1] + 1) != 1))
+    usable = usable.view(feat_height, feat_width, A)
+
+    gt = gt_boxes[:, :, :4].contiguous()
+    gt_area = (gt[:, :, 2] - gt[:, :, 0] + 1) * (gt[:, :, 3] - gt[:, :, 1] + 1)
+    gt_valid = ((gt[:, :, 2] - gt[:, :, 0] + 1) != 1) | ((gt[:, :, 3] - gt[:, :, 1] + 1) != 1)
+
+    # 1. the anchor of cell (y, x) spans the columns of x and the rows of y,
+    # so its intersection with a gt box is iw[x] * ih[y]: (B, K, W, A) and
+    # (B, K, H, A) 1-D intersections, as bbox_overlaps_batch computes them
+    grid = all_anchors.view(feat_height, feat_width, A, 4)
+    gx1, gy1 = gt[:, :, 0].view(batch_size, num_gt, 1, 1), gt[:, :, 1].view(batch_size, num_gt, 1, 1)
+    gx2, gy2 = gt[:, :, 2].view(batch_size, num_gt, 1, 1), gt[:, :, 3].view(batch_size, num_gt, 1, 1)
+    iw = torch.min(grid[0, :, :, 2], gx2) - torch.max(grid[0, :, :, 0], gx1) + 1
+    ih = torch.min(grid[:, 0, :, 3], gy2) - torch.max(grid[:, 0, :, 1], gy1) + 1
+
+    # the cells intersecting a gt box form a rectangle per base anchor;
+    # keep it within the bounding rectangle of the usable anchors
+    first_x, nx = _overlap_interval(iw, usable.max(0)[0].view(1, 1, feat_width, A), feat_width)
+    first_y, ny = _overlap_interval(ih, usable.max(1)[0].view(1, 1, feat_height, A), feat_height)
+    counts = (nx * ny * gt_valid.long().view(batch_size, num_gt, 1)).view(-1)
+
+    # 2. enumerate the cells of the rectangles in chunks of whole gt boxes,
+    # in image and gt order, each chunk holding about _CHUNK_PAIRS pairs
+    max_overlaps = iw.new_zeros(batch_size * num_inside)
+    argmax_overlaps = torch.zeros(batch_size * num_inside, dtype=torch.long, device=device)
+    gt_max_overlaps = iw.new_zeros(batch_size * num_gt)
+    gt_best = torch.zeros(batch_size * num_inside, dtype=torch.long, device=device)
+    gt_slots = 1 << max(num_gt - 1, 1).bit_length()
+    starts = torch.cumsum(counts, 0) - counts
+    gt_counts = counts.view(-1, A).sum(1).tolist()
+    gt_start = 0
+    while gt_start < len(gt_counts):
+        gt_end, total = gt_start, 0
+        while gt_end < len(gt_counts) and (total == 0 or total + gt_counts[gt_end] <= _CHUNK_PAIRS):
+            total += gt_counts[gt_end]
+            gt_end += 1
+        chunk = torch.arange(gt_start * A, gt_end * A, dtype=torch.long, device=device)
+        gt_start = gt_end
+        if total == 0:
+            continue
+
+        triple = _repeat(chunk, counts.index_select(0, chunk), total)
+        offset = torch.arange(total, dtype=torch.long, device=device) + \
+            (starts.take(chunk[:1]) - starts.take(triple))
+        width = nx.take(triple)
+        x = first_x.take(triple) + offset % width
+        y = first_y.take(triple) + offset // width
+        del offset, width
+        a = triple % A
+        pair = triple // A
+        del triple
+        cell = (y * feat_width + x) * A + a
+        sel = torch.nonzero(usable.view(-1).take(cell)).view(-1)
+        pos = inside_pos.take(cell.index_select(0, sel))
+        pair = pair.index_select(0, sel)
+
+        # 3. exact IoU of the pairs
+        inter = iw.take(pair * (feat_width * A) + (x * A + a).index_select(0, sel)) * \
+                ih.take(pair * (feat_height * A) + (y * A + a).index_select(0, sel))
+        del cell, sel, x, y, a
+        iou = inter / (anchors_area.take(pos) + gt_area.take(pair) - inter)
+        del inter
+        if iou.numel() == 0:
+            continue
+        # the IoUs of the chunk ordered by their rank among its distinct ones
+        values, rank = torch.unique(iou, sorted=True, return_inverse=True)
+        num_ranks = values.numel()
+        k = pair % num_gt
+        row = pair // num_gt * num_inside + pos
+        del pos
+
+        # 4. best gt of every anchor in the chunk: the last of its pairs by
+        # (anchor, IoU, -gt); it only replaces a strictly lower best of the
+        # earlier chunks, whose gt boxes come first
+        _, order = torch.sort((row * num_ranks + rank) * gt_slots + (gt_slots - 1 - k))
+        best = order.masked_select(_last_of_runs(row.take(order)))
+        del order
+        best_row, best_iou = row.take(best), iou.take(best)
+        better = torch.nonzero(best_iou > max_overlaps.take(best_row)).view(-1)
+        max_overlaps.index_copy_(0, best_row.take(better), best_iou.take(better))
+        argmax_overlaps.index_copy_(0, best_row.take(better), k.take(best).take(better))
+        del best, best_row, best_iou, better, k
+
+        # 5. best IoU of every gt: the last of its sorted (gt, IoU) keys
+        keys = torch.sort(pair * num_ranks + rank)[0]
+        keys = keys.masked_select(_last_of_runs(keys // num_ranks))
+        gt_max_overlaps.index_copy_(0, keys // num_ranks, values.take(keys % num_ranks))
+        del keys, values, rank
+
+        # 6. anchors reaching the max overlap of a gt (never 0 here)
+        reach_row = row.masked_select(iou == gt_max_overlaps.take(pair))
+        gt_best.index_add_(0, reach_row, torch.ones_like(reach_row))
+
+    max_overlaps = max_overlaps.view(batch_size, num_inside)
+    max_overlaps[:, anchors_area_zero] = -1
+    return (max_overlaps, argmax_overlaps.view(batch_size, num_inside),
+            gt_max_overlaps.view(batch_size, num_gt), gt_best.view(batch_size, num_inside))
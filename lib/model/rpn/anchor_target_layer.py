@@ -15,7 +15,8 @@ import numpy as np
 import numpy.random as npr
 
 from model.utils.config import cfg
-from .generate_anchors import generate_anchors
+from .anchor_grid import grid_anchors, inside_anchor_inds
+from .anchor_overlaps import sparse_anchor_overlaps
 from .bbox_transform import clip_boxes, bbox_overlaps_batch, bbox_transform_batch
 
 import pdb
@@ -33,18 +34,23 @@ class _AnchorTargetLayer(nn.Module):
         Assign anchors to ground-truth targets. Produces anchor classification
         labels and bounding-box regression targets.
     """
-    def __init__(self, feat_stride, scales, ratios):
+    def __init__(self, feat_stride, scales, ratios, generator=None):
         super(_AnchorTargetLayer, self).__init__()
 
         self._feat_stride = feat_stride
         self._scales = scales
-        anchor_scales = scales
-        self._anchors = torch.from_numpy(generate_anchors(scales=np.array(anchor_scales), ratios=np.array(ratios))).float()
-        self._num_anchors = self._anchors.size(0)
+        self._ratios = ratios
+        self._num_anchors = len(scales) * len(ratios)
 
         # allow boxes to sit over the edge by a small amount
         self._allowed_border = 0  # default is 0
 
+        # torch.Generator of the fg/bg subsampling, for reproducible labels
+        # on the CPU only: pytorch 0.4.1 has no CUDA generator objects, so
+        # on the GPU leave it None and seed the default generator of the
+        # device with torch.cuda.manual_seed instead
+        self.generator = generator
+
     def forward(self, input):
         # Algorithm:
         #
@@ -64,28 +70,17 @@ class _AnchorTargetLayer(nn.Module):
         batch_size = gt_boxes.size(0)
 
         feat_height, feat_width = rpn_cls_score.size(2), rpn_cls_score.size(3)
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(rpn_cls_score).float()
-
         A = self._num_anchors
-        K = shifts.size(0)
-
-        self._anchors = self._anchors.type_as(gt_boxes) # move to specific gpu.
-        all_anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)
-        all_anchors = all_anchors.view(K * A, 4)
-
-        total_anchors = int(K * A)
 
-        keep = ((all_anchors[:, 0] >= -self._allowed_border) &
-                (all_anchors[:, 1] >= -self._allowed_border) &
-                (all_anchors[:, 2] < long(im_info[0][1]) + self._allowed_border) &
-                (all_anchors[:, 3] < long(im_info[0][0]) + self._allowed_border))
+        # cached per feature map size and device
+        all_anchors = grid_anchors(feat_height, feat_width, self._feat_stride,
+                                   self._scales, self._ratios, gt_boxes.device, gt_boxes.dtype)
+        total_anchors = all_anchors.size(0)
 
-        inds_inside = torch.nonzero(keep).view(-1)
+        inds_inside = inside_anchor_inds(feat_height, feat_width, self._feat_stride,
+                                         self._scales, self._ratios,
+                                         long(im_info[0][0]), long(im_info[0][1]),
+                                         self._allowed_border, gt_boxes.device, gt_boxes.dtype)
 
         # keep only inside anchors
         anchors = all_anchors[inds_inside, :]
@@ -95,17 +90,21 @@ class _AnchorTargetLayer(nn.Module):
         bbox_inside_weights = gt_boxes.new(batch_size, inds_inside.size(0)).zero_()
         bbox_outside_weights = gt_boxes.new(batch_size, inds_inside.size(0)).zero_()
 
-        overlaps = bbox_overlaps_batch(anchors, gt_boxes)
+        if cfg.TRAIN.RPN_SPARSE_OVERLAPS:
+            max_overlaps, argmax_overlaps, gt_max_overlaps, keep = sparse_anchor_overlaps(
+                all_anchors, inds_inside, gt_boxes, feat_height, feat_width)
+        else:
+            overlaps = bbox_overlaps_batch(anchors, gt_boxes)
+
+            max_overlaps, argmax_overlaps = torch.max(overlaps, 2)
+            gt_max_overlaps, _ = torch.max(overlaps, 1)
 
-        max_overlaps, argmax_overlaps = torch.max(overlaps, 2)
-        gt_max_overlaps, _ = torch.max(overlaps, 1)
+            gt_max_overlaps[gt_max_overlaps==0] = 1e-5
+            keep = torch.sum(overlaps.eq(gt_max_overlaps.view(batch_size,1,-1).expand_as(overlaps)), 2)
 
         if not cfg.TRAIN.RPN_CLOBBER_POSITIVES:
             labels[max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP] = 0
 
-        gt_max_overlaps[gt_max_overlaps==0] = 1e-5
-        keep = torch.sum(overlaps.eq(gt_max_overlaps.view(batch_size,1,-1).expand_as(overlaps)), 2)
-
         if torch.sum(keep) > 0:
             labels[keep>0] = 1
 
@@ -117,31 +116,8 @@ class _AnchorTargetLayer(nn.Module):
 
         num_fg = int(cfg.TRAIN.RPN_FG_FRACTION * cfg.TRAIN.RPN_BATCHSIZE)
 
-        sum_fg = torch.sum((labels == 1).int(), 1)
-        sum_bg = torch.sum((labels == 0).int(), 1)
-
-        for i in range(batch_size):
-            # subsample positive labels if we have too many
-            if sum_fg[i] > num_fg:
-                fg_inds = torch.nonzero(labels[i] == 1).view(-1)
-                # torch.randperm seems has a bug on multi-gpu setting that cause the segfault.
-                # See https://github.com/pytorch/pytorch/issues/1868 for more details.
-                # use numpy instead.
-                #rand_num = torch.randperm(fg_inds.size(0)).type_as(gt_boxes).long()
-                rand_num = torch.from_numpy(np.random.permutation(fg_inds.size(0))).type_as(gt_boxes).long()
-                disable_inds = fg_inds[rand_num[:fg_inds.size(0)-num_fg]]
-                labels[i][disable_inds] = -1
-
-            num_bg = cfg.TRAIN.RPN_BATCHSIZE - sum_fg[i]
-
-            # subsample negative labels if we have too many
-            if sum_bg[i] > num_bg:
-                bg_inds = torch.nonzero(labels[i] == 0).view(-1)
-                #rand_num = torch.randperm(bg_inds.size(0)).type_as(gt_boxes).long()
-
-                rand_num = torch.from_numpy(np.random.permutation(bg_inds.size(0))).type_as(gt_boxes).long()
-                disable_inds = bg_inds[rand_num[:bg_inds.size(0)-num_bg]]
-                labels[i][disable_inds] = -1
+        # subsample positive and negative labels if we have too many
+        _subsample_labels(labels, num_fg, cfg.TRAIN.RPN_BATCHSIZE, self.generator)
 
         offset = torch.arange(0, batch_size)*gt_boxes.size(1)
 
@@ -152,7 +128,8 @@ class _AnchorTargetLayer(nn.Module):
         bbox_inside_weights[labels==1] = cfg.TRAIN.RPN_BBOX_INSIDE_WEIGHTS[0]
 
         if cfg.TRAIN.RPN_POSITIVE_WEIGHT < 0:
-            num_examples = torch.sum(labels[i] >= 0)
+            # normalized by the last image, as the former per-image loop did
+            num_examples = torch.sum(labels[-1] >= 0)
             positive_weights = 1.0 / num_examples
             negative_weights = 1.0 / num_examples
         else:
@@ -212,6 +189,45 @@ def _unmap(data, count, inds, batch_size, fill=0):
     return ret
 
 
+def _subsample_labels(labels, num_fg, batch_size, generator=None):
+    """Randomly disable (set to -1) the positives of every row of labels
+    beyond num_fg, and its negatives beyond batch_size minus its number of
+    positives before subsampling, in place.
+
+    Every label gets a random key, in [0, 1) for the negatives and [2, 3)
+    for the positives (1.5 for the others). Per row, the negatives kept are
+    those with the smallest keys up to the row's quota and the positives
+    those with the largest ones; the cut keys come from one topk from each
+    end, bounded by batch_size and num_fg, and the labels beyond them are
+    disabled by a single masked fill. The keys are drawn in double
+    precision on the device of labels, so that ties at the cut are
+    negligible; generator, if given, is a CPU torch.Generator and labels
+    must then be on the CPU too (None draws from the default generator of
+    the device, which torch.manual_seed and torch.cuda.manual_seed seed).
+    """
+    num_labels = labels.size(1)
+    fg = labels == 1
+    bg = labels == 0
+    sum_fg = fg.long().sum(1, keepdim=True)
+    keep_fg = sum_fg.clamp(max=num_fg)
+    keep_bg = torch.min(bg.long().sum(1, keepdim=True), (batch_size - sum_fg).clamp(min=0))
+
+    keys = labels.new_empty(labels.size(), dtype=torch.float64).uniform_(generator=generator)
+    keys = torch.where(fg, keys + 2, torch.where(bg, keys, torch.full_like(keys, 1.5)))
+
+    cut_fg = keys.new_full(keep_fg.size(), 4)
+    if min(num_fg, num_labels) > 0:
+        largest = torch.topk(keys, min(num_fg, num_labels), 1)[0]
+        cut_fg = torch.where(keep_fg > 0, largest.gather(1, (keep_fg - 1).clamp(min=0)), cut_fg)
+    cut_bg = keys.new_full(keep_bg.size(), -1)
+    if min(batch_size, num_labels) > 0:
+        smallest = torch.topk(keys, min(batch_size, num_labels), 1, largest=False)[0]
+        cut_bg = torch.where(keep_bg > 0, smallest.gather(1, (keep_bg - 1).clamp(min=0)), cut_bg)
+
+    labels.masked_fill_((fg & (keys < cut_fg)) | (bg & (keys > cut_bg)), -1)
+    return labels
+
+
 def _compute_targets_batch(ex_rois, gt_rois):
     """Compute bounding-box regression targets for an image."""
 
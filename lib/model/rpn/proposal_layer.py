@@ -15,9 +15,9 @@ import numpy as np
 import math
 import yaml
 from model.utils.config import cfg
-from .generate_anchors import generate_anchors
+from .anchor_grid import grid_anchors
 from .bbox_transform import bbox_transform_inv, clip_boxes, clip_boxes_batch
-from model.nms.nms_wrapper import nms
+from model.nms.nms_wrapper import nms, soft_nms, SOFT_NMS_MODES
 
 import pdb
 
@@ -33,9 +33,9 @@ class _ProposalLayer(nn.Module):
         super(_ProposalLayer, self).__init__()
 
         self._feat_stride = feat_stride
-        self._anchors = torch.from_numpy(generate_anchors(scales=np.array(scales), 
-            ratios=np.array(ratios))).float()
-        self._num_anchors = self._anchors.size(0)
+        self._scales = scales
+        self._ratios = ratios
+        self._num_anchors = len(scales) * len(ratios)
 
         # rois blob: holds R regions of interest, each is a 5-tuple
         # (n, x1, y1, x2, y2) specifying an image batch index n and a
@@ -77,20 +77,9 @@ class _ProposalLayer(nn.Module):
         batch_size = bbox_deltas.size(0)
 
         feat_height, feat_width = scores.size(2), scores.size(3)
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(scores).float()
-
-        A = self._num_anchors
-        K = shifts.size(0)
-
-        self._anchors = self._anchors.type_as(scores)
-        # anchors = self._anchors.view(1, A, 4) + shifts.view(1, K, 4).permute(1, 0, 2).contiguous()
-        anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)
-        anchors = anchors.view(1, K * A, 4).expand(batch_size, K * A, 4)
+        anchors = grid_anchors(feat_height, feat_width, self._feat_stride,
+                               self._scales, self._ratios, scores.device, scores.dtype)
+        anchors = anchors.view(1, -1, 4).expand(batch_size, anchors.size(0), 4)
 
         # Transpose and reshape predicted bbox transformations to get them
         # into the same order as the anchors:
@@ -109,54 +98,68 @@ class _ProposalLayer(nn.Module):
         proposals = clip_boxes(proposals, im_info, batch_size)
         # proposals = clip_boxes_batch(proposals, im_info, batch_size)
 
-        # assign the score to 0 if it's non keep.
-        # keep = self._filter_boxes(proposals, min_size * im_info[:, 2])
-
-        # trim keep index to make it euqal over batch
-        # keep_idx = torch.cat(tuple(keep_idx), 0)
-
-        # scores_keep = scores.view(-1)[keep_idx].view(batch_size, trim_size)
-        # proposals_keep = proposals.view(-1, 4)[keep_idx, :].contiguous().view(batch_size, trim_size, 4)
-        
-        # _, order = torch.sort(scores_keep, 1, True)
-        
-        scores_keep = scores
-        proposals_keep = proposals
-        _, order = torch.sort(scores_keep, 1, True)
+        # 3. remove predicted boxes with either height or width < threshold
+        # (NOTE: convert min_size to input image scale stored in im_info[2]);
+        # their scores are masked in place so every image keeps its shape
+        keep = self._filter_boxes(proposals, min_size * im_info[:, 2])
+        scores.masked_fill_(keep == 0, float('-inf'))
+
+        # 4. sort all (proposal, score) pairs by score from highest to lowest
+        # 5. take top pre_nms_topN (e.g. 6000)
+        num_anchors = scores.size(1)
+        if pre_nms_topN > 0:
+            num_anchors = min(pre_nms_topN, num_anchors)
+        scores_keep, order = torch.topk(scores, num_anchors, 1)
+        proposals_keep = proposals.gather(1, order.unsqueeze(2).expand(batch_size, num_anchors, 4))
+
+        mode = cfg.TEST.MODE if cfg_key == 'TEST' else 'nms'
+        if mode in SOFT_NMS_MODES:
+            # 6. rescore the proposals of every image with Soft-NMS or
+            # Matrix-NMS, then rank the survivors by their new score
+            flat_scores = scores_keep.view(-1)
+            cand = torch.nonzero(flat_scores > float('-inf')).view(-1)
+            dets = torch.cat((proposals_keep.view(-1, 4)[cand],
+                              flat_scores[cand].unsqueeze(1)), 1)
+            rescored = soft_nms(dets, nms_thresh, mode, groups=cand // num_anchors)
+            alive = rescored >= cfg.TEST.NMS_MIN_SCORE
+            cand, rescored = cand[alive], rescored[alive]
+            _, order = torch.sort(rescored, 0, True)
+            cand = cand[order]
+            _, by_image = torch.sort(cand // num_anchors * cand.numel() +
+                                     torch.arange(cand.numel(), dtype=torch.long,
+                                                  device=cand.device))
+            keep_idx = cand[by_image]
+        else:
+            # 6. apply nms (e.g. threshold = 0.7) to every image; the masked
+            # proposals rank last in their image and are left out. One call
+            # per image keeps the suppression mask at pre_nms_topN^2 bits
+            # instead of growing with the square of the batch size
+            num_valid = (scores_keep > float('-inf')).long().sum(1).tolist()
+            keep_idx = [order.new_zeros(0)]
+            for i in range(batch_size):
+                if num_valid[i] == 0:
+                    continue
+                dets = torch.cat((proposals_keep[i, :num_valid[i]],
+                                  scores_keep[i, :num_valid[i]].unsqueeze(1)), 1)
+                keep_idx.append(nms(dets, nms_thresh).long().view(-1) + i * num_anchors)
+            keep_idx = torch.cat(keep_idx, 0)
+
+        # 7. take after_nms_topN (e.g. 300)
+        # 8. return the top proposals (-> RoIs top), padded with 0 at the end.
+        # the kept proposals of every image are contiguous and in score order
+        # (nms keeps the input order); their rank is the position in it
+        image_idx = keep_idx // num_anchors
+        counts = torch.bincount(image_idx, minlength=batch_size)
+        starts = torch.cumsum(counts, 0) - counts
+        rank = torch.arange(keep_idx.numel(), dtype=torch.long,
+                            device=keep_idx.device) - starts[image_idx]
+        top = rank < post_nms_topN
+        keep_idx, image_idx, rank = keep_idx[top], image_idx[top], rank[top]
 
         output = scores.new(batch_size, post_nms_topN, 5).zero_()
-        for i in range(batch_size):
-            # # 3. remove predicted boxes with either height or width < threshold
-            # # (NOTE: convert min_size to input image scale stored in im_info[2])
-            proposals_single = proposals_keep[i]
-            scores_single = scores_keep[i]
-
-            # # 4. sort all (proposal, score) pairs by score from highest to lowest
-            # # 5. take top pre_nms_topN (e.g. 6000)
-            order_single = order[i]
-
-            if pre_nms_topN > 0 and pre_nms_topN < scores_keep.numel():
-                order_single = order_single[:pre_nms_topN]
-
-            proposals_single = proposals_single[order_single, :]
-            scores_single = scores_single[order_single].view(-1,1)
-
-            # 6. apply nms (e.g. threshold = 0.7)
-            # 7. take after_nms_topN (e.g. 300)
-            # 8. return the top proposals (-> RoIs top)
-
-            keep_idx_i = nms(torch.cat((proposals_single, scores_single), 1), nms_thresh)
-            keep_idx_i = keep_idx_i.long().view(-1)
-
-            if post_nms_topN > 0:
-                keep_idx_i = keep_idx_i[:post_nms_topN]
-            proposals_single = proposals_single[keep_idx_i, :]
-            scores_single = scores_single[keep_idx_i, :]
-
-            # padding 0 at the end.
-            num_proposal = proposals_single.size(0)
-            output[i,:,0] = i
-            output[i,:num_proposal,1:] = proposals_single
+        output[:, :, 0] = torch.arange(batch_size, dtype=output.dtype,
+                                       device=output.device).view(-1, 1)
+        output[image_idx, rank, 1:] = proposals_keep.view(-1, 4)[keep_idx]
 
         return output
 
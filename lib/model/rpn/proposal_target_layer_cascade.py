@@ -23,9 +23,14 @@ class _ProposalTargetLayer(nn.Module):
     classification labels and bounding-box regression targets.
     """
 
-    def __init__(self, nclasses):
+    def __init__(self, nclasses, generator=None):
         super(_ProposalTargetLayer, self).__init__()
         self._num_classes = nclasses
+        # torch.Generator of the fg/bg sampling, for reproducible rois on
+        # the CPU only: pytorch 0.4.1 has no CUDA generator objects, so on
+        # the GPU leave it None and seed the default generator of the
+        # device with torch.cuda.manual_seed instead
+        self.generator = generator
         self.BBOX_NORMALIZE_MEANS = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS)
         self.BBOX_NORMALIZE_STDS = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS)
         self.BBOX_INSIDE_WEIGHTS = torch.FloatTensor(cfg.TRAIN.BBOX_INSIDE_WEIGHTS)
@@ -74,21 +79,10 @@ class _ProposalTargetLayer(nn.Module):
             bbox_target (ndarray): b x N x 4K blob of regression targets
             bbox_inside_weights (ndarray): b x N x 4K blob of loss weights
         """
-        batch_size = labels_batch.size(0)
-        rois_per_image = labels_batch.size(1)
-        clss = labels_batch
-        bbox_targets = bbox_target_data.new(batch_size, rois_per_image, 4).zero_()
-        bbox_inside_weights = bbox_target_data.new(bbox_targets.size()).zero_()
-
-        for b in range(batch_size):
-            # assert clss[b].sum() > 0
-            if clss[b].sum() == 0:
-                continue
-            inds = torch.nonzero(clss[b] > 0).view(-1)
-            for i in range(inds.numel()):
-                ind = inds[i]
-                bbox_targets[b, ind, :] = bbox_target_data[b, ind, :]
-                bbox_inside_weights[b, ind, :] = self.BBOX_INSIDE_WEIGHTS
+        fg = (labels_batch > 0).unsqueeze(2)
+        bbox_targets = bbox_target_data.masked_fill(fg == 0, 0)
+        bbox_inside_weights = self.BBOX_INSIDE_WEIGHTS.view(1, 1, 4).expand_as(bbox_targets) \
+            .masked_fill(fg == 0, 0)
 
         return bbox_targets, bbox_inside_weights
 
@@ -127,82 +121,62 @@ class _ProposalTargetLayer(nn.Module):
         num_proposal = overlaps.size(1)
         num_boxes_per_img = overlaps.size(2)
 
-        offset = torch.arange(0, batch_size)*gt_boxes.size(1)
-        offset = offset.view(-1, 1).type_as(gt_assignment) + gt_assignment
+        labels = gt_boxes[:, :, 4].gather(1, gt_assignment)
 
-        labels = gt_boxes[:,:,4].contiguous().view(-1).index(offset.view(-1))\
-                                                            .view(batch_size, -1)
+        fg = max_overlaps >= cfg.TRAIN.FG_THRESH
+        # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
+        bg = (max_overlaps < cfg.TRAIN.BG_THRESH_HI) & (max_overlaps >= cfg.TRAIN.BG_THRESH_LO)
+        fg_num_rois = fg.long().sum(1, keepdim=True)
+        bg_num_rois = bg.long().sum(1, keepdim=True)
+        if ((fg_num_rois == 0) & (bg_num_rois == 0)).any():
+            raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
 
-        labels_batch = labels.new(batch_size, rois_per_image).zero_()
-        rois_batch  = all_rois.new(batch_size, rois_per_image, 5).zero_()
-        gt_rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
         # Guard against the case when an image has fewer than max_fg_rois_per_image
-        # foreground RoIs
-        for i in range(batch_size):
-
-            fg_inds = torch.nonzero(max_overlaps[i] >= cfg.TRAIN.FG_THRESH).view(-1)
-            fg_num_rois = fg_inds.numel()
-
-            # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
-            bg_inds = torch.nonzero((max_overlaps[i] < cfg.TRAIN.BG_THRESH_HI) &
-                                    (max_overlaps[i] >= cfg.TRAIN.BG_THRESH_LO)).view(-1)
-            bg_num_rois = bg_inds.numel()
-
-            if fg_num_rois > 0 and bg_num_rois > 0:
-                # sampling fg
-                fg_rois_per_this_image = min(fg_rois_per_image, fg_num_rois)
-                
-                # torch.randperm seems has a bug on multi-gpu setting that cause the segfault. 
-                # See https://github.com/pytorch/pytorch/issues/1868 for more details.
-                # use numpy instead.
-                #rand_num = torch.randperm(fg_num_rois).long().cuda()
-                rand_num = torch.from_numpy(np.random.permutation(fg_num_rois)).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num[:fg_rois_per_this_image]]
-
-                # sampling bg
-                bg_rois_per_this_image = rois_per_image - fg_rois_per_this_image
-
-                # Seems torch.rand has a bug, it will generate very large number and make an error. 
-                # We use numpy rand instead. 
-                #rand_num = (torch.rand(bg_rois_per_this_image) * bg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(bg_rois_per_this_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                bg_inds = bg_inds[rand_num]
-
-            elif fg_num_rois > 0 and bg_num_rois == 0:
-                # sampling fg
-                #rand_num = torch.floor(torch.rand(rois_per_image) * fg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(rois_per_image) * fg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num]
-                fg_rois_per_this_image = rois_per_image
-                bg_rois_per_this_image = 0
-            elif bg_num_rois > 0 and fg_num_rois == 0:
-                # sampling bg
-                #rand_num = torch.floor(torch.rand(rois_per_image) * bg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(rois_per_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-
-                bg_inds = bg_inds[rand_num]
-                bg_rois_per_this_image = rois_per_image
-                fg_rois_per_this_image = 0
-            else:
-                raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
-                
-            # The indices that we're selecting (both fg and bg)
-            keep_inds = torch.cat([fg_inds, bg_inds], 0)
-
-            # Select sampled values from various arrays:
-            labels_batch[i].copy_(labels[i][keep_inds])
-
-            # Clamp labels for the background RoIs to 0
-            if fg_rois_per_this_image < rois_per_image:
-                labels_batch[i][fg_rois_per_this_image:] = 0
-
-            rois_batch[i] = all_rois[i][keep_inds]
-            rois_batch[i,:,0] = i
-
-            gt_rois_batch[i] = gt_boxes[i][gt_assignment[i][keep_inds]]
+        # foreground RoIs: with backgrounds, up to fg_rois_per_image distinct
+        # foregrounds and backgrounds drawn with replacement fill the image;
+        # without, foregrounds drawn with replacement do
+        fg_rois_per_this_image = torch.where(bg_num_rois > 0,
+                                             fg_num_rois.clamp(max=fg_rois_per_image),
+                                             fg_num_rois.clamp(max=1) * rois_per_image)
+        slot = torch.arange(rois_per_image, dtype=torch.long, device=all_rois.device).view(1, -1)
+        is_fg = slot < fg_rois_per_this_image
+
+        # drawn in double precision on the device of the rois, from
+        # self.generator on the CPU or the default generator of the device
+        keys = all_rois.new_empty((batch_size, num_proposal), dtype=torch.float64) \
+            .uniform_(generator=self.generator)
+        draws = all_rois.new_empty((batch_size, rois_per_image), dtype=torch.float64) \
+            .uniform_(generator=self.generator)
+
+        # distinct foregrounds: the ones with the smallest random keys
+        num_distinct = min(fg_rois_per_image, num_proposal)
+        _, fg_perm = torch.topk(keys.masked_fill(fg == 0, 2), num_distinct, 1, largest=False)
+        fg_distinct = fg_perm.gather(1, slot.clamp(max=num_distinct - 1).expand(batch_size, -1))
+
+        # draws with replacement: the j-th member, in index order, of a set
+        position = torch.arange(num_proposal, dtype=torch.long, device=all_rois.device).view(1, -1)
+        _, fg_members = torch.sort((fg == 0).long() * num_proposal + position, 1)
+        _, bg_members = torch.sort((bg == 0).long() * num_proposal + position, 1)
+        fg_drawn = fg_members.gather(1, torch.min((draws * fg_num_rois.double()).floor().long(),
+                                                  (fg_num_rois - 1).clamp(min=0)))
+        bg_drawn = bg_members.gather(1, torch.min((draws * bg_num_rois.double()).floor().long(),
+                                                  (bg_num_rois - 1).clamp(min=0)))
+
+        # The indices that we're selecting (fg first, then bg)
+        keep_inds = torch.where(is_fg, torch.where(bg_num_rois > 0, fg_distinct, fg_drawn),
+                                bg_drawn)
+
+        # Select sampled values from various arrays:
+        labels_batch = labels.gather(1, keep_inds)
+        # Clamp labels for the background RoIs to 0
+        labels_batch.masked_fill_(is_fg == 0, 0)
+
+        rois_batch = all_rois.gather(1, keep_inds.unsqueeze(2).expand(batch_size, rois_per_image, 5))
+        rois_batch[:, :, 0] = torch.arange(batch_size, dtype=rois_batch.dtype,
+                                           device=rois_batch.device).view(-1, 1)
+
+        gt_rois_batch = gt_boxes.gather(1, gt_assignment.gather(1, keep_inds).unsqueeze(2)
+                                        .expand(batch_size, rois_per_image, gt_boxes.size(2)))
 
         bbox_target_data = self._compute_targets_pytorch(
                 rois_batch[:,:,1:5], gt_rois_batch[:,:,:4])
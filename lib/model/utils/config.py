@@ -65,6 +65,29 @@ __C.TRAIN.SCALES = (600,)
 # Max pixel size of the longest side of a scaled input image
 __C.TRAIN.MAX_SIZE = 1000
 
+# Directory of pre-decoded image shards written by pack_images.py. Images
+# found in its index are read as memory-mapped views instead of being decoded
+# from disk; leave empty to always decode
+__C.TRAIN.IMAGE_SHARD_DIR = ''
+
+# Byte budget (in MB) of the LRU cache of decoded and resized images kept by
+# every data loader process. The original and the flipped entry of an image
+# then share one decode. 0 disables the cache
+__C.TRAIN.IMAGE_CACHE_MB = 0
+
+# Build multi-scale batches grouped by (scale, aspect-ratio bucket) and
+# filled up to this many padded pixels, instead of fixed --bs batches
+# (0 disables)
+__C.TRAIN.BATCH_PIXELS = 0
+
+# Number of aspect-ratio buckets between 0.5 and 2 used with BATCH_PIXELS
+__C.TRAIN.RATIO_BUCKETS = 8
+
+# With IMAGE_ARCHIVES, draw the batches in archive order through a shuffle
+# buffer of this many batches, so that reads stay mostly sequential
+# (0 keeps the fully random batch order)
+__C.TRAIN.SHUFFLE_BUFFER = 0
+
 # Trim size for input images to create minibatch
 __C.TRAIN.TRIM_HEIGHT = 600
 __C.TRAIN.TRIM_WIDTH = 600
@@ -133,6 +156,11 @@ __C.TRAIN.RPN_POSITIVE_OVERLAP = 0.7
 __C.TRAIN.RPN_NEGATIVE_OVERLAP = 0.3
 # If an anchor statisfied by positive and negative conditions set to negative
 __C.TRAIN.RPN_CLOBBER_POSITIVES = False
+# Compute the anchor/gt IoUs only for the intersecting pairs, found from
+# the anchor grid, instead of a dense (batch, anchors, gt boxes) tensor.
+# Same results, slower but with less memory for large images with many gt
+# boxes, see benchmark.py --suite overlaps
+__C.TRAIN.RPN_SPARSE_OVERLAPS = False
 # Max number of foreground examples
 __C.TRAIN.RPN_FG_FRACTION = 0.5
 # Total number of examples
@@ -174,6 +202,11 @@ __C.TEST.MAX_SIZE = 1000
 # IoU >= this threshold)
 __C.TEST.NMS = 0.3
 
+# The per-class detection NMS of a batch runs in calls over whole
+# (image, class) groups of at most this many candidates; one call over
+# all of them needs a mask quadratic in their number (0: a single call)
+__C.TEST.NMS_MAX_BOXES = 4096
+
 # Experimental: treat the (K+1) units in the cls_score layer as linear
 # predictors (trained, eg, with one-vs-rest SVMs).
 __C.TEST.SVM = False
@@ -200,8 +233,17 @@ __C.TEST.RPN_MIN_SIZE = 16
 
 # Testing mode, default to be 'nms', 'top' is slower but better
 # See report for details
+# 'soft_linear' and 'soft_gaussian' rescore overlapping boxes with
+# Soft-NMS instead of removing them, 'matrix_linear' and 'matrix_gaussian'
+# with the parallel Matrix-NMS; used by the test-time RPN and detections
 __C.TEST.MODE = 'nms'
 
+# Sigma of the Gaussian Soft-NMS and Matrix-NMS decay exp(-IoU^2 / sigma)
+__C.TEST.NMS_SIGMA = 0.5
+
+# Boxes rescored below this score by Soft-NMS or Matrix-NMS are dropped
+__C.TEST.NMS_MIN_SCORE = 0.001
+
 # Only useful when TEST.MODE is 'top', specifies the number of top proposals to select
 __C.TEST.RPN_TOP_N = 5000
 
@@ -256,6 +298,20 @@ __C.DEDUP_BOXES = 1. / 16.
 # they were trained with
 __C.PIXEL_MEANS = np.array([[[102.9801, 115.9465, 122.7717]]])
 
+# Ship images from the data loader as uint8 NHWC batches; the float
+# conversion, mean subtraction and NCHW permute then run as one step on the
+# device at the start of the network's forward pass
+__C.UINT8_INPUT = False
+
+# Number of threads probing image sizes from the file headers when a roidb
+# is prepared; the sizes are cached next to the roidb cache files
+__C.IMAGE_SIZE_WORKERS = 16
+
+# Uncompressed tar or zip archives holding the dataset images. Images found
+# in them (matched by their path below the archive root) are read as byte
+# ranges of the archives instead of being opened as loose files
+__C.IMAGE_ARCHIVES = []
+
 # For reproducibility
 __C.RNG_SEED = 3
 
@@ -277,6 +333,10 @@ __C.EXP_DIR = 'default'
 # Use GPU implementation of non-maximum suppression
 __C.USE_GPU_NMS = True
 
+# The CPU non-maximum suppression runs the compiled greedy loop from this
+# many boxes on, and the vectorized block IoU version below
+__C.NMS_CPU_LOOP_MIN_BOXES = 1000
+
 # Default GPU device id
 __C.GPU_ID = 0
 
@@ -297,6 +357,10 @@ __C.ANCHOR_RATIOS = [0.5,1,2]
 # Feature stride for RPN
 __C.FEAT_STRIDE = [16, ]
 
+# Number of shifted anchor grids (one per feature map size, device and
+# dtype) and of in-image anchor index sets kept by the RPN layers
+__C.ANCHOR_CACHE_SIZE = 64
+
 __C.CUDA = False
 
 __C.CROP_RESIZE_WITH_MAX_POOL = True
@@ -0,0 +1,141 @@
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Image decoding with the fastest available backend.
+
+The backend is picked at import time, in order of preference:
+
+  cv2    cv2.imdecode, with IMREAD_REDUCED_COLOR_{2,4,8} when the target
+         scale is at most 1/2, 1/4 or 1/8 of the image (OpenCV >= 3)
+  pil    PIL, with Image.draft() so JPEGs are downscaled in the DCT domain
+  scipy  scipy.misc.imread, the original decode path
+
+Every backend returns uint8 images in BGR order: cv2 decodes to BGR and
+PIL converts with the 'BGR' raw encoder, so no channel-reversing copy is
+needed. Archive URIs (datasets.archive) are decoded from the member bytes.
+decode_image_for_scale() always resizes to the size computed from
+the original image, so the result does not depend on the backend's
+reduced decode.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+
+import numpy as np
+import cv2
+
+from datasets.archive import is_archive_uri, read_bytes
+
+from datasets.image_sizes import image_size_from_bytes
+from model.utils.blob import get_im_scale
+
+try:
+  import PIL.Image
+except ImportError:
+  PIL = None
+
+BACKENDS = []
+if hasattr(cv2, 'IMREAD_REDUCED_COLOR_2'):
+  BACKENDS.append('cv2')
+if PIL is not None:
+  BACKENDS.append('pil')
+BACKENDS.append('scipy')
+BACKEND = BACKENDS[0]
+
+_REDUCED_FACTORS = (8, 4, 2)
+
+
+def _reduce_factor(im_scale):
+  """Largest decode reduction that keeps the image at least target size."""
+  for factor in _REDUCED_FACTORS:
+    if im_scale * factor <= 1.:
+      return factor
+  return 1
+
+
+def _open(path):
+  """A file object or name PIL and scipy can read the image from."""
+  if is_archive_uri(path):
+    return io.BytesIO(read_bytes(path))
+  return path
+
+
+def _decode_cv2(path, im_scale_fn):
+  if is_archive_uri(path):
+    data = np.frombuffer(read_bytes(path), dtype=np.uint8)
+  else:
+    data = np.fromfile(path, dtype=np.uint8)
+  factor = 1
+  if im_scale_fn is not None:
+    size = image_size_from_bytes(data)
+    if size is not None:
+      factor = _reduce_factor(im_scale_fn((size[1], size[0])))
+  flags = {1: cv2.IMREAD_COLOR,
+           2: cv2.IMREAD_REDUCED_COLOR_2,
+           4: cv2.IMREAD_REDUCED_COLOR_4,
+           8: cv2.IMREAD_REDUCED_COLOR_8}[factor]
+  # the annotations refer to the stored pixels, not the EXIF-rotated image
+  flags |= getattr(cv2, 'IMREAD_IGNORE_ORIENTATION', 0)
+  im = cv2.imdecode(data, flags)
+  if im is None:
+    raise IOError('cannot decode image {}'.format(path))
+  return im
+
+
+def _decode_pil(path, im_scale_fn):
+  img = PIL.Image.open(_open(path))
+  if im_scale_fn is not None and img.format == 'JPEG':
+    width, height = img.size
+    factor = _reduce_factor(im_scale_fn((height, width)))
+    if factor > 1:
+      # draft() picks the smallest DCT scale not below the requested size
+      img.draft('RGB', (width // factor, height // factor))
+  if img.mode != 'RGB':
+    img = img.convert('RGB')
+  return np.frombuffer(img.tobytes('raw', 'BGR'), dtype=np.uint8).reshape(
+    img.size[1], img.size[0], 3)
+
+
+def _decode_scipy(path, im_scale_fn):
+  from scipy.misc import imread
+  im = imread(_open(path))
+  if len(im.shape) == 2:
+    im = im[:,:,np.newaxis]
+    im = np.concatenate((im,im,im), axis=2)
+  # rgb -> bgr
+  return im[:,:,::-1]
+
+
+_DECODERS = {'cv2': _decode_cv2, 'pil': _decode_pil, 'scipy': _decode_scipy}
+
+
+def decode_image(path, backend=None):
+  """Decode an image file or archive URI into a uint8 (H, W, 3) array in BGR order."""
+  return _DECODERS[backend or BACKEND](path, None)
+
+
+def decode_image_for_scale(path, target_size, max_size, backend=None):
+  """Decode an image and resize it to target_size, as resize_im_for_blob.
+
+  Returns the resized uint8 BGR image and its scale relative to the
+  original image. The decoder may downscale on the fly; the final size
+  is computed from the original size either way.
+  """
+  orig_shape = []
+
+  def im_scale_fn(shape):
+    orig_shape[:] = shape
+    return get_im_scale(shape, target_size, max_size)
+
+  im = _DECODERS[backend or BACKEND](path, im_scale_fn)
+  if not orig_shape:
+    # the backend did not look at the header, the image is full size
+    orig_shape[:] = im.shape[:2]
+  im_scale = get_im_scale(orig_shape, target_size, max_size)
+  dsize = (int(round(orig_shape[1] * im_scale)), int(round(orig_shape[0] * im_scale)))
+  if (im.shape[1], im.shape[0]) != dsize:
+    im = cv2.resize(im, dsize, interpolation=cv2.INTER_LINEAR)
+  return im, im_scale
@@ -70,6 +70,21 @@ def adjust_learning_rate(optimizer, decay=0.1):
 def save_checkpoint(state, filename):
     torch.save(state, filename)
 
+def _normalize_input(im_data):
+    """Turn a uint8 (B, H, W, 3) BGR batch into the network input.
+
+    The dtype conversion and the NCHW permute happen in a single copy on
+    the batch's device, followed by an in-place mean subtraction, so the
+    data loader only has to ship a quarter of the float32 bytes.
+    """
+    batch_size, height, width = im_data.size(0), im_data.size(1), im_data.size(2)
+    pixel_means = torch.from_numpy(cfg.PIXEL_MEANS.reshape(1, 3, 1, 1)).float()
+    if im_data.is_cuda:
+        pixel_means = pixel_means.cuda(im_data.get_device())
+    out = pixel_means.new(batch_size, 3, height, width)
+    out.copy_(im_data.permute(0, 3, 1, 2))
+    return out.sub_(pixel_means)
+
 def _smooth_l1_loss(bbox_pred, bbox_targets, bbox_inside_weights, bbox_outside_weights, sigma=1.0, dim=[1]):
     
     sigma_2 = sigma ** 2
@@ -0,0 +1,217 @@
+"""Columnar, array-backed roidb.
+
+The roidb produced by the imdbs is a list with one dict of small numpy
+arrays (and a scipy.sparse gt_overlaps matrix) per image. ColumnarRoidb
+stores the same information as a handful of flat arrays instead:
+
+  per box    boxes (N, 4), gt_classes, seg_areas, max_overlaps, max_classes,
+             gt_crowd
+  per image  box_offsets (num_images + 1), width, height, flipped,
+             need_crop, image, img_id
+
+The boxes of image i are rows box_offsets[i]:box_offsets[i + 1] of the box
+arrays. Every column is a plain ndarray, so the whole roidb can be saved
+as .npy files and memory-mapped back. A memory-mapped roidb pickles as
+the name of its directory, so DataLoader workers attach to the same pages
+instead of receiving a copy; share() moves an in-memory roidb into
+/dev/shm for that. Indexing returns a dict with the keys the roi data
+layer reads, whose arrays are views into the columns.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import os
+import os.path as osp
+import shutil
+import tempfile
+import numpy as np
+
+from datasets.gt_stats import overlap_stats
+
+BOX_COLUMNS = ('boxes', 'gt_classes', 'seg_areas', 'max_overlaps', 'max_classes',
+               'gt_crowd')
+IMAGE_COLUMNS = ('box_offsets', 'width', 'height', 'flipped', 'need_crop',
+                 'image', 'img_id')
+
+
+def _remove_shared(path, owner_pid):
+  # forked workers inherit the atexit hook, only the owner cleans up
+  if os.getpid() == owner_pid:
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class ColumnarRoidb(object):
+  """A roidb held as flat per-box and per-image column arrays."""
+
+  def __init__(self, columns, path=None):
+    for name in BOX_COLUMNS + IMAGE_COLUMNS:
+      setattr(self, name, columns[name])
+    # directory the columns are memory-mapped from, if any
+    self._path = path
+
+  @classmethod
+  def from_roidb(cls, roidb):
+    """Convert a prepared list-of-dicts roidb into columns.
+
+    max_overlaps, max_classes and gt_crowd are taken from the entries
+    when prepare_roidb() attached them, otherwise they are computed for
+    all boxes at once from the stacked gt_overlaps matrices.
+    """
+    num_images = len(roidb)
+    counts = np.array([len(r['boxes']) for r in roidb], dtype=np.int64)
+    box_offsets = np.zeros(num_images + 1, dtype=np.int64)
+    np.cumsum(counts, out=box_offsets[1:])
+
+    def concat(arrays, shape, dtype):
+      if len(arrays) == 0:
+        return np.zeros(shape, dtype=dtype)
+      return np.concatenate(arrays).astype(dtype, copy=False)
+
+    boxes = concat([np.asarray(r['boxes']).reshape(-1, 4) for r in roidb],
+                   (0, 4), np.float32)
+    gt_classes = concat([r['gt_classes'] for r in roidb], (0,), np.int32)
+    seg_areas = concat([r['seg_areas'] if 'seg_areas' in r else
+                        (r['boxes'][:, 2] - r['boxes'][:, 0] + 1.) *
+                        (r['boxes'][:, 3] - r['boxes'][:, 1] + 1.)
+                        for r in roidb], (0,), np.float32)
+    if all('max_overlaps' in r for r in roidb):
+      max_overlaps = concat([r['max_overlaps'] for r in roidb], (0,), np.float32)
+      max_classes = concat([r['max_classes'] for r in roidb], (0,), np.int32)
+      gt_crowd = concat([r['gt_crowd'] for r in roidb], (0,), np.bool_)
+    else:
+      max_overlaps, max_classes, gt_crowd = overlap_stats(
+        [r['gt_overlaps'] for r in roidb])
+
+    # sanity checks
+    # max overlap of 0 => class should be zero (background)
+    assert np.all(max_classes[max_overlaps == 0] == 0)
+    # max overlap > 0 => class should not be zero (must be a fg class)
+    assert np.all(max_classes[max_overlaps > 0] != 0)
+
+    columns = {
+      'boxes': boxes,
+      'gt_classes': gt_classes,
+      'seg_areas': seg_areas,
+      'max_overlaps': max_overlaps,
+      'max_classes': max_classes,
+      'gt_crowd': gt_crowd,
+      'box_offsets': box_offsets,
+      'width': np.array([r['width'] for r in roidb], dtype=np.int32),
+      'height': np.array([r['height'] for r in roidb], dtype=np.int32),
+      'flipped': np.array([r['flipped'] for r in roidb], dtype=np.bool_),
+      'need_crop': np.array([r.get('need_crop', 0) for r in roidb], dtype=np.uint8),
+      'image': np.array([r['image'] for r in roidb], dtype=np.str_),
+      'img_id': np.array([r['img_id'] for r in roidb]),
+    }
+    return cls(columns)
+
+  def __len__(self):
+    return len(self.width)
+
+  @property
+  def num_boxes(self):
+    return np.diff(self.box_offsets)
+
+  def __getitem__(self, i):
+    i = int(i)
+    if i < 0:
+      i += len(self)
+    start, end = self.box_offsets[i], self.box_offsets[i + 1]
+    return {'boxes': self.boxes[start:end],
+            'gt_classes': self.gt_classes[start:end],
+            'seg_areas': self.seg_areas[start:end],
+            'max_overlaps': self.max_overlaps[start:end],
+            'max_classes': self.max_classes[start:end],
+            'gt_crowd': self.gt_crowd[start:end],
+            'width': int(self.width[i]),
+            'height': int(self.height[i]),
+            'flipped': bool(self.flipped[i]),
+            'need_crop': int(self.need_crop[i]),
+            'image': str(self.image[i]),
+            'img_id': self.img_id[i].item()}
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def select(self, index):
+    """Return a new ColumnarRoidb holding the images at index, in order."""
+    index = np.asarray(index, dtype=np.int64)
+    starts = self.box_offsets[index]
+    counts = self.box_offsets[index + 1] - starts
+    box_offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(counts, out=box_offsets[1:])
+    # position of every selected box in the source box columns
+    box_index = (np.arange(box_offsets[-1], dtype=np.int64) -
+                 np.repeat(box_offsets[:-1] - starts, counts))
+    columns = dict((name, np.asarray(getattr(self, name))[box_index])
+                   for name in BOX_COLUMNS)
+    columns.update((name, np.asarray(getattr(self, name))[index])
+                   for name in IMAGE_COLUMNS if name != 'box_offsets')
+    columns['box_offsets'] = box_offsets
+    return ColumnarRoidb(columns)
+
+  def columns(self):
+    return dict((name, getattr(self, name)) for name in BOX_COLUMNS + IMAGE_COLUMNS)
+
+  def save(self, path):
+    """Write every column to <path>/<column>.npy."""
+    if not osp.exists(path):
+      os.makedirs(path)
+    for name, column in self.columns().items():
+      np.save(osp.join(path, name + '.npy'), np.ascontiguousarray(column))
+
+  @classmethod
+  def load(cls, path, mmap_mode='r'):
+    """Load the columns written by save(), memory-mapped by default."""
+    columns = dict((name, np.load(osp.join(path, name + '.npy'), mmap_mode=mmap_mode))
+                   for name in BOX_COLUMNS + IMAGE_COLUMNS)
+    if mmap_mode is not None:
+      # plain ndarray views of the maps: slicing and computing on np.memmap
+      # instances costs several times more per sample
+      columns = dict((name, column.view(np.ndarray)) for name, column in columns.items())
+    return cls(columns, path if mmap_mode is not None else None)
+
+  @property
+  def path(self):
+    return self._path
+
+  def share(self):
+    """Return this roidb backed by memory-mapped files workers attach to.
+
+    A roidb loaded from disk is returned as is. Otherwise the columns are
+    written to a fresh directory in /dev/shm (or the temp directory) that
+    is removed when this process exits.
+    """
+    if self._path is not None:
+      return self
+    shm_dir = '/dev/shm' if osp.isdir('/dev/shm') else None
+    path = tempfile.mkdtemp(prefix='roidb_', dir=shm_dir)
+    atexit.register(_remove_shared, path, os.getpid())
+    self.save(path)
+    return ColumnarRoidb.load(path)
+
+  @staticmethod
+  def exists(path):
+    return all(osp.exists(osp.join(path, name + '.npy'))
+               for name in BOX_COLUMNS + IMAGE_COLUMNS)
+
+  def __getstate__(self):
+    # memory-mapped columns are re-mapped in the receiving process instead
+    # of being copied into the pickle, only columns replaced in memory
+    # since loading (e.g. need_crop) travel by value
+    if self._path is None:
+      return self.__dict__.copy()
+    state = dict((name, column) for name, column in self.columns().items()
+                 if not isinstance(column.base, np.memmap))
+    state['_path'] = self._path
+    return state
+
+  def __setstate__(self, state):
+    state = dict(state)
+    path = state.get('_path')
+    if path is not None:
+      self.__dict__.update(ColumnarRoidb.load(path).__dict__)
+    self.__dict__.update(state)
@@ -0,0 +1,119 @@
+"""Batched crop-window selection and gt box cropping for roibatchLoader.
+
+Images whose aspect ratio lies outside [0.5, 2] (need_crop) are cropped
+along their long axis to the target ratio of their group, at a random
+start that keeps as many gt boxes as possible inside the window. Groups
+with target ratio 1 are trimmed to a square. sample_crop_windows() draws
+the windows of a whole batch at once and crop_gt_boxes() shifts, clamps
+and filters the padded gt boxes of the batch accordingly.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import torch
+
+
+def _valid_mask(gt_boxes, num_boxes):
+  return torch.arange(gt_boxes.size(1), dtype=torch.long).view(1, -1) < num_boxes.view(-1, 1)
+
+
+def _crop_starts(min_c, max_c, data_len, trim, u):
+  """Crop start along one axis for every image, as float tensors.
+
+  A window smaller than the box region starts at a random position
+  keeping all the boxes inside; otherwise it starts at a random position
+  in the first half of the uncovered box region.
+  """
+  region = max_c - min_c + 1
+  lo = (max_c - trim).clamp(min=0)
+  hi = torch.min(min_c, data_len - trim)
+  fits = torch.where(hi > lo, lo + torch.floor(u * (hi - lo)), lo)
+  add = torch.floor((region - trim) / 2)
+  covers = torch.where(add > 0, min_c + torch.floor(u * add), min_c)
+  starts = torch.where(region - trim < 0, fits, covers)
+  return torch.where(min_c == 0, torch.zeros_like(starts), starts)
+
+
+def sample_crop_windows(gt_boxes, num_boxes, heights, widths, ratios, need_crop):
+  """Draw the crop window of every image of a batch.
+
+  gt_boxes is a padded (B, N, 5) tensor of scaled boxes with num_boxes
+  valid rows per image, heights and widths the image sizes, ratios the
+  target ratios and need_crop a byte mask. Returns the long tensors
+  (x_start, y_start, width, height) of the windows and the float tensors
+  (x_limit, y_limit) the box coordinates are clamped to.
+  """
+  batch_size = gt_boxes.size(0)
+  heights = heights.double()
+  widths = widths.double()
+  ratios = ratios.double()
+  valid = _valid_mask(gt_boxes, num_boxes)
+  boxes = gt_boxes.double()
+  inf = float('inf')
+  min_xy = torch.where(valid.unsqueeze(2), boxes[:, :, 0:2], torch.full_like(boxes[:, :, 0:2], inf))
+  max_xy = torch.where(valid.unsqueeze(2), boxes[:, :, 2:4], torch.full_like(boxes[:, :, 2:4], -inf))
+  # images without boxes start their window at 0
+  empty = (num_boxes == 0).view(-1, 1)
+  min_xy = torch.floor(min_xy.min(1)[0]).masked_fill(empty, 0)
+  max_xy = torch.floor(max_xy.max(1)[0]).masked_fill(empty, 0)
+
+  # ratio < 1 crops the height, otherwise the width is cropped
+  crop_y = need_crop & (ratios < 1)
+  crop_x = need_crop & (ratios >= 1)
+  trim_y = torch.min(torch.floor(widths / ratios), heights)
+  trim_x = torch.min(torch.ceil(heights * ratios), widths)
+  u = torch.from_numpy(np.random.random_sample(batch_size))
+  starts = _crop_starts(torch.where(crop_y, min_xy[:, 1], min_xy[:, 0]),
+                        torch.where(crop_y, max_xy[:, 1], max_xy[:, 0]),
+                        torch.where(crop_y, heights, widths),
+                        torch.where(crop_y, trim_y, trim_x), u)
+
+  zeros = torch.zeros_like(starts)
+  x_start = torch.where(crop_x, starts, zeros)
+  y_start = torch.where(crop_y, starts, zeros)
+  width = torch.where(crop_x, trim_x, widths)
+  height = torch.where(crop_y, trim_y, heights)
+  x_limit = torch.where(crop_x, trim_x - 1, torch.full_like(starts, inf))
+  y_limit = torch.where(crop_y, trim_y - 1, torch.full_like(starts, inf))
+
+  # ratio 1 trims to the top-left square
+  square = ratios == 1
+  side = torch.min(width, height)
+  width = torch.where(square, side, width)
+  height = torch.where(square, side, height)
+  x_limit = torch.where(square, torch.min(x_limit, side), x_limit)
+  y_limit = torch.where(square, torch.min(y_limit, side), y_limit)
+
+  return (x_start.long(), y_start.long(), width.long(), height.long(),
+          x_limit.float(), y_limit.float())
+
+
+def crop_gt_boxes(gt_boxes, num_boxes, x_start, y_start, x_limit, y_limit,
+                  max_num_box):
+  """Shift, clamp and filter the padded gt boxes of a batch.
+
+  Boxes that collapse to zero width or height are dropped, the remaining
+  ones are compacted to the front of every row and cut to max_num_box.
+  Returns the (B, max_num_box, 5) boxes and the new num_boxes.
+  """
+  batch_size, num_rows = gt_boxes.size(0), gt_boxes.size(1)
+  boxes = gt_boxes.clone()
+  xs = boxes[:, :, 0:4:2] - x_start.view(-1, 1, 1).float()
+  ys = boxes[:, :, 1:4:2] - y_start.view(-1, 1, 1).float()
+  boxes[:, :, 0:4:2] = torch.min(xs.clamp(min=0), x_limit.view(-1, 1, 1))
+  boxes[:, :, 1:4:2] = torch.min(ys.clamp(min=0), y_limit.view(-1, 1, 1))
+
+  keep = _valid_mask(gt_boxes, num_boxes) & \
+         (boxes[:, :, 0] != boxes[:, :, 2]) & (boxes[:, :, 1] != boxes[:, :, 3])
+  # kept boxes first, in their original order
+  key = (keep == 0).long() * num_rows + torch.arange(num_rows, dtype=torch.long).view(1, -1)
+  order = torch.sort(key, 1)[1][:, :max_num_box]
+  boxes = boxes.gather(1, order.unsqueeze(2).expand(-1, -1, 5))
+  num_boxes = keep.long().sum(1).clamp(max=max_num_box)
+
+  out = gt_boxes.new_zeros(batch_size, max_num_box, 5)
+  out[:, :boxes.size(1)] = boxes
+  out[_valid_mask(out, num_boxes) == 0] = 0
+  return out, num_boxes
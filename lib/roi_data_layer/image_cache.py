@@ -0,0 +1,69 @@
+"""Bounded LRU cache of decoded and resized images.
+
+The flipped roidb entries added by imdb.append_flipped_images() point at
+the same file as the original ones. Caching the decoded, resized uint8
+image under (path, target_size) lets both entries share a single decode;
+the flipped entry simply takes a mirrored view of the cached array.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+
+
+class ImageCache(object):
+  """LRU cache of (image, im_scale) pairs bounded by a byte budget."""
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._bytes = 0
+    self._images = OrderedDict()
+
+  def __len__(self):
+    return len(self._images)
+
+  @property
+  def nbytes(self):
+    return self._bytes
+
+  @property
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return float(self.hits) / total if total > 0 else 0.
+
+  def get(self, key):
+    value = self._images.pop(key, None)
+    if value is None:
+      self.misses += 1
+      return None
+    # re-insert to mark as most recently used
+    self._images[key] = value
+    self.hits += 1
+    return value
+
+  def put(self, key, value):
+    im = value[0]
+    if im.nbytes > self.max_bytes:
+      return
+    old = self._images.pop(key, None)
+    if old is not None:
+      self._bytes -= old[0].nbytes
+    # cached images are shared between entries, nobody may write into them
+    im.flags.writeable = False
+    self._images[key] = value
+    self._bytes += im.nbytes
+    while self._bytes > self.max_bytes:
+      _, evicted = self._images.popitem(last=False)
+      self._bytes -= evicted[0].nbytes
+
+  def clear(self):
+    self._images.clear()
+    self._bytes = 0
+
+  def __repr__(self):
+    return 'ImageCache({:d} images, {:.1f}/{:.1f} MB, hit rate {:.3f})'.format(
+      len(self), self._bytes / float(1 << 20), self.max_bytes / float(1 << 20),
+      self.hit_rate)
@@ -0,0 +1,120 @@
+"""Pre-decoded, memory-mapped image shards for the roi data layer.
+
+pack_images() decodes every image of a roidb once, resizes it to the
+training scale and appends the raw uint8 BGR pixels to a few large shard
+files. An index records the shard, offset, shape and scale of each image,
+so ImageShardStore.lookup() can hand back a zero-copy np.memmap view
+instead of decoding the file again on every epoch.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import os.path as osp
+import pickle
+import numpy as np
+
+from model.utils.image_decode import decode_image_for_scale
+
+INDEX_FILE = 'index.pkl'
+
+
+def _shard_name(shard_id):
+  return 'shard_{:05d}.bin'.format(shard_id)
+
+
+def pack_images(roidb, output_dir, target_size, max_size, shard_bytes=4 << 30):
+  """Decode the roidb images at target_size into uint8 shard files.
+
+  Flipped entries share the image of their original entry, so every
+  image path is packed only once.
+  """
+  if not osp.exists(output_dir):
+    os.makedirs(output_dir)
+
+  images = {}
+  shards = []
+  fid = None
+  offset = 0
+  for i in range(len(roidb)):
+    path = roidb[i]['image']
+    if path in images:
+      continue
+
+    im, im_scale = decode_image_for_scale(path, target_size, max_size)
+    data = np.ascontiguousarray(im, dtype=np.uint8)
+    if fid is None or offset + data.nbytes > shard_bytes:
+      if fid is not None:
+        fid.close()
+      shards.append(_shard_name(len(shards)))
+      fid = open(osp.join(output_dir, shards[-1]), 'wb')
+      offset = 0
+    fid.write(data.tobytes())
+    images[path] = (len(shards) - 1, offset, data.shape, im_scale)
+    offset += data.nbytes
+
+    if (len(images) % 1000) == 0:
+      print('packed {:d} images into {:d} shards'.format(len(images), len(shards)))
+
+  if fid is not None:
+    fid.close()
+
+  index = {'target_size': target_size,
+           'max_size': max_size,
+           'shards': shards,
+           'images': images}
+  with open(osp.join(output_dir, INDEX_FILE), 'wb') as f:
+    pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+  print('wrote {:d} images into {:d} shards at {:s}'.format(
+    len(images), len(shards), output_dir))
+  return index
+
+
+class ImageShardStore(object):
+  """Read-only view over the shards written by pack_images()."""
+
+  def __init__(self, shard_dir):
+    self._shard_dir = shard_dir
+    with open(osp.join(shard_dir, INDEX_FILE), 'rb') as f:
+      index = pickle.load(f)
+    self.target_size = index['target_size']
+    self.max_size = index['max_size']
+    self._shards = index['shards']
+    self._images = index['images']
+    self._maps = {}
+
+  def __len__(self):
+    return len(self._images)
+
+  def __contains__(self, path):
+    return path in self._images
+
+  def __getstate__(self):
+    # memmaps are opened lazily in every process, never pickled into workers
+    state = self.__dict__.copy()
+    state['_maps'] = {}
+    return state
+
+  def _shard(self, shard_id):
+    mm = self._maps.get(shard_id)
+    if mm is None:
+      mm = np.memmap(osp.join(self._shard_dir, self._shards[shard_id]),
+                     dtype=np.uint8, mode='r')
+      self._maps[shard_id] = mm
+    return mm
+
+  def lookup(self, path, target_size):
+    """Return (image, im_scale) for a packed image, or None.
+
+    The image is a read-only (H, W, 3) uint8 BGR view into the shard.
+    """
+    if target_size != self.target_size:
+      return None
+    entry = self._images.get(path)
+    if entry is None:
+      return None
+    shard_id, offset, shape, im_scale = entry
+    size = int(np.prod(shape))
+    im = self._shard(shard_id)[offset:offset + size].reshape(shape)
+    return im, im_scale
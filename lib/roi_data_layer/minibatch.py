@@ -12,22 +12,31 @@ from __future__ import print_function
 
 import numpy as np
 import numpy.random as npr
-from scipy.misc import imread
 from model.utils.config import cfg
-from model.utils.blob import prep_im_for_blob, im_list_to_blob
+from model.utils.blob import im_list_to_blob
+from model.utils.image_decode import decode_image_for_scale
 import pdb
-def get_minibatch(roidb, num_classes):
-  """Given a roidb, construct a minibatch sampled from it."""
+def get_minibatch(roidb, num_classes, shard_store=None, image_cache=None,
+                  scale_inds=None):
+  """Given a roidb, construct a minibatch sampled from it.
+
+  scale_inds picks the index into cfg.TRAIN.SCALES of every image; by
+  default a random scale is drawn per image.
+  """
   num_images = len(roidb)
   # Sample random scales to use for each image in this batch
-  random_scale_inds = npr.randint(0, high=len(cfg.TRAIN.SCALES),
-                  size=num_images)
+  if scale_inds is None:
+    random_scale_inds = npr.randint(0, high=len(cfg.TRAIN.SCALES),
+                    size=num_images)
+  else:
+    random_scale_inds = scale_inds
   assert(cfg.TRAIN.BATCH_SIZE % num_images == 0), \
     'num_images ({}) must divide BATCH_SIZE ({})'. \
     format(num_images, cfg.TRAIN.BATCH_SIZE)
 
   # Get the input image blob, formatted for caffe
-  im_blob, im_scales = _get_image_blob(roidb, random_scale_inds)
+  im_blob, im_scales = _get_image_blob(roidb, random_scale_inds, shard_store,
+                                       image_cache)
 
   blobs = {'data': im_blob}
 
@@ -40,7 +49,8 @@ def get_minibatch(roidb, num_classes):
     gt_inds = np.where(roidb[0]['gt_classes'] != 0)[0]
   else:
     # For the COCO ground truth boxes, exclude the ones that are ''iscrowd'' 
-    gt_inds = np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+    gt_inds = np.where((roidb[0]['gt_classes'] != 0) &
+                       ~roidb[0]['gt_crowd'])[0]
   gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
   gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
   gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
@@ -53,7 +63,16 @@ def get_minibatch(roidb, num_classes):
 
   return blobs
 
-def _get_image_blob(roidb, scale_inds):
+def _get_cached_image(path, target_size, image_cache):
+  """Decode and resize an image, sharing the result through image_cache."""
+  key = (path, target_size)
+  scaled = image_cache.get(key)
+  if scaled is None:
+    scaled = decode_image_for_scale(path, target_size, cfg.TRAIN.MAX_SIZE)
+    image_cache.put(key, scaled)
+  return scaled
+
+def _get_image_blob(roidb, scale_inds, shard_store=None, image_cache=None):
   """Builds an input blob from the images in the roidb at the specified
   scales.
   """
@@ -62,21 +81,24 @@ def _get_image_blob(roidb, scale_inds):
   processed_ims = []
   im_scales = []
   for i in range(num_images):
-    #im = cv2.imread(roidb[i]['image'])
-    im = imread(roidb[i]['image'])
-
-    if len(im.shape) == 2:
-      im = im[:,:,np.newaxis]
-      im = np.concatenate((im,im,im), axis=2)
-    # flip the channel, since the original one using cv2
-    # rgb -> bgr
-    im = im[:,:,::-1]
+    target_size = cfg.TRAIN.SCALES[scale_inds[i]]
+    scaled = None
+    if shard_store is not None:
+      scaled = shard_store.lookup(roidb[i]['image'], target_size)
+    if scaled is None and image_cache is not None:
+      scaled = _get_cached_image(roidb[i]['image'], target_size, image_cache)
+    if scaled is None:
+      scaled = decode_image_for_scale(roidb[i]['image'], target_size,
+                                      cfg.TRAIN.MAX_SIZE)
 
+    # decoded and resized, only flip and subtract the means
+    im, im_scale = scaled
     if roidb[i]['flipped']:
       im = im[:, ::-1, :]
-    target_size = cfg.TRAIN.SCALES[scale_inds[i]]
-    im, im_scale = prep_im_for_blob(im, cfg.PIXEL_MEANS, target_size,
-                    cfg.TRAIN.MAX_SIZE)
+    if not cfg.UINT8_INPUT:
+      # otherwise the network subtracts the means on the device
+      im = im.astype(np.float32)
+      im -= cfg.PIXEL_MEANS
     im_scales.append(im_scale)
     processed_ims.append(im)
 
@@ -0,0 +1,167 @@
+"""Background prefetching of data loader batches.
+
+DataPrefetcher wraps a DataLoader and pulls its batches on a background
+thread, up to depth batches ahead of the training or test loop. With CUDA
+every batch is staged into a ring of reused device holder tensors on a
+side stream, through reused pinned host buffers unless the loader already
+pinned it, so the host-to-device copy overlaps the current step and the
+loop swaps holders instead of copying into fixed ones. Without CUDA the
+thread still overlaps decoding and collation with compute.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+
+import torch
+
+try:
+  import queue
+except ImportError:  # Python 2
+  import Queue as queue
+
+
+class _End(object):
+  pass
+
+
+class _Error(object):
+  def __init__(self, exc):
+    self.exc = exc
+
+
+class _Slot(object):
+  """Host and device holders of one staged batch."""
+
+  def __init__(self):
+    self.host = []
+    self.device = []
+    # H2D copy out of the host buffers done, consumer done with the holders
+    self.copied = None
+    self.released = None
+
+
+class DataPrefetcher(object):
+  """Iterates a DataLoader with batches staged ahead on a background thread.
+
+  With cuda set, the yielded tensors are device holders owned by the
+  prefetcher: a batch stays valid until depth + 1 further batches have
+  been drawn, after which its holders are refilled.
+  """
+
+  def __init__(self, loader, cuda=False, depth=2):
+    self.loader = loader
+    self.cuda = cuda and torch.cuda.is_available()
+    self.depth = depth
+
+  def __len__(self):
+    return len(self.loader)
+
+  def __iter__(self):
+    return _PrefetchIterator(self.loader, self.cuda, self.depth)
+
+
+class _PrefetchIterator(object):
+
+  def __init__(self, loader, cuda, depth):
+    self._cuda = cuda
+    self._queue = queue.Queue(maxsize=depth)
+    self._stop = threading.Event()
+    self._current = None
+    if cuda:
+      self._device = torch.cuda.current_device()
+      self._stream = torch.cuda.Stream()
+      # depth queued + one being filled + one held by the consumer
+      self._slots = [_Slot() for _ in range(depth + 2)]
+    self._loader_iter = iter(loader)
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _put(self, item):
+    while not self._stop.is_set():
+      try:
+        self._queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _run(self):
+    if self._cuda:
+      torch.cuda.set_device(self._device)
+    try:
+      for i, batch in enumerate(self._loader_iter):
+        if self._cuda:
+          batch = self._stage(self._slots[i % len(self._slots)], batch)
+        if not self._put(batch):
+          return
+      self._put(_End())
+    except Exception as e:
+      self._put(_Error(e))
+
+  def _stage(self, slot, batch):
+    with torch.cuda.stream(self._stream):
+      if slot.released is not None:
+        # the previous batch in these holders may still be in use on the device
+        self._stream.wait_event(slot.released)
+      if slot.copied is not None:
+        # and its copy may still be reading the host buffers
+        slot.copied.synchronize()
+      while len(slot.device) < len(batch):
+        slot.host.append(None)
+        slot.device.append(None)
+      for j, t in enumerate(batch):
+        if slot.device[j] is None or slot.device[j].dtype != t.dtype:
+          slot.host[j] = torch.empty(0, dtype=t.dtype).pin_memory()
+          slot.device[j] = torch.empty(0, dtype=t.dtype, device='cuda')
+        src = t
+        if not t.is_pinned():
+          src = slot.host[j]
+          src.resize_(t.size()).copy_(t)
+        slot.device[j].resize_(t.size()).copy_(src, non_blocking=True)
+      slot.copied = torch.cuda.Event()
+      slot.copied.record(self._stream)
+    return slot
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self._current is not None:
+      # the holders can be refilled once the queued work of this step is done
+      released = torch.cuda.Event()
+      released.record(torch.cuda.current_stream())
+      self._current.released = released
+      self._current = None
+
+    item = self._queue.get()
+    if isinstance(item, _End):
+      self._queue.put(item)
+      raise StopIteration
+    if isinstance(item, _Error):
+      self._queue.put(item)
+      raise item.exc
+    if not self._cuda:
+      return item
+
+    torch.cuda.current_stream().wait_event(item.copied)
+    self._current = item
+    return tuple(item.device)
+
+  next = __next__  # Python 2
+
+  def close(self):
+    """Stop the background thread, e.g. when leaving an epoch early."""
+    self._stop.set()
+    try:
+      while True:
+        self._queue.get_nowait()
+    except queue.Empty:
+      pass
+    self._thread.join()
+
+  def __del__(self):
+    if not self._stop.is_set():
+      self._stop.set()
@@ -12,6 +12,10 @@ import torch
 
 from model.utils.config import cfg
 from roi_data_layer.minibatch import get_minibatch, get_minibatch
+from roi_data_layer.image_shards import ImageShardStore
+from roi_data_layer.image_cache import ImageCache
+from roi_data_layer.crop import sample_crop_windows, crop_gt_boxes
+from roi_data_layer.columnar_roidb import ColumnarRoidb
 from model.rpn.bbox_transform import bbox_transform_inv, clip_boxes
 
 import numpy as np
@@ -20,7 +24,11 @@ import time
 import pdb
 
 class roibatchLoader(data.Dataset):
-  def __init__(self, roidb, ratio_list, ratio_index, batch_size, num_classes, training=True, normalize=None):
+  def __init__(self, roidb, ratio_list, ratio_index, batch_size, num_classes, training=True, normalize=None,
+               pin_memory=False):
+    if isinstance(roidb, ColumnarRoidb):
+        # workers attach to the shared columns instead of copying the roidb
+        roidb = roidb.share()
     self._roidb = roidb
     self._num_classes = num_classes
     # we make the height of image consistent to trim_height, trim_width
@@ -29,10 +37,17 @@ class roibatchLoader(data.Dataset):
     self.max_num_box = cfg.MAX_NUM_GT_BOXES
     self.training = training
     self.normalize = normalize
+    self.pin_memory = pin_memory
     self.ratio_list = ratio_list
     self.ratio_index = ratio_index
     self.batch_size = batch_size
     self.data_size = len(self.ratio_list)
+    self.shard_store = None
+    if cfg.TRAIN.IMAGE_SHARD_DIR:
+        self.shard_store = ImageShardStore(cfg.TRAIN.IMAGE_SHARD_DIR)
+    self.image_cache = None
+    if cfg.TRAIN.IMAGE_CACHE_MB > 0:
+        self.image_cache = ImageCache(cfg.TRAIN.IMAGE_CACHE_MB << 20)
 
     # given the ratio_list, we want to make the ratio same for each batch.
     self.ratio_list_batch = torch.Tensor(self.data_size).zero_()
@@ -55,6 +70,14 @@ class roibatchLoader(data.Dataset):
 
 
   def __getitem__(self, index):
+    # PixelBudgetBatchSampler hands out (index, scale_ind, target_ratio)
+    # items, which override the random scale and the group's target ratio
+    scale_inds = None
+    ratio = None
+    if isinstance(index, tuple):
+        index, scale_ind, ratio = index
+        scale_inds = [scale_ind]
+
     if self.training:
         index_ratio = int(self.ratio_index[index])
     else:
@@ -64,7 +87,8 @@ class roibatchLoader(data.Dataset):
     # here we set the anchor index to the last one
     # sample in this group
     minibatch_db = [self._roidb[index_ratio]]
-    blobs = get_minibatch(minibatch_db, self._num_classes)
+    blobs = get_minibatch(minibatch_db, self._num_classes, self.shard_store,
+                          self.image_cache, scale_inds)
     data = torch.from_numpy(blobs['data'])
     im_info = torch.from_numpy(blobs['im_info'])
     # we need to random shuffle the bounding box.
@@ -73,137 +97,38 @@ class roibatchLoader(data.Dataset):
         np.random.shuffle(blobs['gt_boxes'])
         gt_boxes = torch.from_numpy(blobs['gt_boxes'])
 
-        ########################################################
-        # padding the input image to fixed size for each group #
-        ########################################################
-
-        # NOTE1: need to cope with the case where a group cover both conditions. (done)
-        # NOTE2: need to consider the situation for the tail samples. (no worry)
-        # NOTE3: need to implement a parallel data loader. (no worry)
-        # get the index range
-
-        # if the image need to crop, crop to the target size.
-        ratio = self.ratio_list_batch[index]
-
-        if self._roidb[index_ratio]['need_crop']:
-            if ratio < 1:
-                # this means that data_width << data_height, we need to crop the
-                # data_height
-                min_y = int(torch.min(gt_boxes[:,1]))
-                max_y = int(torch.max(gt_boxes[:,3]))
-                trim_size = int(np.floor(data_width / ratio))
-                if trim_size > data_height:
-                    trim_size = data_height                
-                box_region = max_y - min_y + 1
-                if min_y == 0:
-                    y_s = 0
-                else:
-                    if (box_region-trim_size) < 0:
-                        y_s_min = max(max_y-trim_size, 0)
-                        y_s_max = min(min_y, data_height-trim_size)
-                        if y_s_min == y_s_max:
-                            y_s = y_s_min
-                        else:
-                            y_s = np.random.choice(range(y_s_min, y_s_max))
-                    else:
-                        y_s_add = int((box_region-trim_size)/2)
-                        if y_s_add == 0:
-                            y_s = min_y
-                        else:
-                            y_s = np.random.choice(range(min_y, min_y+y_s_add))
-                # crop the image
-                data = data[:, y_s:(y_s + trim_size), :, :]
-
-                # shift y coordiante of gt_boxes
-                gt_boxes[:, 1] = gt_boxes[:, 1] - float(y_s)
-                gt_boxes[:, 3] = gt_boxes[:, 3] - float(y_s)
-
-                # update gt bounding box according the trip
-                gt_boxes[:, 1].clamp_(0, trim_size - 1)
-                gt_boxes[:, 3].clamp_(0, trim_size - 1)
-
-            else:
-                # this means that data_width >> data_height, we need to crop the
-                # data_width
-                min_x = int(torch.min(gt_boxes[:,0]))
-                max_x = int(torch.max(gt_boxes[:,2]))
-                trim_size = int(np.ceil(data_height * ratio))
-                if trim_size > data_width:
-                    trim_size = data_width                
-                box_region = max_x - min_x + 1
-                if min_x == 0:
-                    x_s = 0
-                else:
-                    if (box_region-trim_size) < 0:
-                        x_s_min = max(max_x-trim_size, 0)
-                        x_s_max = min(min_x, data_width-trim_size)
-                        if x_s_min == x_s_max:
-                            x_s = x_s_min
-                        else:
-                            x_s = np.random.choice(range(x_s_min, x_s_max))
-                    else:
-                        x_s_add = int((box_region-trim_size)/2)
-                        if x_s_add == 0:
-                            x_s = min_x
-                        else:
-                            x_s = np.random.choice(range(min_x, min_x+x_s_add))
-                # crop the image
-                data = data[:, :, x_s:(x_s + trim_size), :]
-
-                # shift x coordiante of gt_boxes
-                gt_boxes[:, 0] = gt_boxes[:, 0] - float(x_s)
-                gt_boxes[:, 2] = gt_boxes[:, 2] - float(x_s)
-                # update gt bounding box according the trip
-                gt_boxes[:, 0].clamp_(0, trim_size - 1)
-                gt_boxes[:, 2].clamp_(0, trim_size - 1)
-
-        # based on the ratio, padding the image.
+        # if the image need to crop, crop to the target size. The crop
+        # window is drawn for the whole batch in collate_fn.
+        if ratio is None:
+            ratio = float(self.ratio_list_batch[index])
+        need_crop = bool(self._roidb[index_ratio]['need_crop'])
+
+        # based on the ratio, work out the padded size of the image. The
+        # padding itself is done by collate_fn, directly into the batch.
+        data = data[0]
         if ratio < 1:
             # this means that data_width < data_height
-            trim_size = int(np.floor(data_width / ratio))
-
-            padding_data = torch.FloatTensor(int(np.ceil(data_width / ratio)), \
-                                             data_width, 3).zero_()
-
-            padding_data[:data_height, :, :] = data[0]
-            # update im_info
-            im_info[0, 0] = padding_data.size(0)
-            # print("height %d %d \n" %(index, anchor_idx))
+            im_info[0, 0] = int(np.ceil(data_width / ratio))
         elif ratio > 1:
             # this means that data_width > data_height
-            # if the image need to crop.
-            padding_data = torch.FloatTensor(data_height, \
-                                             int(np.ceil(data_height * ratio)), 3).zero_()
-            padding_data[:, :data_width, :] = data[0]
-            im_info[0, 1] = padding_data.size(1)
+            im_info[0, 1] = int(np.ceil(data_height * ratio))
         else:
             trim_size = min(data_height, data_width)
-            padding_data = torch.FloatTensor(trim_size, trim_size, 3).zero_()
-            padding_data = data[0][:trim_size, :trim_size, :]
-            gt_boxes.clamp_(0, trim_size)
             im_info[0, 0] = trim_size
             im_info[0, 1] = trim_size
 
-
-        # check the bounding box:
-        not_keep = (gt_boxes[:,0] == gt_boxes[:,2]) | (gt_boxes[:,1] == gt_boxes[:,3])
-        keep = torch.nonzero(not_keep == 0).view(-1)
-
-        gt_boxes_padding = torch.FloatTensor(self.max_num_box, gt_boxes.size(1)).zero_()
-        if keep.numel() != 0:
-            gt_boxes = gt_boxes[keep]
-            num_boxes = min(gt_boxes.size(0), self.max_num_box)
-            gt_boxes_padding[:num_boxes,:] = gt_boxes[:num_boxes]
-        else:
-            num_boxes = 0
-
-            # permute trim_data to adapt to downstream processing
-        padding_data = padding_data.permute(2, 0, 1).contiguous()
+        # permute to adapt to downstream processing, the copy happens in collate_fn.
+        # uint8 images stay NHWC, the network permutes them on the device.
+        if not cfg.UINT8_INPUT:
+            data = data.permute(2, 0, 1)
         im_info = im_info.view(3)
 
-        return padding_data, im_info, gt_boxes_padding, num_boxes
+        return data, im_info, gt_boxes, need_crop, ratio
     else:
-        data = data.permute(0, 3, 1, 2).contiguous().view(3, data_height, data_width)
+        if cfg.UINT8_INPUT:
+            data = data[0]
+        else:
+            data = data.permute(0, 3, 1, 2).contiguous().view(3, data_height, data_width)
         im_info = im_info.view(3)
 
         gt_boxes = torch.FloatTensor([1,1,1,1,1])
@@ -213,3 +138,58 @@ class roibatchLoader(data.Dataset):
 
   def __len__(self):
     return len(self._roidb)
+
+  def collate_fn(self, batch):
+    """Crop and pad the samples of a batch into one preallocated batch buffer.
+
+    The crop windows of all samples are drawn at once and every image is
+    copied once, in place, from its window into a single zeroed
+    (B, 3, H, W) tensor sized by the padded shapes recorded in im_info.
+    The gt boxes are shifted, clamped and filtered for the whole batch.
+    With cfg.UINT8_INPUT the buffer is a (B, H, W, 3) uint8 tensor padded
+    with the pixel means, which become zeros once the network subtracts them.
+    With pin_memory the image and gt box buffers are returned page-locked.
+    """
+    batch_size = len(batch)
+    height = max(int(sample[1][0]) for sample in batch)
+    width = max(int(sample[1][1]) for sample in batch)
+
+    if cfg.UINT8_INPUT:
+        padding_data = torch.empty(batch_size, height, width, 3, dtype=torch.uint8)
+        pixel_means = torch.from_numpy(np.round(cfg.PIXEL_MEANS).astype(np.uint8))
+        padding_data.copy_(pixel_means.view(1, 1, 1, 3).expand_as(padding_data))
+        sizes = [sample[0].shape[:2] for sample in batch]
+    else:
+        padding_data = torch.zeros(batch_size, 3, height, width)
+        sizes = [sample[0].shape[1:] for sample in batch]
+    im_info = torch.stack([sample[1] for sample in batch], 0)
+
+    num_boxes = torch.LongTensor([sample[2].size(0) for sample in batch])
+    gt_boxes = torch.zeros(batch_size, max(1, int(num_boxes.max())), 5)
+    for i, sample in enumerate(batch):
+        gt_boxes[i, :sample[2].size(0)] = sample[2]
+
+    x_s, y_s, crop_w, crop_h, x_limit, y_limit = sample_crop_windows(
+        gt_boxes, num_boxes,
+        torch.LongTensor([size[0] for size in sizes]),
+        torch.LongTensor([size[1] for size in sizes]),
+        torch.DoubleTensor([sample[4] for sample in batch]),
+        torch.ByteTensor([sample[3] for sample in batch]) > 0)
+
+    for i, sample in enumerate(batch):
+        data = sample[0]
+        x0, y0 = int(x_s[i]), int(y_s[i])
+        h = min(int(crop_h[i]), height)
+        w = min(int(crop_w[i]), width)
+        if cfg.UINT8_INPUT:
+            padding_data[i, :h, :w].copy_(data[y0:y0 + h, x0:x0 + w])
+        else:
+            padding_data[i, :, :h, :w].copy_(data[:, y0:y0 + h, x0:x0 + w])
+
+    gt_boxes, num_boxes = crop_gt_boxes(gt_boxes, num_boxes, x_s, y_s,
+                                        x_limit, y_limit, self.max_num_box)
+    if self.pin_memory:
+        padding_data = padding_data.pin_memory()
+        gt_boxes = gt_boxes.pin_memory()
+
+    return padding_data, im_info, gt_boxes, num_boxes
@@ -7,87 +7,100 @@ import datasets
 import numpy as np
 from model.utils.config import cfg
 from datasets.factory import get_imdb
+from roi_data_layer.columnar_roidb import ColumnarRoidb
+import os
+import os.path as osp
+import pickle
 import PIL
 import pdb
 
 def prepare_roidb(imdb):
   """Enrich the imdb's roidb by adding some derived quantities that
-  are useful for training. This function precomputes the maximum
-  overlap, taken over ground-truth boxes, between each ROI and
-  each ground-truth box. The class with maximum overlap is also
-  recorded.
+  are useful for training. The per-box maximum overlap over the
+  ground-truth boxes, the class with the maximum overlap and the crowd
+  flag are precomputed once per imdb and cached on disk, so gt_overlaps
+  is never densified here or in the data layer.
   """
 
   roidb = imdb.roidb
   if not (imdb.name.startswith('coco')):
-    sizes = [PIL.Image.open(imdb.image_path_at(i)).size
-         for i in range(imdb.num_images)]
-         
+    sizes = imdb._get_sizes()
+  max_overlaps, max_classes, gt_crowd = imdb._get_gt_stats()
+
   for i in range(len(imdb.image_index)):
     roidb[i]['img_id'] = imdb.image_id_at(i)
-    roidb[i]['image'] = imdb.image_path_at(i)
+    roidb[i]['image'] = imdb.image_uri_at(i)
     if not (imdb.name.startswith('coco')):
       roidb[i]['width'] = sizes[i][0]
       roidb[i]['height'] = sizes[i][1]
-    # need gt_overlaps as a dense array for argmax
-    gt_overlaps = roidb[i]['gt_overlaps'].toarray()
-    # max overlap with gt over classes (columns)
-    max_overlaps = gt_overlaps.max(axis=1)
-    # gt class that had the max overlap
-    max_classes = gt_overlaps.argmax(axis=1)
-    roidb[i]['max_classes'] = max_classes
-    roidb[i]['max_overlaps'] = max_overlaps
-    # sanity checks
-    # max overlap of 0 => class should be zero (background)
-    zero_inds = np.where(max_overlaps == 0)[0]
-    assert all(max_classes[zero_inds] == 0)
-    # max overlap > 0 => class should not be zero (must be a fg class)
-    nonzero_inds = np.where(max_overlaps > 0)[0]
-    assert all(max_classes[nonzero_inds] != 0)
+    roidb[i]['max_overlaps'] = max_overlaps[i]
+    roidb[i]['max_classes'] = max_classes[i]
+    roidb[i]['gt_crowd'] = gt_crowd[i]
 
 
 def rank_roidb_ratio(roidb):
     # rank roidb based on the ratio between width and height.
     ratio_large = 2 # largest ratio to preserve.
     ratio_small = 0.5 # smallest ratio to preserve.    
-    
-    ratio_list = []
-    for i in range(len(roidb)):
-      width = roidb[i]['width']
-      height = roidb[i]['height']
-      ratio = width / float(height)
-
-      if ratio > ratio_large:
-        roidb[i]['need_crop'] = 1
-        ratio = ratio_large
-      elif ratio < ratio_small:
-        roidb[i]['need_crop'] = 1
-        ratio = ratio_small        
-      else:
-        roidb[i]['need_crop'] = 0
-
-      ratio_list.append(ratio)
-
-    ratio_list = np.array(ratio_list)
+
+    if isinstance(roidb, ColumnarRoidb):
+      width, height = roidb.width, roidb.height
+    else:
+      width = np.fromiter((r['width'] for r in roidb), dtype=np.float64, count=len(roidb))
+      height = np.fromiter((r['height'] for r in roidb), dtype=np.float64, count=len(roidb))
+
+    ratio_list = width / height.astype(np.float64)
+    need_crop = ((ratio_list > ratio_large) |
+                 (ratio_list < ratio_small)).astype(np.uint8)
+    ratio_list = np.clip(ratio_list, ratio_small, ratio_large)
+
+    if isinstance(roidb, ColumnarRoidb):
+      roidb.need_crop = need_crop
+    else:
+      for r, crop in zip(roidb, need_crop.tolist()):
+        r['need_crop'] = crop
+
     ratio_index = np.argsort(ratio_list)
     return ratio_list[ratio_index], ratio_index
 
 def filter_roidb(roidb):
     # filter the image without bounding box.
     print('before filtering, there are %d images...' % (len(roidb)))
-    i = 0
-    while i < len(roidb):
-      if len(roidb[i]['boxes']) == 0:
-        del roidb[i]
-        i -= 1
-      i += 1
+    if isinstance(roidb, ColumnarRoidb):
+      keep = np.flatnonzero(roidb.num_boxes > 0)
+      if len(keep) < len(roidb):
+        roidb = roidb.select(keep)
+    else:
+      roidb = [r for r in roidb if len(r['boxes']) > 0]
 
     print('after filtering, there are %d images...' % (len(roidb)))
     return roidb
 
+def _roidb_stamp(imdb_names, cache_path):
+  """Stamp of what the columnar roidb of imdb_names is built from: the
+  mtimes of the gt roidb and image size caches of every imdb, the proposal
+  method, and the path, mtime and size of every image archive, whose
+  offsets the archive URIs hold."""
+  files = []
+  for name in imdb_names.split('+'):
+    for suffix in ('_gt_roidb.pkl', '_image_sizes.pkl'):
+      path = osp.join(cache_path, name + suffix)
+      files.append((path, osp.getmtime(path) if osp.exists(path) else None))
+  archives = []
+  for path in cfg.IMAGE_ARCHIVES:
+    path = osp.abspath(path)
+    st = os.stat(path) if osp.exists(path) else None
+    archives.append((path, st.st_mtime, st.st_size) if st is not None else (path, None, None))
+  return {'files': files, 'proposal_method': cfg.TRAIN.PROPOSAL_METHOD,
+          'archives': archives}
+
 def combined_roidb(imdb_names, training=True):
   """
-  Combine multiple roidbs
+  Combine multiple roidbs into one ColumnarRoidb.
+
+  The columnar roidb is cached under the data cache directory together
+  with the stamp of its sources, and memory mapped from there on later
+  calls until the stamp changes.
   """
 
   def get_training_roidb(imdb):
@@ -108,24 +121,56 @@ def combined_roidb(imdb_names, training=True):
   def get_roidb(imdb_name):
     imdb = get_imdb(imdb_name)
     print('Loaded dataset `{:s}` for training'.format(imdb.name))
+    if cfg.IMAGE_ARCHIVES:
+      imdb.set_archives(cfg.IMAGE_ARCHIVES)
     imdb.set_proposal_method(cfg.TRAIN.PROPOSAL_METHOD)
     print('Set proposal method: {:s}'.format(cfg.TRAIN.PROPOSAL_METHOD))
     roidb = get_training_roidb(imdb)
     return roidb
 
-  roidbs = [get_roidb(s) for s in imdb_names.split('+')]
-  roidb = roidbs[0]
-
-  if len(roidbs) > 1:
-    for r in roidbs[1:]:
-      roidb.extend(r)
-    tmp = get_imdb(imdb_names.split('+')[1])
-    imdb = datasets.imdb.imdb(imdb_names, tmp.classes)
+  def get_combined_imdb():
+    if '+' in imdb_names:
+      tmp = get_imdb(imdb_names.split('+')[1])
+      return datasets.imdb.imdb(imdb_names, tmp.classes)
+    return get_imdb(imdb_names)
+
+  cache_path = osp.abspath(osp.join(cfg.DATA_DIR, 'cache'))
+  cache_dir = osp.join(cache_path, '{}_{}{}{}_columnar_roidb'.format(
+    imdb_names, 'train' if training else 'test',
+    '_flipped' if training and cfg.TRAIN.USE_FLIPPED else '',
+    '_archived' if cfg.IMAGE_ARCHIVES else ''))
+  stamp_file = osp.join(cache_dir, 'stamp.pkl')
+  cached_stamp = None
+  if ColumnarRoidb.exists(cache_dir) and osp.exists(stamp_file):
+    with open(stamp_file, 'rb') as f:
+      cached_stamp = pickle.load(f)
+  if cached_stamp is not None and cached_stamp == _roidb_stamp(imdb_names, cache_path):
+    roidb = ColumnarRoidb.load(cache_dir)
+    print('columnar roidb loaded from {}'.format(cache_dir))
+    imdb = get_combined_imdb()
   else:
-    imdb = get_imdb(imdb_names)
-
-  if training:
-    roidb = filter_roidb(roidb)
+    if ColumnarRoidb.exists(cache_dir):
+      print('columnar roidb in {} is out of date, rebuilding it'.format(cache_dir))
+    roidbs = [get_roidb(s) for s in imdb_names.split('+')]
+    roidb = roidbs[0]
+
+    if len(roidbs) > 1:
+      for r in roidbs[1:]:
+        roidb.extend(r)
+    imdb = get_combined_imdb()
+
+    roidb = ColumnarRoidb.from_roidb(roidb)
+    if training:
+      roidb = filter_roidb(roidb)
+    roidb.save(cache_dir)
+    # stamped once the sources are all written
+    tmp_file = '{}.{:d}.tmp'.format(stamp_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+      pickle.dump(_roidb_stamp(imdb_names, cache_path), f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, stamp_file)
+    print('wrote columnar roidb to {}'.format(cache_dir))
+    # map the saved columns back, so data loader workers share their pages
+    roidb = ColumnarRoidb.load(cache_dir)
 
   ratio_list, ratio_index = rank_roidb_ratio(roidb)
 
@@ -0,0 +1,248 @@
+"""Batch samplers for the roibatchLoader dataset."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data.sampler import Sampler
+
+
+def shuffle_buffer(items, buffer_size, generator):
+  """Locally shuffled order of items.
+
+  Every next item is drawn at random from a buffer holding the next
+  buffer_size items of the input order, so items move at most about
+  buffer_size places forward and the order keeps following the input.
+  """
+  u = torch.rand(len(items), generator=generator).tolist()
+  buf = []
+  out = []
+  for item, r in zip(items, u):
+    if len(buf) < buffer_size:
+      buf.append(item)
+      continue
+    j = int(r * len(buf))
+    out.append(buf[j])
+    buf[j] = item
+  perm = torch.randperm(len(buf), generator=generator).tolist()
+  out.extend(buf[j] for j in perm)
+  return out
+
+
+class AspectRatioBatchSampler(Sampler):
+  """Yields whole aspect-ratio groups as batches, in a random group order.
+
+  The dataset indices are positions in the ratio-sorted roidb, and
+  roibatchLoader.ratio_list_batch assigns one target ratio to every block of
+  batch_size consecutive positions. Keeping each block together as one
+  batch lets roibatchLoader.collate_fn pad the whole group into a single
+  buffer. The tail positions that do not fill a block form the last batch,
+  unless drop_last is set.
+
+  The group order is drawn from seed + epoch, so every rank computes the
+  same permutation and takes every num_replicas-th group of it; the order
+  is padded by repeating its head so all ranks see the same number of
+  batches. state_dict() / load_state_dict() record how many batches of the
+  current epoch were consumed, and a restored sampler resumes right after
+  them instead of replaying the epoch.
+
+  With read_keys, one sort key per dataset position such as
+  datasets.archive.read_order() of the images, and buffer_size > 0 the
+  batches are instead ordered by the smallest key of their images and
+  passed through a shuffle buffer of buffer_size batches, so archived
+  images are read mostly sequentially.
+  """
+
+  def __init__(self, train_size, batch_size, num_replicas=None, rank=None,
+               seed=0, drop_last=False, read_keys=None, buffer_size=0):
+    if num_replicas is None:
+      num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+    if rank is None:
+      rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+    self.num_data = train_size
+    self.num_per_batch = int(train_size / batch_size)
+    self.batch_size = batch_size
+    self.num_replicas = num_replicas
+    self.rank = rank
+    self.seed = seed
+    self.epoch = 0
+    self.range = torch.arange(0, batch_size).view(1, batch_size).long()
+    self.leftover_flag = False
+    if train_size % batch_size and not drop_last:
+      self.leftover = torch.arange(self.num_per_batch*batch_size, train_size).long()
+      self.leftover_flag = True
+    self.num_groups = self.num_per_batch + int(self.leftover_flag)
+    self.read_keys = None if read_keys is None else np.asarray(read_keys)
+    self.buffer_size = buffer_size
+    # batches of the current epoch to skip, and batches handed out so far
+    self._start = 0
+    self._yielded = 0
+
+  def set_epoch(self, epoch):
+    """Select the epoch whose group order the next iteration follows."""
+    if epoch != self.epoch:
+      self._start = 0
+    self.epoch = epoch
+
+  @property
+  def start(self):
+    """Number of batches of the current epoch a restored sampler skips."""
+    return self._start
+
+  def _epoch_batches(self):
+    """All batches of the current epoch, before sharding."""
+    g = torch.Generator()
+    g.manual_seed(self.seed + self.epoch)
+    order = torch.randperm(self.num_per_batch, generator=g).view(-1, 1) * self.batch_size
+    batches = (order + self.range).tolist()
+    if self.leftover_flag:
+      batches.append(self.leftover.tolist())
+    return self._read_ordered(batches, g)
+
+  def _read_ordered(self, batches, g):
+    """Reorder shuffled batches by read_keys through the shuffle buffer."""
+    if self.read_keys is None or self.buffer_size <= 0:
+      return batches
+    keys = [min(self.read_keys[p if isinstance(p, int) else p[0]] for p in batch)
+            for batch in batches]
+    # stable, so batches with equal keys keep their shuffled order
+    order = np.argsort(keys, kind='mergesort')
+    return shuffle_buffer([batches[i] for i in order], self.buffer_size, g)
+
+  def __iter__(self):
+    batches = self._epoch_batches()
+    # pad the batches so that they split evenly over the ranks
+    num_padded = len(self) * self.num_replicas - len(batches)
+    if num_padded > 0:
+      batches += (batches * (num_padded // len(batches) + 1))[:num_padded]
+    batches = batches[self.rank::self.num_replicas]
+
+    start, self._start = self._start, 0
+    self._yielded = start
+    for batch in batches[start:]:
+      self._yielded += 1
+      yield batch
+
+  def __len__(self):
+    return (self.num_groups + self.num_replicas - 1) // self.num_replicas
+
+  def state_dict(self, consumed=None):
+    """Position in the current epoch.
+
+    consumed is the number of batches of the epoch the caller has actually
+    processed. It defaults to the number handed out so far, which runs
+    ahead of training when the DataLoader prefetches batches.
+    """
+    return {'epoch': self.epoch,
+            'seed': self.seed,
+            'batch_size': self.batch_size,
+            'num_replicas': self.num_replicas,
+            'consumed': self._yielded if consumed is None else consumed}
+
+  def load_state_dict(self, state):
+    if state['batch_size'] != self.batch_size or \
+       state['num_replicas'] != self.num_replicas:
+      raise ValueError('cannot resume a sampler saved with batch size {} on {} '
+                       'replicas with batch size {} on {} replicas'.format(
+                         state['batch_size'], state['num_replicas'],
+                         self.batch_size, self.num_replicas))
+    self.seed = state['seed']
+    self.epoch = state['epoch']
+    self._start = min(state['consumed'], len(self))
+    self._yielded = self._start
+
+
+class PixelBudgetBatchSampler(AspectRatioBatchSampler):
+  """Multi-scale batches grouped by (scale, aspect-ratio bucket).
+
+  Every epoch draws one training scale per image and groups the images by
+  that scale and by one of num_buckets log-spaced buckets of their clipped
+  aspect ratio (the middle edge sits at ratio 1, so no bucket straddles
+  it). Each group is cut into batches holding as many images as fit in
+  pixel_budget once padded to the bucket's most elongated shape, so small
+  scales get larger batches.
+
+  Batch items are (position, scale_ind, target_ratio) tuples, which
+  roibatchLoader.__getitem__ uses instead of its fixed ratio_list_batch
+  and a randomly drawn scale. target_ratio follows the same rule as
+  ratio_list_batch, applied to the images of the batch.
+  """
+
+  def __init__(self, ratio_list, scales, pixel_budget, num_buckets=8,
+               num_replicas=None, rank=None, seed=0, read_keys=None, buffer_size=0):
+    super(PixelBudgetBatchSampler, self).__init__(len(ratio_list), 1, num_replicas,
+                                                  rank, seed, read_keys=read_keys,
+                                                  buffer_size=buffer_size)
+    self.ratio_list = np.asarray(ratio_list, dtype=np.float64)
+    self.scales = list(scales)
+    self.pixel_budget = pixel_budget
+    self.num_buckets = num_buckets - num_buckets % 2
+    assert self.num_buckets > 0, 'need at least two ratio buckets'
+
+    log_ratio = np.log(self.ratio_list)
+    edges = np.linspace(np.log(0.5), np.log(2.), self.num_buckets + 1)
+    self.bucket = np.clip(np.searchsorted(edges, log_ratio, side='right') - 1,
+                          0, self.num_buckets - 1)
+    # padded area of an image relative to scale ** 2, at the extreme ratio
+    # of every bucket
+    self.bucket_area = np.exp(np.maximum(np.abs(edges[:-1]), np.abs(edges[1:])))
+    self._cache = (None, None)
+
+  def _batch_size(self, scale_ind, bucket):
+    area = self.scales[scale_ind] ** 2 * self.bucket_area[bucket]
+    return max(1, int(self.pixel_budget // area))
+
+  def _target_ratio(self, positions):
+    ratios = self.ratio_list[positions]
+    if ratios.max() < 1:
+      return float(ratios.min())
+    elif ratios.min() > 1:
+      return float(ratios.max())
+    return 1.
+
+  def _epoch_batches(self):
+    if self._cache[0] == self.epoch:
+      return list(self._cache[1])
+    g = torch.Generator()
+    g.manual_seed(self.seed + self.epoch)
+    num_data = len(self.ratio_list)
+    scale_inds = torch.randint(len(self.scales), (num_data,), generator=g).numpy()
+    perm = torch.randperm(num_data, generator=g).numpy()
+    keys = (scale_inds * self.num_buckets + self.bucket)[perm]
+    # group by key, stable so that the images stay shuffled inside a group
+    group_order = np.argsort(keys, kind='mergesort')
+    order = perm[group_order]
+    bounds = np.flatnonzero(np.diff(keys[group_order])) + 1
+
+    batches = []
+    for group in np.split(order, bounds):
+      if len(group) == 0:
+        continue
+      scale_ind = int(scale_inds[group[0]])
+      size = self._batch_size(scale_ind, self.bucket[group[0]])
+      for i in range(0, len(group), size):
+        positions = group[i:i + size]
+        ratio = self._target_ratio(positions)
+        batches.append([(int(p), scale_ind, ratio) for p in positions])
+
+    shuffle = torch.randperm(len(batches), generator=g).tolist()
+    batches = self._read_ordered([batches[i] for i in shuffle], g)
+    self._cache = (self.epoch, batches)
+    return list(batches)
+
+  def __len__(self):
+    return (len(self._epoch_batches()) + self.num_replicas - 1) // self.num_replicas
+
+  def state_dict(self, consumed=None):
+    state = super(PixelBudgetBatchSampler, self).state_dict(consumed)
+    state['pixel_budget'] = self.pixel_budget
+    return state
+
+  def load_state_dict(self, state):
+    if state.get('pixel_budget') != self.pixel_budget:
+      raise ValueError('cannot resume a sampler saved with pixel budget {} '
+                       'with pixel budget {}'.format(state.get('pixel_budget'),
+                                                     self.pixel_budget))
+    super(PixelBudgetBatchSampler, self).load_state_dict(state)
@@ -119,6 +119,14 @@ ext_modules = [
         extra_compile_args={'gcc': ["-Wno-cpp", "-Wno-unused-function"]},
         include_dirs=[numpy_include]
     ),
+    Extension(
+        "model.nms.cpu_nms",
+        ["model/nms/cpu_nms.pyx"],
+        # no FMA contraction, so the IoU rounds like the GPU kernel's
+        extra_compile_args={'gcc': ["-Wno-cpp", "-Wno-unused-function",
+                                    "-ffp-contract=off"]},
+        include_dirs=[numpy_include]
+    ),
     Extension(
         'pycocotools._mask',
         sources=['pycocotools/maskApi.c', 'pycocotools/_mask.pyx'],
@@ -0,0 +1,79 @@
+# --------------------------------------------------------
+# Pytorch multi-GPU Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Pack the training images of a dataset into pre-decoded uint8 shards.
+
+Train with the result by passing --shards <output_dir> to trainval_net.py.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import argparse
+import pprint
+import time
+
+from roi_data_layer.roidb import combined_roidb
+from roi_data_layer.image_shards import pack_images
+from model.utils.config import cfg, cfg_from_file
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Pack training images into uint8 shards')
+  parser.add_argument('--dataset', dest='dataset',
+                      help='training dataset',
+                      default='pascal_voc', type=str)
+  parser.add_argument('--net', dest='net',
+                      help='vgg16, res101',
+                      default='vgg16', type=str)
+  parser.add_argument('--ls', dest='large_scale',
+                      help='whether use large imag scale',
+                      action='store_true')
+  parser.add_argument('--output_dir', dest='output_dir',
+                      help='directory to write the shards to',
+                      required=True, type=str)
+  parser.add_argument('--shard_gb', dest='shard_gb',
+                      help='maximal size of a single shard file in GB',
+                      default=4, type=float)
+
+  args = parser.parse_args()
+  return args
+
+
+if __name__ == '__main__':
+
+  args = parse_args()
+
+  print('Called with args:')
+  print(args)
+
+  if args.dataset == "pascal_voc":
+      args.imdb_name = "voc_2007_trainval"
+  elif args.dataset == "pascal_voc_0712":
+      args.imdb_name = "voc_2007_trainval+voc_2012_trainval"
+  elif args.dataset == "coco":
+      args.imdb_name = "coco_2014_train+coco_2014_valminusminival"
+  elif args.dataset == "imagenet":
+      args.imdb_name = "imagenet_train"
+  elif args.dataset == "vg":
+      args.imdb_name = "vg_150-50-50_minitrain"
+
+  args.cfg_file = "cfgs/{}_ls.yml".format(args.net) if args.large_scale else "cfgs/{}.yml".format(args.net)
+  cfg_from_file(args.cfg_file)
+
+  print('Using config:')
+  pprint.pprint(cfg)
+
+  # flipped entries reuse the images of the original ones
+  cfg.TRAIN.USE_FLIPPED = False
+  imdb, roidb, ratio_list, ratio_index = combined_roidb(args.imdb_name)
+
+  start = time.time()
+  pack_images(roidb, args.output_dir, cfg.TRAIN.SCALES[0], cfg.TRAIN.MAX_SIZE,
+              shard_bytes=int(args.shard_gb * (1 << 30)))
+  print('packing time: {:.1f}s'.format(time.time() - start))
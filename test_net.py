@@ -23,9 +23,11 @@ import torch.optim as optim
 import pickle
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
+from roi_data_layer.prefetcher import DataPrefetcher
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
+from model.utils.image_decode import decode_image
 from model.rpn.bbox_transform import clip_boxes
-from model.nms.nms_wrapper import nms
+from model.nms.multiclass_nms import multiclass_nms
 from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import save_net, load_net, vis_detections
 from model.faster_rcnn.vgg16 import vgg16
@@ -59,6 +61,12 @@ def parse_args():
   parser.add_argument('--load_dir', dest='load_dir',
                       help='directory to load models', default="/data2/mikeliao/DLAProj/faster-rcnn.pytorch/models",
                       nargs=argparse.REMAINDER)
+  parser.add_argument('--archives', dest='archives',
+                      help='comma separated tar/zip archives holding the images',
+                      default='', type=str)
+  parser.add_argument('--uint8', dest='uint8_input',
+                      help='load uint8 images and normalize them on the device',
+                      action='store_true')
   parser.add_argument('--cuda', dest='cuda',
                       help='whether use CUDA',
                       action='store_true')
@@ -139,6 +147,8 @@ if __name__ == '__main__':
   pprint.pprint(cfg)
 
   cfg.TRAIN.USE_FLIPPED = False
+  cfg.UINT8_INPUT = args.uint8_input
+  cfg.IMAGE_ARCHIVES = [a for a in args.archives.split(',') if a]
   imdb, roidb, ratio_list, ratio_index = combined_roidb(args.imdbval_name, False)
   imdb.competition_mode(on=True)
 
@@ -179,24 +189,6 @@ if __name__ == '__main__':
 
 
   print('load model successfully!')
-  # initilize the tensor holder here.
-  im_data = torch.FloatTensor(1)
-  im_info = torch.FloatTensor(1)
-  num_boxes = torch.LongTensor(1)
-  gt_boxes = torch.FloatTensor(1)
-
-  # ship to cuda
-  if args.cuda:
-    im_data = im_data.cuda()
-    im_info = im_info.cuda()
-    num_boxes = num_boxes.cuda()
-    gt_boxes = gt_boxes.cuda()
-
-  # make variable
-  im_data = Variable(im_data, volatile=True)
-  im_info = Variable(im_info, volatile=True)
-  num_boxes = Variable(num_boxes, volatile=True)
-  gt_boxes = Variable(gt_boxes, volatile=True)
 
   if args.cuda:
     cfg.CUDA = True
@@ -226,7 +218,8 @@ if __name__ == '__main__':
                             shuffle=False, num_workers=0,
                             pin_memory=True)
 
-  data_iter = iter(dataloader)
+  # stages the next images on the device while the current one is detected
+  data_iter = iter(DataPrefetcher(dataloader, cuda=args.cuda))
 
   _t = {'im_detect': time.time(), 'misc': time.time()}
   det_file = os.path.join(output_dir, 'detections.pkl')
@@ -236,16 +229,15 @@ if __name__ == '__main__':
   for i in range(num_images):
 
       data = next(data_iter)
-      im_data.data.resize_(data[0].size()).copy_(data[0])
-      im_info.data.resize_(data[1].size()).copy_(data[1])
-      gt_boxes.data.resize_(data[2].size()).copy_(data[2])
-      num_boxes.data.resize_(data[3].size()).copy_(data[3])
+      im_data, im_info, gt_boxes, num_boxes = data
 
       det_tic = time.time()
-      rois, cls_prob, bbox_pred, \
-      rpn_loss_cls, rpn_loss_box, \
-      RCNN_loss_cls, RCNN_loss_bbox, \
-      rois_label = fasterRCNN(im_data, im_info, gt_boxes, num_boxes)
+      # inference only, no autograd graph
+      with torch.no_grad():
+        rois, cls_prob, bbox_pred, \
+        rpn_loss_cls, rpn_loss_box, \
+        RCNN_loss_cls, RCNN_loss_bbox, \
+        rois_label = fasterRCNN(im_data, im_info, gt_boxes, num_boxes)
 
       scores = cls_prob.data
       boxes = rois.data[:, :, 1:5]
@@ -278,40 +270,23 @@ if __name__ == '__main__':
       detect_time = det_toc - det_tic
       misc_tic = time.time()
       if vis:
-          im = cv2.imread(imdb.image_path_at(i))
+          im = decode_image(roidb[i]['image'])
           im2show = np.copy(im)
+      # all classes suppressed and capped to max_per_image in one pass
+      cls_dets_all, _ = multiclass_nms(pred_boxes.view(1, scores.size(0), -1),
+                                       scores.unsqueeze(0), cfg.TEST.NMS,
+                                       score_thresh=thresh, max_per_image=max_per_image,
+                                       out_device='cpu', mode=cfg.TEST.MODE)
       for j in xrange(1, imdb.num_classes):
-          inds = torch.nonzero(scores[:,j]>thresh).view(-1)
+          cls_dets = cls_dets_all[0][j]
           # if there is det
-          if inds.numel() > 0:
-            cls_scores = scores[:,j][inds]
-            _, order = torch.sort(cls_scores, 0, True)
-            if args.class_agnostic:
-              cls_boxes = pred_boxes[inds, :]
-            else:
-              cls_boxes = pred_boxes[inds][:, j * 4:(j + 1) * 4]
-            
-            cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1)), 1)
-            # cls_dets = torch.cat((cls_boxes, cls_scores), 1)
-            cls_dets = cls_dets[order]
-            keep = nms(cls_dets, cfg.TEST.NMS)
-            cls_dets = cls_dets[keep.view(-1).long()]
+          if cls_dets.numel() > 0:
             if vis:
-              im2show = vis_detections(im2show, imdb.classes[j], cls_dets.cpu().numpy(), 0.3)
-            all_boxes[j][i] = cls_dets.cpu().numpy()
+              im2show = vis_detections(im2show, imdb.classes[j], cls_dets.numpy(), 0.3)
+            all_boxes[j][i] = cls_dets.numpy()
           else:
             all_boxes[j][i] = empty_array
 
-      # Limit to max_per_image detections *over all classes*
-      if max_per_image > 0:
-          image_scores = np.hstack([all_boxes[j][i][:, -1]
-                                    for j in xrange(1, imdb.num_classes)])
-          if len(image_scores) > max_per_image:
-              image_thresh = np.sort(image_scores)[-max_per_image]
-              for j in xrange(1, imdb.num_classes):
-                  keep = np.where(all_boxes[j][i][:, -1] >= image_thresh)[0]
-                  all_boxes[j][i] = all_boxes[j][i][keep, :]
-
       misc_toc = time.time()
       nms_time = misc_toc - misc_tic
 
@@ -0,0 +1,7 @@
+import os.path as osp
+import sys
+
+# the tests import the packages under lib/, as the tools do through _init_paths
+lib_path = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), 'lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import torch
+
+from model.rpn.anchor_grid import grid_anchors, inside_anchor_inds
+from model.rpn.anchor_overlaps import sparse_anchor_overlaps
+from model.rpn.bbox_transform import bbox_overlaps_batch
+
+
+def dense_overlaps(anchors, gt_boxes):
+    """The reductions of the dense overlaps in anchor_target_layer.py."""
+    overlaps = bbox_overlaps_batch(anchors, gt_boxes)
+    max_overlaps, argmax_overlaps = torch.max(overlaps, 2)
+    gt_max_overlaps, _ = torch.max(overlaps, 1)
+    target = gt_max_overlaps.clone()
+    target[target == 0] = 1e-5
+    keep = torch.sum(overlaps.eq(target.view(gt_boxes.size(0), 1, -1).expand_as(overlaps)), 2)
+    return max_overlaps, argmax_overlaps, gt_max_overlaps, keep
+
+
+def random_gt_boxes(batch_size, num_gt, im_height, im_width, seed):
+    """(B, num_gt, 5) boxes, the last ones of every image zero padding and
+    one degenerate 1x1 box."""
+    rng = np.random.RandomState(seed)
+    xy = np.round(rng.uniform(0, 1, (batch_size, num_gt, 2)) * [im_width, im_height])
+    wh = np.round(rng.uniform(0.02, 0.5, (batch_size, num_gt, 2)) * [im_width, im_height])
+    boxes = np.concatenate((xy, np.minimum(xy + wh, [im_width - 1, im_height - 1]),
+                            np.ones((batch_size, num_gt, 1))), 2)
+    if num_gt > 3:
+        boxes[:, -3, 2:4] = boxes[:, -3, :2]
+        boxes[:, -2:] = 0
+    return torch.from_numpy(boxes.astype(np.float32))
+
+
+@pytest.mark.parametrize('im_height, im_width', [(600, 1000), (800, 1333), (224, 224)])
+@pytest.mark.parametrize('num_gt', [1, 6, 40])
+def test_sparse_overlaps_match_dense(im_height, im_width, num_gt):
+    scales, ratios, stride = np.array([4, 8, 16, 32]), np.array([0.5, 1, 2]), 16
+    feat_height, feat_width = im_height // stride, im_width // stride
+    all_anchors = grid_anchors(feat_height, feat_width, stride, scales, ratios, 'cpu')
+    inds_inside = inside_anchor_inds(feat_height, feat_width, stride, scales, ratios,
+                                     im_height, im_width, 0, 'cpu')
+    gt_boxes = random_gt_boxes(2, num_gt, im_height, im_width, num_gt)
+
+    expected = dense_overlaps(all_anchors[inds_inside], gt_boxes)
+    outputs = sparse_anchor_overlaps(all_anchors, inds_inside, gt_boxes,
+                                     feat_height, feat_width)
+    for output, dense in zip(outputs, expected):
+        assert output.dtype == dense.dtype
+    assert torch.equal(outputs[0], expected[0])
+    # the argmax of the anchors overlapping no gt box is 0, the one of the
+    # dense max depends on the pytorch version; they get no box targets
+    overlapping = expected[0] > 0
+    assert torch.equal(outputs[1][overlapping], expected[1][overlapping])
+    assert torch.equal(outputs[1][overlapping == 0], torch.zeros_like(outputs[1][overlapping == 0]))
+    assert torch.equal(outputs[2], expected[2])
+    assert torch.equal(outputs[3], expected[3])
@@ -0,0 +1,44 @@
+import numpy as np
+import torch
+
+from model.rpn.anchor_target_layer import _AnchorTargetLayer, _subsample_labels
+
+
+def random_labels(batch_size, num_anchors, seed):
+    g = torch.Generator().manual_seed(seed)
+    return (torch.randint(0, 3, (batch_size, num_anchors), generator=g) - 1).float()
+
+
+def test_subsample_labels_is_reproducible_with_a_generator():
+    labels = random_labels(3, 5000, 0)
+    # more positives than num_fg, fewer than batch_size
+    labels[:, 600:][labels[:, 600:] == 1] = -1
+    a = _subsample_labels(labels.clone(), 128, 256, torch.Generator().manual_seed(7))
+    b = _subsample_labels(labels.clone(), 128, 256, torch.Generator().manual_seed(7))
+    assert torch.equal(a, b)
+    # the quotas of every row, taken among the original labels
+    num_fg = (labels == 1).sum(1)
+    assert (num_fg > 128).all()
+    assert ((a == 1).sum(1) == 128).all()
+    assert torch.equal((a == 0).sum(1), 256 - num_fg)
+    assert not ((a == 1) & (labels != 1)).any()
+    assert not ((a == 0) & (labels != 0)).any()
+    c = _subsample_labels(labels.clone(), 128, 256, torch.Generator().manual_seed(8))
+    assert not torch.equal(a, c)
+
+
+def test_anchor_target_layer_is_reproducible_with_a_generator():
+    gt_boxes = torch.tensor([[[50, 60, 200, 300, 1],
+                              [300, 100, 500, 400, 2],
+                              [0, 0, 0, 0, 0]]] * 2, dtype=torch.float32)
+    inputs = (torch.zeros(2, 18, 38, 50), gt_boxes,
+              torch.tensor([[600., 800., 1.6]] * 2), torch.tensor([2, 2]))
+
+    def run(seed):
+        layer = _AnchorTargetLayer(16, np.array([8, 16, 32]), np.array([0.5, 1, 2]),
+                                   generator=torch.Generator().manual_seed(seed))
+        return layer(inputs)
+
+    first, second = run(3), run(3)
+    for a, b in zip(first, second):
+        assert torch.equal(a, b)
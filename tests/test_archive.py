@@ -0,0 +1,58 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from datasets import archive
+
+
+def make_tar(path, num_members):
+    contents = {}
+    with tarfile.open(path, 'w') as tar:
+        for i in range(num_members):
+            data = os.urandom(1000 + 37 * i)
+            info = tarfile.TarInfo('JPEGImages/{:06d}.jpg'.format(i))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            contents[info.name] = data
+    return contents
+
+
+def test_read_bytes(tmpdir):
+    path = str(tmpdir.join('images.tar'))
+    contents = make_tar(path, 5)
+    uris = archive.index_archive(path, str(tmpdir))
+    for name, data in contents.items():
+        assert archive.read_bytes(uris[name]) == data
+    # the cached listing gives the same URIs
+    assert archive.index_archive(path, str(tmpdir)) == uris
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork()')
+def test_forked_workers_read_without_pread(tmpdir, monkeypatch):
+    path = str(tmpdir.join('images.tar'))
+    contents = make_tar(path, 20)
+    uris = archive.index_archive(path)
+    names = sorted(contents)
+    # the lseek() and read() fallback, with the descriptor opened by the
+    # parent before the workers fork, as prepare_roidb() does
+    monkeypatch.delattr(os, 'pread', raising=False)
+    assert archive.read_bytes(uris[names[0]]) == contents[names[0]]
+    parent_fd = archive._descriptor(os.path.abspath(path))
+    os.lseek(parent_fd, 0, os.SEEK_SET)
+
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            for name in names:
+                if archive.read_bytes(uris[name]) != contents[name]:
+                    status = 1
+        except Exception:
+            status = 2
+        os._exit(status)
+    assert os.waitpid(pid, 0)[1] == 0
+    # the reads of the worker did not move the offset of the parent
+    assert os.lseek(parent_fd, 0, os.SEEK_CUR) == 0
+    assert archive.read_bytes(uris[names[-1]]) == contents[names[-1]]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import torch
+
+from model.nms.multiclass_nms import multiclass_nms
+from model.nms.nms_wrapper import nms
+from model.utils.config import cfg
+
+
+def detections(num_rois, num_classes, seed):
+    rng = np.random.RandomState(seed)
+    objects = rng.rand(num_rois // 20 + 1, 4) * [600, 400, 200, 200]
+    boxes = objects[rng.randint(0, len(objects), num_rois)][:, np.newaxis] + \
+        rng.randn(num_rois, num_classes, 4) * 10
+    boxes[:, :, 2:] = boxes[:, :, :2] + np.abs(boxes[:, :, 2:]) + 8
+    logits = rng.randn(2, num_rois, num_classes) * 3
+    scores = np.exp(logits) / np.exp(logits).sum(2, keepdims=True)
+    boxes = np.stack((boxes, boxes[::-1])).reshape(2, num_rois, -1)
+    return torch.from_numpy(boxes.astype(np.float32)), torch.from_numpy(scores.astype(np.float32))
+
+
+def per_class_nms(boxes, scores, nms_thresh, score_thresh):
+    """The per-class loop of test_net.py for one image."""
+    dets = [np.zeros((0, 5), dtype=np.float32)]
+    for j in range(1, scores.size(1)):
+        inds = torch.nonzero(scores[:, j] > score_thresh).view(-1)
+        cls_scores = scores[inds, j]
+        _, order = torch.sort(cls_scores, 0, True)
+        cls_dets = torch.cat((boxes[inds][:, j * 4:(j + 1) * 4], cls_scores.unsqueeze(1)), 1)
+        cls_dets = cls_dets[order]
+        dets.append(cls_dets[nms(cls_dets, nms_thresh).view(-1).long()].numpy()
+                    if inds.numel() > 0 else np.zeros((0, 5), dtype=np.float32))
+    return dets
+
+
+@pytest.mark.parametrize('max_boxes', [0, 300, 1500])
+@pytest.mark.parametrize('score_thresh', [0., 0.05])
+def test_chunked_nms_matches_per_class_loop(max_boxes, score_thresh):
+    boxes, scores = detections(200, 21, 5)
+    saved = cfg.TEST.NMS_MAX_BOXES
+    cfg.TEST.NMS_MAX_BOXES = max_boxes
+    try:
+        dets, _ = multiclass_nms(boxes, scores, 0.3, score_thresh=score_thresh)
+    finally:
+        cfg.TEST.NMS_MAX_BOXES = saved
+    for i in range(boxes.size(0)):
+        expected = per_class_nms(boxes[i], scores[i], 0.3, score_thresh)
+        for j in range(scores.size(2)):
+            np.testing.assert_array_equal(dets[i][j].numpy(), expected[j])
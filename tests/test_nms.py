@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import torch
+
+from model.nms import nms_cpu
+from model.nms.nms_wrapper import nms_gpu
+
+
+def greedy_nms(boxes, thresh):
+    """Plain greedy NMS with the float32 IoU of devIoU in nms_cuda_kernel.cu."""
+    boxes = boxes.astype(np.float32)
+    thresh = np.float32(thresh)
+    one, zero = np.float32(1), np.float32(0)
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in range(len(boxes)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        a = boxes[i]
+        for j in range(i + 1, len(boxes)):
+            b = boxes[j]
+            width = max(min(a[2], b[2]) - max(a[0], b[0]) + one, zero)
+            height = max(min(a[3], b[3]) - max(a[1], b[1]) + one, zero)
+            inter = width * height
+            area_a = (a[2] - a[0] + one) * (a[3] - a[1] + one)
+            area_b = (b[2] - b[0] + one) * (b[3] - b[1] + one)
+            if inter / (area_a + area_b - inter) > thresh:
+                suppressed[j] = True
+    return np.array(keep, dtype=np.int64)
+
+
+def clustered_boxes(num_boxes, seed, integer=False):
+    """(N, 4) boxes jittered around a few objects, like RPN proposals."""
+    rng = np.random.RandomState(seed)
+    objects = rng.rand(num_boxes // 20 + 1, 4) * [600, 400, 200, 200]
+    boxes = objects[rng.randint(0, len(objects), num_boxes)] + rng.randn(num_boxes, 4) * 10
+    boxes[:, 2:] = boxes[:, :2] + np.abs(boxes[:, 2:]) + 8
+    if integer:
+        boxes = np.round(boxes)
+    return boxes.astype(np.float32)
+
+
+def with_scores(boxes):
+    scores = np.linspace(1, 0, len(boxes), dtype=np.float32)
+    return torch.from_numpy(np.hstack((boxes, scores[:, np.newaxis])))
+
+
+@pytest.mark.parametrize('num_boxes', [1, 50, 300, 700])
+@pytest.mark.parametrize('thresh', [0.3, 0.7])
+@pytest.mark.parametrize('integer', [False, True])
+def test_blocked_nms_matches_greedy(num_boxes, thresh, integer):
+    boxes = clustered_boxes(num_boxes, num_boxes, integer)
+    keep = nms_cpu._nms_blocked(torch.from_numpy(boxes), thresh)
+    np.testing.assert_array_equal(keep.numpy(), greedy_nms(boxes, thresh))
+
+
+@pytest.mark.skipif(nms_cpu.cpu_nms is None, reason='cpu_nms extension not built')
+@pytest.mark.parametrize('thresh', [0.3, 0.7])
+def test_cython_nms_matches_greedy(thresh):
+    boxes = clustered_boxes(700, 7, integer=False)
+    keep = nms_cpu.cpu_nms(boxes, thresh)
+    np.testing.assert_array_equal(keep, greedy_nms(boxes, thresh))
+
+
+def test_nms_cpu_returns_int_column():
+    dets = with_scores(clustered_boxes(300, 3))
+    keep = nms_cpu.nms_cpu(dets, 0.7)
+    assert keep.dtype == torch.int32 and keep.dim() == 2 and keep.size(1) == 1
+    np.testing.assert_array_equal(keep.view(-1).numpy(),
+                                  greedy_nms(dets[:, :4].numpy(), 0.7))
+
+
+@pytest.mark.skipif(nms_gpu is None or not torch.cuda.is_available(),
+                    reason='needs the CUDA NMS extension and a GPU')
+@pytest.mark.parametrize('num_boxes', [300, 6000])
+def test_cpu_nms_matches_gpu_kernel(num_boxes):
+    # integer coordinates make every IoU exact up to the final division,
+    # so the kernel's fused arithmetic cannot round differently
+    dets = with_scores(clustered_boxes(num_boxes, 11, integer=True))
+    gpu_keep = nms_gpu(dets.cuda(), 0.7).view(-1).cpu()
+    assert torch.equal(nms_cpu._nms_blocked(dets[:, :4].contiguous(), 0.7),
+                       gpu_keep.long())
+    if nms_cpu.cpu_nms is not None:
+        cpu_keep = nms_cpu.cpu_nms(dets[:, :4].contiguous().numpy(), 0.7)
+        np.testing.assert_array_equal(cpu_keep, gpu_keep.numpy())
@@ -0,0 +1,89 @@
+import math
+
+import numpy as np
+import pytest
+import torch
+
+try:
+    from model.roi_align._ext import roi_align
+    from model.roi_align.functions.roi_align import RoIAlignFunction
+except ImportError:
+    roi_align = None
+
+pytestmark = pytest.mark.skipif(roi_align is None or not hasattr(roi_align, 'roi_align_forward'),
+                                reason='roi_align extension not built')
+
+
+def kernel_roi_align(aligned_height, aligned_width, spatial_scale, features, rois, grad_output):
+    """Output and feature gradient of ROIAlignForward/Backward in
+    roi_align_kernel.cu, one output element at a time in double precision."""
+    features = features.double().numpy()
+    grad_output = grad_output.double().numpy()
+    num_channels, height, width = features.shape[1:]
+    output = np.zeros((len(rois), num_channels, aligned_height, aligned_width))
+    grad_input = np.zeros(features.shape)
+    for n, roi in enumerate(rois.tolist()):
+        start_w, start_h, end_w, end_h = [v * spatial_scale for v in roi[1:]]
+        bin_size_h = max(end_h - start_h + 1, 0) / (aligned_height - 1.)
+        bin_size_w = max(end_w - start_w + 1, 0) / (aligned_width - 1.)
+        for ph in range(aligned_height):
+            for pw in range(aligned_width):
+                h = ph * bin_size_h + start_h
+                w = pw * bin_size_w + start_w
+                if h < 0 or h >= height or w < 0 or w >= width:
+                    continue
+                hstart = int(min(math.floor(h), height - 2))
+                wstart = int(min(math.floor(w), width - 2))
+                h_ratio, w_ratio = h - hstart, w - wstart
+                weights = np.array([[(1 - h_ratio) * (1 - w_ratio), (1 - h_ratio) * w_ratio],
+                                    [h_ratio * (1 - w_ratio), h_ratio * w_ratio]])
+                cell = (int(roi[0]), slice(None), slice(hstart, hstart + 2), slice(wstart, wstart + 2))
+                output[n, :, ph, pw] = (features[cell] * weights).sum((1, 2))
+                grad_input[cell] += grad_output[n, :, ph, pw].reshape(-1, 1, 1) * weights
+    return output, grad_input
+
+
+def random_rois(num_rois, batch_size, im_height, im_width, seed):
+    """(R, 5) rois over and around the image, some of them malformed."""
+    rng = np.random.RandomState(seed)
+    xy = rng.uniform([-40, -40], [im_width, im_height], (num_rois, 2))
+    wh = rng.uniform(-20, 200, (num_rois, 2))
+    rois = np.hstack((rng.randint(0, batch_size, (num_rois, 1)), xy, xy + wh))
+    # exactly the whole image, the last samples extrapolate
+    rois[0, 1:] = [0, 0, im_width - 16, im_height - 16]
+    return torch.from_numpy(rois.astype(np.float32))
+
+
+@pytest.mark.parametrize('aligned_height, aligned_width', [(7, 7), (4, 3)])
+def test_cpu_roi_align_matches_kernel(aligned_height, aligned_width):
+    torch.manual_seed(0)
+    features = torch.randn(2, 5, 9, 12)
+    rois = random_rois(20, 2, 9 * 16, 12 * 16, aligned_height)
+    function = RoIAlignFunction(aligned_height, aligned_width, 1. / 16)
+    output = function.forward(features, rois)
+    grad_output = torch.randn_like(output)
+    grad_input, _ = function.backward(grad_output)
+
+    expected_output, expected_grad = kernel_roi_align(aligned_height, aligned_width, 1. / 16,
+                                                      features, rois, grad_output)
+    np.testing.assert_allclose(output.numpy(), expected_output, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(grad_input.numpy(), expected_grad, rtol=1e-5, atol=1e-5)
+
+
+def test_cpu_roi_align_gradcheck():
+    class RoIAlignDouble(torch.autograd.Function):
+        # the float extension as a double function: the output is linear in
+        # the features, so large finite differences are exact
+        @staticmethod
+        def forward(ctx, features, rois):
+            ctx.function = RoIAlignFunction(4, 4, 1. / 16)
+            return ctx.function.forward(features.float(), rois.float()).double()
+
+        @staticmethod
+        def backward(ctx, grad_output):
+            return ctx.function.backward(grad_output.float())[0].double(), None
+
+    torch.manual_seed(1)
+    features = torch.randn(2, 3, 9, 12, dtype=torch.float64, requires_grad=True)
+    rois = random_rois(8, 2, 9 * 16, 12 * 16, 1).double()
+    assert torch.autograd.gradcheck(RoIAlignDouble.apply, (features, rois), eps=1e-1, atol=1e-4)
@@ -0,0 +1,113 @@
+import os
+import pickle
+import tarfile
+
+import numpy as np
+import pytest
+import scipy.sparse
+from PIL import Image
+
+import datasets.imdb
+import roi_data_layer.roidb as roidb_module
+from model.utils.config import cfg
+
+
+class ToyImdb(datasets.imdb.imdb):
+    """Two images with one box each, their gt roidb pickled in the cache
+    as the imdbs of datasets/ do."""
+
+    def __init__(self, image_dir):
+        datasets.imdb.imdb.__init__(self, 'toy_train', ('__background__', 'thing'))
+        self._image_dir = image_dir
+        self._image_index = ['000001', '000002']
+        self._roidb_handler = self.gt_roidb
+
+    def image_path_at(self, i):
+        return os.path.join(self._image_dir, self._image_index[i] + '.jpg')
+
+    def image_id_at(self, i):
+        return i
+
+    def gt_roidb(self):
+        with open(os.path.join(self.cache_path, self.name + '_gt_roidb.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+
+def write_gt_roidb(cache_path, x2):
+    roidb = [{'boxes': np.array([[1, 2, x2, 20]], dtype=np.uint16),
+              'gt_classes': np.array([1], dtype=np.int32),
+              'gt_overlaps': scipy.sparse.csr_matrix(np.array([[0, 1]], dtype=np.float32)),
+              'seg_areas': np.array([100], dtype=np.float32),
+              'flipped': False} for _ in range(2)]
+    with open(os.path.join(cache_path, 'toy_train_gt_roidb.pkl'), 'wb') as f:
+        pickle.dump(roidb, f, pickle.HIGHEST_PROTOCOL)
+
+
+@pytest.fixture
+def toy_data(tmpdir, monkeypatch):
+    data_dir = str(tmpdir)
+    cache_path = os.path.join(data_dir, 'cache')
+    os.makedirs(cache_path)
+    image_dir = os.path.join(data_dir, 'images')
+    os.makedirs(image_dir)
+    for name in ('000001', '000002'):
+        Image.new('RGB', (64, 48)).save(os.path.join(image_dir, name + '.jpg'))
+    write_gt_roidb(cache_path, 30)
+
+    built = []
+
+    def get_imdb(name):
+        built.append(name)
+        return ToyImdb(image_dir)
+
+    monkeypatch.setattr(roidb_module, 'get_imdb', get_imdb)
+    monkeypatch.setattr(cfg, 'DATA_DIR', data_dir)
+    monkeypatch.setattr(cfg.TRAIN, 'USE_FLIPPED', False)
+    monkeypatch.setattr(cfg, 'IMAGE_ARCHIVES', [])
+    monkeypatch.setattr(cfg, 'IMAGE_SIZE_WORKERS', 1)
+    return cache_path, built
+
+
+def test_columnar_roidb_is_rebuilt_when_the_gt_roidb_changes(toy_data):
+    cache_path, built = toy_data
+    roidb = roidb_module.combined_roidb('toy_train')[1]
+    assert roidb.boxes[:, 2].tolist() == [30, 30]
+    num_built = len(built)
+
+    # unchanged sources: the cached columns are loaded as they are
+    roidb = roidb_module.combined_roidb('toy_train')[1]
+    assert roidb.path is not None
+    assert roidb.boxes[:, 2].tolist() == [30, 30]
+
+    # new annotations: the columns are rebuilt from the new gt roidb
+    gt_roidb_file = os.path.join(cache_path, 'toy_train_gt_roidb.pkl')
+    mtime = os.path.getmtime(gt_roidb_file)
+    write_gt_roidb(cache_path, 40)
+    os.utime(gt_roidb_file, (mtime + 10, mtime + 10))
+    roidb = roidb_module.combined_roidb('toy_train')[1]
+    assert roidb.boxes[:, 2].tolist() == [40, 40]
+    assert len(built) > num_built
+
+
+def test_columnar_roidb_is_rebuilt_when_the_archives_change(toy_data, monkeypatch):
+    from datasets.archive import index_archive
+    cache_path, built = toy_data
+    image_dir = os.path.join(os.path.dirname(cache_path), 'images')
+    archive = os.path.join(os.path.dirname(cache_path), 'images.tar')
+
+    def pack(names):
+        with tarfile.open(archive, 'w') as tar:
+            for name in names:
+                tar.add(os.path.join(image_dir, name + '.jpg'), 'images/{}.jpg'.format(name))
+
+    pack(['000001', '000002'])
+    monkeypatch.setattr(cfg, 'IMAGE_ARCHIVES', [archive])
+    roidb = roidb_module.combined_roidb('toy_train')[1]
+    assert sorted(roidb.image.tolist()) == sorted(index_archive(archive).values())
+
+    # repacked in another order, the members move
+    mtime = os.path.getmtime(archive)
+    pack(['000002', '000001'])
+    os.utime(archive, (mtime + 10, mtime + 10))
+    roidb = roidb_module.combined_roidb('toy_train')[1]
+    assert sorted(roidb.image.tolist()) == sorted(index_archive(archive).values())
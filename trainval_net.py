@@ -22,10 +22,12 @@ import torch.nn as nn
 import torch.optim as optim
 
 import torchvision.transforms as transforms
-from torch.utils.data.sampler import Sampler
 
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
+from roi_data_layer.sampler import AspectRatioBatchSampler, PixelBudgetBatchSampler
+from datasets.archive import read_order
+from roi_data_layer.prefetcher import DataPrefetcher
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
 from model.utils.net_utils import weights_normal_init, save_net, load_net, \
       adjust_learning_rate, save_checkpoint, clip_gradient
@@ -56,7 +58,7 @@ def parse_args():
                       help='number of iterations to display',
                       default=100, type=int)
   parser.add_argument('--checkpoint_interval', dest='checkpoint_interval',
-                      help='number of iterations to display',
+                      help='number of iterations between mid-epoch checkpoints',
                       default=10000, type=int)
 
   parser.add_argument('--save_dir', dest='save_dir',
@@ -65,6 +67,19 @@ def parse_args():
   parser.add_argument('--nw', dest='num_workers',
                       help='number of worker to load data',
                       default=0, type=int)
+  parser.add_argument('--shards', dest='shard_dir',
+                      help='directory of image shards written by pack_images.py',
+                      default='', type=str)
+  parser.add_argument('--archives', dest='archives',
+                      help='comma separated tar/zip archives holding the images',
+                      default='', type=str)
+  parser.add_argument('--shuffle_buffer', dest='shuffle_buffer',
+                      help='draw archived images in archive order through a '
+                           'shuffle buffer of this many batches',
+                      default=0, type=int)
+  parser.add_argument('--uint8', dest='uint8_input',
+                      help='load uint8 images and normalize them on the device',
+                      action='store_true')
   parser.add_argument('--cuda', dest='cuda',
                       help='whether use CUDA',
                       action='store_true')
@@ -77,6 +92,9 @@ def parse_args():
   parser.add_argument('--bs', dest='batch_size',
                       help='batch_size',
                       default=1, type=int)
+  parser.add_argument('--mpix', dest='batch_mpix',
+                      help='fill multi-scale batches up to this many megapixels instead of --bs images',
+                      default=0, type=float)
   parser.add_argument('--cag', dest='class_agnostic',
                       help='whether perform class_agnostic bbox regression',
                       action='store_true')
@@ -122,31 +140,6 @@ def parse_args():
   return args
 
 
-class sampler(Sampler):
-  def __init__(self, train_size, batch_size):
-    self.num_data = train_size
-    self.num_per_batch = int(train_size / batch_size)
-    self.batch_size = batch_size
-    self.range = torch.arange(0,batch_size).view(1, batch_size).long()
-    self.leftover_flag = False
-    if train_size % batch_size:
-      self.leftover = torch.arange(self.num_per_batch*batch_size, train_size).long()
-      self.leftover_flag = True
-
-  def __iter__(self):
-    rand_num = torch.randperm(self.num_per_batch).view(-1,1) * self.batch_size
-    self.rand_num = rand_num.expand(self.num_per_batch, self.batch_size) + self.range
-
-    self.rand_num_view = self.rand_num.view(-1)
-
-    if self.leftover_flag:
-      self.rand_num_view = torch.cat((self.rand_num_view, self.leftover),0)
-
-    return iter(self.rand_num_view)
-
-  def __len__(self):
-    return self.num_data
-
 if __name__ == '__main__':
 
   args = parse_args()
@@ -201,6 +194,12 @@ if __name__ == '__main__':
   # -- Note: Use validation set and disable the flipped to enable faster loading.
   cfg.TRAIN.USE_FLIPPED = True
   cfg.USE_GPU_NMS = args.cuda
+  cfg.TRAIN.IMAGE_SHARD_DIR = args.shard_dir
+  cfg.UINT8_INPUT = args.uint8_input
+  cfg.IMAGE_ARCHIVES = [a for a in args.archives.split(',') if a]
+  cfg.TRAIN.SHUFFLE_BUFFER = args.shuffle_buffer
+  if args.batch_mpix > 0:
+    cfg.TRAIN.BATCH_PIXELS = int(args.batch_mpix * 1e6)
   imdb, roidb, ratio_list, ratio_index = combined_roidb(args.imdb_name)
   train_size = len(roidb)
 
@@ -210,34 +209,34 @@ if __name__ == '__main__':
   if not os.path.exists(output_dir):
     os.makedirs(output_dir)
 
-  sampler_batch = sampler(train_size, args.batch_size)
+  # archive position of the image at every ratio-sorted dataset position
+  read_keys = None
+  if cfg.IMAGE_ARCHIVES and cfg.TRAIN.SHUFFLE_BUFFER > 0:
+    read_keys = read_order([str(p) for p in roidb.image[ratio_index]])
+
+  if cfg.TRAIN.BATCH_PIXELS > 0:
+    sampler_batch = PixelBudgetBatchSampler(ratio_list, cfg.TRAIN.SCALES,
+                                            cfg.TRAIN.BATCH_PIXELS,
+                                            num_buckets=cfg.TRAIN.RATIO_BUCKETS,
+                                            seed=cfg.RNG_SEED, read_keys=read_keys,
+                                            buffer_size=cfg.TRAIN.SHUFFLE_BUFFER)
+  else:
+    sampler_batch = AspectRatioBatchSampler(train_size, args.batch_size,
+                                            seed=cfg.RNG_SEED, drop_last=True,
+                                            read_keys=read_keys,
+                                            buffer_size=cfg.TRAIN.SHUFFLE_BUFFER)
 
+  # batches collated in worker processes travel through shared memory,
+  # only pin them when they are built in this process.
   dataset = roibatchLoader(roidb, ratio_list, ratio_index, args.batch_size, \
-                           imdb.num_classes, training=True)
+                           imdb.num_classes, training=True,
+                           pin_memory=args.cuda and args.num_workers == 0)
   print("dataset", dataset)
 
-  dataloader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size,
-                            sampler=sampler_batch, num_workers=args.num_workers)
-
-  # initilize the tensor holder here.
-  im_data = torch.FloatTensor(1)
-  im_info = torch.FloatTensor(1)
-  num_boxes = torch.LongTensor(1)
-  gt_boxes = torch.FloatTensor(1)
-
-
-  # ship to cuda
-  if args.cuda:
-    im_data = im_data.cuda()
-    im_info = im_info.cuda()
-    num_boxes = num_boxes.cuda()
-    gt_boxes = gt_boxes.cuda()
-
-  # make variable
-  im_data = Variable(im_data)
-  im_info = Variable(im_info)
-  num_boxes = Variable(num_boxes)
-  gt_boxes = Variable(gt_boxes)
+  dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=sampler_batch,
+                            collate_fn=dataset.collate_fn, num_workers=args.num_workers)
+  # stages the next batches on the device while the current step runs
+  prefetcher = DataPrefetcher(dataloader, cuda=args.cuda)
 
   if args.cuda:
     cfg.CUDA = True
@@ -292,6 +291,9 @@ if __name__ == '__main__':
     lr = optimizer.param_groups[0]['lr']
     if 'pooling_mode' in checkpoint.keys():
       cfg.POOLING_MODE = checkpoint['pooling_mode']
+    if 'sampler' in checkpoint.keys():
+      # continue a mid-epoch checkpoint after its last consumed batch
+      sampler_batch.load_state_dict(checkpoint['sampler'])
     print("loaded checkpoint %s" % (load_name))
 
   if args.mGPUs:
@@ -300,26 +302,26 @@ if __name__ == '__main__':
   if args.cuda:
     fasterRCNN.cuda()
 
-  iters_per_epoch = int(train_size / args.batch_size)
-
   for epoch in range(args.start_epoch, args.max_epochs):
     # setting to train mode
     fasterRCNN.train()
     loss_temp = 0
     start = time.time()
 
-    if epoch % (args.lr_decay_step + 1) == 0:
+    sampler_batch.set_epoch(epoch)
+    first_step = sampler_batch.start
+    # the number of pixel-budget batches changes from epoch to epoch
+    iters_per_epoch = len(sampler_batch)
+
+    # a resumed mid-epoch checkpoint already carries this epoch's decay
+    if epoch % (args.lr_decay_step + 1) == 0 and first_step == 0:
         adjust_learning_rate(optimizer, args.lr_decay_gamma)
         lr *= args.lr_decay_gamma
     
     print('len:', len(dataloader))
-    data_iter = iter(dataloader)
-    for step in range(iters_per_epoch):
-      data = next(data_iter)
-      im_data.data.resize_(data[0].size()).copy_(data[0])
-      im_info.data.resize_(data[1].size()).copy_(data[1])
-      gt_boxes.data.resize_(data[2].size()).copy_(data[2])
-      num_boxes.data.resize_(data[3].size()).copy_(data[3])
+    data_iter = iter(prefetcher)
+    for step in range(first_step, iters_per_epoch):
+      im_data, im_info, gt_boxes, num_boxes = next(data_iter)
 
       fasterRCNN.zero_grad()
       rois, cls_prob, bbox_pred, \
@@ -377,6 +379,22 @@ if __name__ == '__main__':
         loss_temp = 0
         start = time.time()
 
+      if (step + 1) % args.checkpoint_interval == 0 and step + 1 < iters_per_epoch:
+        save_name = os.path.join(output_dir, 'faster_rcnn_{}_{}_{}.pth'.format(args.session, epoch, step))
+        save_checkpoint({
+          'session': args.session,
+          'epoch': epoch,
+          'model': fasterRCNN.module.state_dict() if args.mGPUs else fasterRCNN.state_dict(),
+          'optimizer': optimizer.state_dict(),
+          'pooling_mode': cfg.POOLING_MODE,
+          'class_agnostic': args.class_agnostic,
+          'sampler': sampler_batch.state_dict(step + 1),
+        }, save_name)
+        print('save model: {}'.format(save_name))
+
+    # the sampler may hold more batches than the epoch consumes
+    data_iter.close()
+
     if args.mGPUs:
       save_name = os.path.join(output_dir, 'faster_rcnn_{}_{}_{}.pth'.format(args.session, epoch, step))
       save_checkpoint({